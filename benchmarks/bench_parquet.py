@@ -0,0 +1,97 @@
+"""Compares the JSON output path with the Parquet sink on synthetic opportunities.
+
+    python benchmarks/bench_parquet.py [records]
+
+The JSON path is what every page goes through by default: the singer
+transformer followed by serializing one RECORD message per row. The Parquet
+path converts the same pages column by column and writes them to a
+temporary directory.
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+
+import singer
+import singer.utils
+
+from tap_lever.parquet import ParquetSink
+
+PAGE_SIZE = 100
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), '..',
+                           'tap_lever', 'schemas', 'opportunities.json')
+
+
+def make_page(start):
+    now = 1600000000000
+    return [{
+        'id': 'opp-{}'.format(i),
+        'name': 'Candidate {}'.format(i),
+        'headline': 'Engineer',
+        'contact': 'contact-{}'.format(i),
+        'stage': 'lead-new',
+        'stageChanges': [{'toStageId': 'lead-new', 'toStageIndex': 0,
+                          'updatedAt': now + i, 'userId': 'user-1'}],
+        'location': 'Berlin',
+        'phones': [{'type': 'mobile', 'value': '555-0100'}],
+        'emails': ['candidate{}@example.com'.format(i)],
+        'links': [],
+        'archived': None,
+        'tags': ['python', 'remote'],
+        'sources': ['Referral'],
+        'origin': 'referred',
+        'owner': 'user-1',
+        'followers': ['user-1', 'user-2'],
+        'applications': ['app-{}'.format(i)],
+        'createdAt': now + i,
+        'lastInteractionAt': now + 2 * i,
+        'lastAdvancedAt': now + 3 * i,
+        'snoozedUntil': None,
+        'urls': {'list': 'https://hire.lever.co/candidates',
+                 'show': 'https://hire.lever.co/candidates/{}'.format(i)},
+        'dataProtection': None,
+        'isAnonymized': False,
+    } for i in range(start, start + PAGE_SIZE)]
+
+
+def bench_json(pages, schema):
+    transformer = singer.Transformer(singer.UNIX_MILLISECONDS_INTEGER_DATETIME_PARSING)
+    out = io.StringIO()
+    started = time.perf_counter()
+    for page in pages:
+        for record in page:
+            message = singer.RecordMessage('opportunities', transformer.transform(record, schema))
+            out.write(singer.format_message(message))
+            out.write('\n')
+    return time.perf_counter() - started, out.tell()
+
+
+def bench_parquet(pages, schema):
+    with tempfile.TemporaryDirectory() as parquet_dir:
+        sink = ParquetSink({'parquet_dir': parquet_dir})
+        started = time.perf_counter()
+        sink.set_schema('opportunities', schema)
+        for page in pages:
+            sink.write_records('opportunities', page)
+        sink.commit()
+        elapsed = time.perf_counter() - started
+
+        size = sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(parquet_dir) for name in names)
+    return elapsed, size
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    schema = singer.utils.load_json(SCHEMA_PATH)
+    pages = [make_page(start) for start in range(0, records, PAGE_SIZE)]
+
+    for name, bench in (('json', bench_json), ('parquet', bench_parquet)):
+        elapsed, size = bench(pages, schema)
+        print('{:<8} {:>8.2f}s {:>10.0f} records/s {:>10.1f} MB'.format(
+            name, elapsed, records / elapsed, size / 1024 / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""Measures how the transform pool scales with worker processes.
+
+    python benchmarks/bench_transform.py [records]
+
+Pages of synthetic opportunities are transformed in this process, as
+without `transform_workers`, and then through pools of 1, 2, 4, ... workers
+up to the number of cores, with the results collected in page order like
+the streams do.
+"""
+import os
+import sys
+import time
+
+import singer
+import singer.utils
+from singer.catalog import CatalogEntry, Schema
+
+from bench_parquet import PAGE_SIZE, SCHEMA_PATH, make_page
+from tap_lever import transform
+
+
+def get_projection():
+    entry = CatalogEntry(stream='opportunities',
+                         schema=Schema.from_dict(singer.utils.load_json(SCHEMA_PATH)),
+                         metadata=[])
+    return transform.build_projection(entry)
+
+
+def bench_serial(pages, projection):
+    transformer = singer.Transformer(singer.UNIX_MILLISECONDS_INTEGER_DATETIME_PARSING)
+    started = time.perf_counter()
+    for page in pages:
+        transform.transform_records(page['data'], projection, transformer)
+    return time.perf_counter() - started
+
+
+def bench_pool(pages, projection, workers):
+    pool = transform.TransformPool(workers, {'opportunities': projection})
+    try:
+        # Start the workers before timing
+        list(pool.map_pages('opportunities', pages[:workers], lambda records: None,
+                            singer.Transformer()))
+
+        transformer = singer.Transformer(singer.UNIX_MILLISECONDS_INTEGER_DATETIME_PARSING)
+        started = time.perf_counter()
+        for _ in pool.map_pages('opportunities', pages, lambda records: None, transformer):
+            pass
+        return time.perf_counter() - started
+    finally:
+        pool.shutdown()
+
+
+def main():
+    records = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    projection = get_projection()
+    pages = [{'data': make_page(start)} for start in range(0, records, PAGE_SIZE)]
+
+    elapsed = bench_serial(pages, projection)
+    print('{:<10} {:>8.2f}s {:>10.0f} records/s'.format('serial', elapsed, records / elapsed))
+
+    workers = 1
+    while workers <= (os.cpu_count() or 1):
+        elapsed = bench_pool(pages, projection, workers)
+        print('{:<10} {:>8.2f}s {:>10.0f} records/s'.format(
+            '{} worker{}'.format(workers, 's' if workers > 1 else ''), elapsed, records / elapsed))
+        workers *= 2
+
+
+if __name__ == '__main__':
+    main()
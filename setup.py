@@ -18,6 +18,12 @@ setup(name='tap-lever',
         "dev": [
           "nose",
         ],
+        "parquet": [
+          "pyarrow",
+        ],
+        "duckdb": [
+          "duckdb",
+        ],
       },
       entry_points='''
           [console_scripts]
@@ -0,0 +1,72 @@
+import contextvars
+import hashlib
+
+import requests
+import singer
+
+from tap_lever import client
+
+LOGGER = singer.get_logger()  # noqa
+
+ACCOUNT_FIELD = '_sdc_account_id'
+
+# The account the current thread is syncing for, None outside of
+# multi-account mode. Module level registries (the stream cache, retry
+# queue, shared state, downloaders, budgets, tuning profiles and empty
+# parent cache) are dicts keyed by this id.
+CURRENT = contextvars.ContextVar('lever_account', default=None)
+
+
+def current():
+    return CURRENT.get()
+
+
+def run_as(account_id, func, *args):
+    """Runs `func` in a fresh context bound to the account. Threads started
+    from there carry the account along by copying the context."""
+    def bound():
+        CURRENT.set(account_id)
+        return func(*args)
+
+    return contextvars.copy_context().run(bound)
+
+
+def get_account_id(entry):
+    if entry.get('account_id'):
+        return str(entry['account_id'])
+    # Never put the token itself in state or records
+    return hashlib.sha256(entry['token'].encode('utf-8')).hexdigest()[:12]
+
+
+def build_session(pool_size):
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+class Account:
+    """One Lever account of a multi-account sync.
+
+    Each account gets its own config (the shared config with the entry's
+    `token`, `start_date` and any other keys on top), its own client and
+    rate limiter. Its slice of the state document is kept by
+    tap_lever.state under the account id.
+    """
+
+    def __init__(self, entry, config, session):
+        self.id = get_account_id(entry)
+        self.config = dict(config, **entry)
+        self.config.pop('accounts', None)
+        self.client = client.LeverClient(self.config, session=session)
+
+
+def get_accounts(config, session):
+    accounts = [Account(entry, config, session) for entry in config['accounts']]
+
+    ids = [account.id for account in accounts]
+    if len(set(ids)) != len(ids):
+        raise RuntimeError('Account ids must be unique: {}'.format(', '.join(ids)))
+
+    return accounts
@@ -0,0 +1,136 @@
+import copy
+import threading
+
+from types import SimpleNamespace
+
+import singer
+from singer.catalog import Catalog
+
+from tap_lever import deadline
+from tap_lever.client import LeverClient
+from tap_lever.config import check_config
+from tap_lever.record_queue import Record, RecordQueue
+from tap_lever.runner import LeverRunner
+from tap_lever.streams import AVAILABLE_STREAMS
+from tap_lever.streams.base import is_stream_selected
+
+LOGGER = singer.get_logger()  # noqa
+
+__all__ = ['LeverTap', 'Record']
+
+
+def get_stream_class(name):
+    for stream_class in AVAILABLE_STREAMS:
+        if stream_class.TABLE == name:
+            return stream_class
+    raise ValueError('Unknown stream {}'.format(name))
+
+
+def with_requirements(streams):
+    # Children can only be synced along with the parents they read from
+    selected = set()
+    pending = list(streams)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(get_stream_class(name).get_requirements())
+    return selected
+
+
+def select_streams(catalog, streams):
+    for entry in catalog.streams:
+        mdata = singer.metadata.to_map(entry.metadata)
+        mdata = singer.metadata.write(mdata, (), 'selected', entry.stream in streams)
+        entry.metadata = singer.metadata.to_list(mdata)
+    return catalog
+
+
+class LeverTap:
+    """The tap as a library, for services that want Lever data without
+    running the tap and parsing its output.
+
+    `discover`, `plan` and `sync` do what the command line does. `records`
+    syncs streams and yields their records as `Record`s, transformed against
+    the stream schemas but never serialized. `state` always holds the state
+    covering the records handed out so far, to pass to the next `LeverTap`.
+
+    Output, deadlines and tracing are process wide, so one sync runs at a
+    time per process, as with the command line.
+    """
+
+    def __init__(self, config, state=None, catalog=None, client=None):
+        check_config(config)
+        self.config = config
+        self.state = copy.deepcopy(state or {})
+        self.catalog = catalog
+        self.client = client or LeverClient(config)
+
+    def get_runner(self, catalog=None):
+        args = SimpleNamespace(config=self.config,
+                               state=copy.deepcopy(self.state),
+                               catalog=catalog or self.catalog)
+        return LeverRunner(args, self.client, AVAILABLE_STREAMS)
+
+    def discover(self):
+        return self.get_runner().discover()
+
+    def plan(self):
+        return self.get_runner().plan()
+
+    def sync(self):
+        """Syncs the streams selected in the catalog, writing Singer
+        messages to stdout."""
+        runner = self.get_runner()
+        runner.do_sync()
+        self.state = runner.state
+
+    def get_catalog(self, streams):
+        catalog = Catalog.from_dict(self.discover())
+        return select_streams(catalog, with_requirements(streams))
+
+    def records(self, streams=None, buffer_size=100):
+        """Yields the records of `streams`, or of the streams selected in the
+        catalog, as they are synced.
+
+        The sync runs on a background thread and waits while `buffer_size`
+        pages are queued up unread. Streams that are only synced because the
+        requested ones need them aren't yielded. Stopping early stops the
+        sync at its next checkpoint, and `state` then covers exactly the
+        records that were read.
+        """
+        if streams is None:
+            catalog = self.catalog
+            streams = [entry.stream for entry in catalog.streams if is_stream_selected(entry)]
+        else:
+            if isinstance(streams, str):
+                streams = [streams]
+            catalog = self.get_catalog(streams)
+
+        runner = self.get_runner(catalog)
+        writer = RecordQueue(streams, buffer_size)
+        thread = threading.Thread(target=self.run, args=(runner, writer), name='lever-sync')
+        thread.start()
+
+        try:
+            for item in writer:
+                if item[0] == 'state':
+                    self.state = item[1]
+                    continue
+
+                _, stream, records = item
+                for record in records:
+                    yield Record(stream, record)
+        finally:
+            if not writer.done:
+                deadline.request_stop('Records are no longer read')
+                writer.close()
+            thread.join()
+
+    def run(self, runner, writer):
+        try:
+            runner.do_sync(writer)
+        except Exception as ex:  # pylint: disable=broad-except
+            writer.finish(ex)
+            return
+        writer.finish()
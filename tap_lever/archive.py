@@ -0,0 +1,74 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+from urllib.parse import urlsplit
+
+import singer
+
+from tap_lever import accounts, budget
+
+LOGGER = singer.get_logger()  # noqa
+
+NO_STREAM = '_'
+
+
+class MissingResponseError(Exception):
+    pass
+
+
+def get_key(method, url, params=None, body=None):
+    # The host is left out so an archive can be replayed against any
+    # base_url, and params are normalized so their order doesn't matter
+    request = {
+        'method': method,
+        'path': urlsplit(url).path,
+        'params': {key: str(value) for key, value in (params or {}).items()},
+        'body': body,
+    }
+    return hashlib.sha256(json.dumps(request, sort_keys=True).encode('utf-8')).hexdigest(), request
+
+
+class ResponseArchive:
+    """Raw API responses stored on disk, one gzipped JSON file per request.
+
+    Files are kept under `<dir>/<account>/<stream>/<key[:2]>/<key>.json.gz`,
+    where the stream is the one whose sync sent the request (opportunity
+    children are archived with `opportunities`) and the key is a hash of the
+    method, path, params and body. Each file holds the request alongside the
+    response so an archive can be inspected by hand.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+
+    def get_path(self, key):
+        parts = [self.directory]
+        if accounts.current() is not None:
+            parts.append(accounts.current())
+        parts.extend([budget.TABLE.get() or NO_STREAM, key[:2], '{}.json.gz'.format(key)])
+        return os.path.join(*parts)
+
+    def save(self, method, url, params, body, response):
+        key, request = get_key(method, url, params, body)
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Written next to its final path and moved into place, so an
+        # interrupted run never leaves a truncated response behind
+        handle, partial_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        with os.fdopen(handle, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as compressed:
+            compressed.write(json.dumps({'request': request, 'response': response}).encode('utf-8'))
+        os.replace(partial_path, path)
+
+    def load(self, method, url, params, body):
+        key, _ = get_key(method, url, params, body)
+        path = self.get_path(key)
+
+        if not os.path.exists(path):
+            return None
+
+        with gzip.open(path, 'rb') as compressed:
+            return json.loads(compressed.read().decode('utf-8'))['response']
@@ -0,0 +1,144 @@
+import copy
+import gzip
+import json
+import os
+import time
+import uuid
+
+import singer
+
+LOGGER = singer.get_logger()  # noqa
+
+DEFAULT_MAX_RECORDS = 100000
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+DEFAULT_COMMIT_INTERVAL = 300
+
+
+def new_run_id():
+    # Starts with the time in milliseconds so files sort by run, and ends
+    # with a random part so runs started together never share file names
+    return '{}-{}'.format(int(time.time() * 1000), uuid.uuid4().hex[:8])
+
+
+class BatchMessage(singer.Message):
+    '''BATCH message.
+
+    References one or more finalized files holding the records of a stream,
+    so the target can load them directly instead of reading RECORD lines.
+    '''
+
+    def __init__(self, stream, manifest, encoding=None):
+        self.stream = stream
+        self.manifest = manifest
+        self.encoding = encoding or {'format': 'jsonl', 'compression': 'gzip'}
+
+    def asdict(self):
+        return {
+            'type': 'BATCH',
+            'stream': self.stream,
+            'encoding': self.encoding,
+            'manifest': self.manifest,
+        }
+
+
+class BatchFile:
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = path + '.part'
+        self.handle = gzip.open(self.tmp_path, 'wt', encoding='utf-8')
+        self.opened_at = time.monotonic()
+        self.records = 0
+        self.bytes = 0
+
+    def write(self, record):
+        line = json.dumps(record, default=str) + '\n'
+        self.handle.write(line)
+        self.records += 1
+        self.bytes += len(line)
+
+    def finalize(self):
+        self.handle.close()
+        os.replace(self.tmp_path, self.path)
+        return self.path
+
+
+class BatchWriter:
+    """Writes the records of each stream to rotating batch files.
+
+    Files are only finalized once full, so a STATE is held back while files
+    holding rows it covers are open and emitted right after the last of
+    them is finalized. To keep state from lagging behind on a slow stream,
+    every open file is finalized once the oldest has been open for
+    `commit_interval` seconds, and at the end of the run.
+    """
+
+    def __init__(self, config):
+        self.batch_dir = os.path.abspath(config.get('batch_dir', 'batches'))
+        self.max_records = int(config.get('batch_max_records', DEFAULT_MAX_RECORDS))
+        self.max_bytes = int(config.get('batch_max_bytes', DEFAULT_MAX_BYTES))
+        self.commit_interval = float(config.get('batch_commit_interval', DEFAULT_COMMIT_INTERVAL))
+        self.run_id = new_run_id()
+        self.open_files = {}
+        self.sequence = {}
+        # The latest state held back, and the files it waits for
+        self.pending_state = None
+        self.pending_files = set()
+
+        os.makedirs(self.batch_dir, exist_ok=True)
+
+    def next_path(self, stream):
+        seq = self.sequence.get(stream, 0) + 1
+        self.sequence[stream] = seq
+        return os.path.join(
+            self.batch_dir,
+            '{}-{}-{:05d}.jsonl.gz'.format(stream, self.run_id, seq))
+
+    def write_records(self, stream, records):
+        for record in records:
+            batch_file = self.open_files.get(stream)
+            if batch_file is None:
+                batch_file = BatchFile(self.next_path(stream))
+                self.open_files[stream] = batch_file
+
+            batch_file.write(record)
+
+            if batch_file.records >= self.max_records or \
+               batch_file.bytes >= self.max_bytes:
+                self.finalize(stream)
+
+    def finalize(self, stream):
+        batch_file = self.open_files.pop(stream, None)
+        if batch_file is None:
+            return
+
+        path = batch_file.finalize()
+        LOGGER.info('Finalized batch file {} with {} records'
+                    .format(path, batch_file.records))
+        singer.write_message(BatchMessage(stream, ['file://' + path]))
+
+        self.pending_files.discard(batch_file)
+        if self.pending_state is not None and not self.pending_files:
+            state, self.pending_state = self.pending_state, None
+            singer.write_state(state)
+
+    def checkpoint(self, state):
+        """Returns the state to emit now, or None while files holding rows
+        it covers are open, in which case it is emitted once they are
+        finalized."""
+        if not self.open_files:
+            self.pending_state = None
+            return state
+
+        # Streams go on updating their bookmarks in place
+        self.pending_state = copy.deepcopy(state)
+        self.pending_files = set(self.open_files.values())
+
+        oldest = min(batch_file.opened_at for batch_file in self.open_files.values())
+        if time.monotonic() - oldest >= self.commit_interval:
+            self.commit()
+        return None
+
+    def commit(self):
+        for stream in list(self.open_files):
+            self.finalize(stream)
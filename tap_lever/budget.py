@@ -0,0 +1,189 @@
+import collections
+import contextlib
+import contextvars
+import threading
+import time
+
+import singer
+
+from tap_lever import accounts
+
+LOGGER = singer.get_logger()  # noqa
+
+STATE_KEY = 'request_budget'
+HOUR = 60 * 60
+
+BUDGETS = {}
+
+# The stream whose sync the current thread is running, and the child stream
+# fetched inline whose requests are being sent, if any. Requests are charged
+# to the child stream when set.
+TABLE = contextvars.ContextVar('lever_budget_table', default=None)
+CHILD_TABLE = contextvars.ContextVar('lever_budget_child_table', default=None)
+
+
+def configure(state, config, tables):
+    if not (config.get('request_budget') or config.get('request_budget_per_hour')):
+        BUDGETS.pop(accounts.current(), None)
+        return
+
+    budget = RequestBudget(config.get('request_budget'),
+                           config.get('request_budget_per_hour'),
+                           config.get('stream_weights') or {},
+                           tables,
+                           state.get(STATE_KEY))
+    LOGGER.info('Request budget: {}'.format(budget.describe()))
+    BUDGETS[accounts.current()] = budget
+
+
+def get_budget():
+    return BUDGETS.get(accounts.current())
+
+
+def charge():
+    budget = get_budget()
+    if budget is not None:
+        budget.charge(CHILD_TABLE.get() or TABLE.get())
+
+
+def allows(table):
+    budget = get_budget()
+    return budget is None or budget.allows(table)
+
+
+@contextlib.contextmanager
+def charging(table, inline_tables=()):
+    """Counts the requests sent in the block towards `table`, which is
+    finished when the block ends and leaves what it didn't spend to the
+    streams still running. The `inline_tables` of children fetched during
+    the block are finished with it."""
+    token = TABLE.set(table)
+    try:
+        yield
+    finally:
+        TABLE.reset(token)
+        budget = get_budget()
+        if budget is not None:
+            for finished in [table, *inline_tables]:
+                budget.finish(finished)
+
+
+@contextlib.contextmanager
+def charging_child(table):
+    """Counts the requests sent in the block towards `table`, a child
+    stream fetched inline by the stream being synced."""
+    token = CHILD_TABLE.set(table)
+    try:
+        yield
+    finally:
+        CHILD_TABLE.reset(token)
+
+
+def attach(state):
+    # Only the hourly allowance outlives the run
+    budget = get_budget()
+    if budget is None or budget.per_hour is None:
+        return state
+
+    state[STATE_KEY] = budget.dump()
+    return state
+
+
+class RequestBudget:
+    """Shares a number of requests between the streams of a sync.
+
+    The allowance is what is left of `request_budget` for the run or of
+    `request_budget_per_hour` for the current hour, whichever is smaller.
+    Each stream is entitled to a part of it by its weight, so streams that
+    come first don't starve the ones after them. Once a stream finishes,
+    what it didn't spend is shared out between the streams still running.
+    A stream that has spent its part stops at its next checkpoint and
+    continues from its bookmark in the next run.
+    """
+
+    def __init__(self, per_run, per_hour, weights, tables, saved=None):
+        self.per_run = int(per_run) if per_run else None
+        self.per_hour = int(per_hour) if per_hour else None
+        self.weights = {table: float(weights.get(table, 1)) for table in tables}
+        self.lock = threading.Lock()
+        self.run_spent = 0
+        self.hour_started = None
+        self.hour_spent = 0
+        self.spent = collections.Counter()
+        self.finished = set()
+        self.exhausted = set()
+
+        if self.per_hour is not None and saved:
+            self.hour_started = saved.get('hour_started')
+            self.hour_spent = saved.get('spent', 0)
+        self.roll_hour(time.time())
+
+    def describe(self):
+        limits = []
+        if self.per_run is not None:
+            limits.append('{} requests this run'.format(self.per_run))
+        if self.per_hour is not None:
+            limits.append('{} of {} requests left this hour'.format(
+                self.per_hour - self.hour_spent, self.per_hour))
+        return ', '.join(limits)
+
+    def roll_hour(self, now):
+        if self.per_hour is None:
+            return
+        if self.hour_started is None or now - self.hour_started >= HOUR:
+            self.hour_started = now
+            self.hour_spent = 0
+            # A new hour is a new allowance to share out
+            self.spent.clear()
+            self.exhausted.clear()
+
+    def available(self):
+        left = []
+        if self.per_run is not None:
+            left.append(self.per_run - self.run_spent)
+        if self.per_hour is not None:
+            left.append(self.per_hour - self.hour_spent)
+        return max(min(left), 0)
+
+    def share(self, table):
+        running = [other for other in self.weights if other not in self.finished]
+        if table not in running:
+            return 0
+
+        # What the streams still running have spent plus what is left,
+        # split by weight
+        allowance = self.available() + sum(self.spent[other] for other in running)
+        weight = sum(self.weights[other] for other in running)
+        return allowance * self.weights[table] / weight if weight else 0
+
+    def charge(self, table):
+        with self.lock:
+            self.roll_hour(time.time())
+            self.run_spent += 1
+            self.hour_spent += 1
+            if table is not None:
+                self.spent[table] += 1
+
+    def allows(self, table):
+        with self.lock:
+            self.roll_hour(time.time())
+            if self.available() < 1:
+                allowed = False
+            elif table not in self.weights:
+                allowed = True
+            else:
+                allowed = self.spent[table] < self.share(table)
+
+            if not allowed and table not in self.exhausted:
+                self.exhausted.add(table)
+                LOGGER.warning('%s has spent its share of the request budget (%s requests), '
+                               'checkpointing for the next run', table, self.spent[table])
+            return allowed
+
+    def finish(self, table):
+        with self.lock:
+            self.finished.add(table)
+
+    def dump(self):
+        with self.lock:
+            return {'hour_started': self.hour_started, 'spent': self.hour_spent}
@@ -1,12 +1,32 @@
+import contextlib
+import contextvars
+import time
+
+from concurrent import futures
+
 import backoff
 import requests
 import singer
 import singer.metrics
 
-from requests.exceptions import ConnectionError
+from requests.exceptions import ConnectionError, Timeout
+
+from tap_lever import archive, budget, tracing
+from tap_lever.latency import LatencyTracker, get_endpoint, is_child_endpoint
+from tap_lever.ratelimit import RateLimiter, RequestRate
 
 LOGGER = singer.get_logger()  # noqa
 
+# Used until an endpoint has enough latency samples, and the upper bound of
+# every adaptive timeout
+DEFAULT_TIMEOUT = 300
+MIN_TIMEOUT = 5
+TIMEOUT_MULTIPLIER = 4
+DEFAULT_HEDGE_WORKERS = 16
+
+# Set while requests that aren't part of a sync are sent, see unrecorded
+UNRECORDED = contextvars.ContextVar('lever_unrecorded', default=False)
+
 
 class Server5xxError(Exception):
     pass
@@ -20,12 +40,122 @@ class OffsetInvalidException(Exception):
     pass
 
 
+class ServerAuthError(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def unrecorded():
+    """Requests sent in the block are neither charged to the request budget
+    nor archived, like the samples of a sync plan."""
+    token = UNRECORDED.set(True)
+    try:
+        yield
+    finally:
+        UNRECORDED.reset(token)
+
+
 class LeverClient:
 
     MAX_TRIES = 5
 
-    def __init__(self, config):
+    def __init__(self, config, session=None):
         self.config = config
+        self.rate_limiter = None
+        # A requests.Session shared by several clients pools their
+        # connections; without one every request uses requests.request
+        self.session = session
+
+        # Shared by every stream using this client, so concurrent streams
+        # stay within one account-wide allowance.
+        if config.get("max_requests_per_second"):
+            self.rate_limiter = RateLimiter(float(config["max_requests_per_second"]))
+
+        self.request_timeout = float(config.get("request_timeout", DEFAULT_TIMEOUT))
+        self.latency = LatencyTracker()
+        self.request_rate = RequestRate()
+        self.hedge_requests = bool(config.get("hedge_requests"))
+        self.hedge_executor = None
+
+        self.archive = None
+        self.replay = None
+        if config.get("archive_dir"):
+            self.archive = archive.ResponseArchive(config["archive_dir"])
+        if config.get("replay_dir"):
+            LOGGER.info("Replaying responses from {}, no requests will be sent".format(config["replay_dir"]))
+            self.replay = archive.ResponseArchive(config["replay_dir"])
+
+    def get_timeout(self, endpoint):
+        # A few times the endpoint's p99, so a stuck connection is given up on
+        # long before the configured ceiling without cutting off slow pages.
+        p99 = self.latency.percentile(endpoint, 99)
+        if p99 is None:
+            return self.request_timeout
+        return min(self.request_timeout, max(MIN_TIMEOUT, p99 * TIMEOUT_MULTIPLIER))
+
+    def send(self, endpoint, method, url, params=None, body=None):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire()
+        if not UNRECORDED.get():
+            budget.charge()
+
+        timeout = self.get_timeout(endpoint)
+        started = time.monotonic()
+        status = None
+        try:
+            with tracing.span("http", endpoint=endpoint, timeout=timeout) as span:
+                response = (self.session or requests).request(
+                    method,
+                    url,
+                    headers={"Content-Type": "application/json"},
+                    auth=(self.config["token"], ""),
+                    params=params,
+                    json=body,
+                    timeout=timeout,
+                )
+                status = span["status"] = response.status_code
+        except Timeout:
+            # Counts as at least this slow, so timeouts widen rather than
+            # keep tripping
+            self.latency.observe(endpoint, timeout)
+            raise
+        finally:
+            self.request_rate.record(status)
+
+        self.latency.observe(endpoint, time.monotonic() - started)
+        return response
+
+    def send_hedged(self, endpoint, method, url, params=None):
+        """Sends a second copy of a GET that hasn't returned after the
+        endpoint's p95 and takes whichever response comes first."""
+        delay = self.latency.percentile(endpoint, 95)
+        if delay is None:
+            return self.send(endpoint, method, url, params)
+
+        if self.hedge_executor is None:
+            self.hedge_executor = futures.ThreadPoolExecutor(
+                max_workers=int(self.config.get("hedge_workers", DEFAULT_HEDGE_WORKERS)),
+                thread_name_prefix="hedged-request")
+
+        # The copied context keeps the requests in the caller's trace span
+        first = self.hedge_executor.submit(contextvars.copy_context().run,
+                                           self.send, endpoint, method, url, params)
+        try:
+            return first.result(timeout=delay)
+        except futures.TimeoutError:
+            pass
+
+        LOGGER.info("No response from {} after {:.2f}s, sending a hedged request".format(url, delay))
+        second = self.hedge_executor.submit(contextvars.copy_context().run,
+                                            self.send, endpoint, method, url, params)
+
+        error = None
+        for future in futures.as_completed([first, second]):
+            try:
+                return future.result()
+            except Exception as ex:  # pylint: disable=broad-except
+                error = ex
+        raise error
 
     # 429 Too Many Requests: Apply backoff strategy to handle rate limiting.
     # Lever API uses a token bucket algorithm to enforce rate limits, capping requests per second.
@@ -33,21 +163,24 @@ class LeverClient:
     # Reference: https://hire.lever.co/developer/documentation#rate-limits
     @backoff.on_exception(
         backoff.expo,
-        (Server5xxError, Server429Error, ConnectionError),
+        (Server5xxError, Server429Error, ConnectionError, Timeout),
         max_tries=MAX_TRIES,
         factor=2,
     )
     def make_request(self, url, method, params=None, body=None):
+        if self.replay is not None:
+            return self.replay_request(url, method, params, body)
+
         LOGGER.info("Making {} request to {} ({})".format(method, url, params))
 
-        response = requests.request(
-            method,
-            url,
-            headers={"Content-Type": "application/json"},
-            auth=(self.config["token"], ""),
-            params=params,
-            json=body,
-        )
+        endpoint = get_endpoint(url)
+        with tracing.span("make_request", method=method, endpoint=endpoint):
+            # Only GETs for a single parent are hedged: they are idempotent
+            # and make up most of the requests of a sync
+            if self.hedge_requests and method == "GET" and body is None and is_child_endpoint(endpoint):
+                response = self.send_hedged(endpoint, method, url, params)
+            else:
+                response = self.send(endpoint, method, url, params, body)
 
         try:
             response_json = response.json()
@@ -65,8 +198,61 @@ class LeverClient:
             raise Server5xxError(msg)
         elif response.status_code == 429:
             raise Server429Error('Rate limit exceeded')
+        elif response.status_code in (401, 403):
+            # The token lacks access, which no retry or later run will fix
+            raise ServerAuthError(response.text)
         elif response.status_code != 200:
             raise RuntimeError(response.text)
 
+        if self.archive is not None and not UNRECORDED.get():
+            self.archive.save(method, url, params, body, response_json)
+
+        return response_json
+
+    def replay_request(self, url, method, params=None, body=None):
+        with tracing.span("replay_request", method=method, endpoint=get_endpoint(url)):
+            response_json = self.replay.load(method, url, params, body)
+
+        if response_json is None:
+            # A window or parent the archived run never asked for. Not a
+            # child error, so the sync stops with its bookmarks where the
+            # archive ends instead of completing what it doesn't cover.
+            raise archive.MissingResponseError(
+                "No archived response for {} {} ({}), the archive ends here"
+                .format(method, url, params))
+
         return response_json
 
+    @backoff.on_exception(
+        backoff.expo,
+        (Server5xxError, Server429Error, ConnectionError, Timeout),
+        max_tries=MAX_TRIES,
+        factor=2,
+    )
+    def stream_request(self, url, headers=None):
+        if self.replay is not None:
+            raise RuntimeError("Files aren't archived, {} can't be replayed".format(url))
+
+        LOGGER.info("Streaming GET request to {}".format(url))
+        if not UNRECORDED.get():
+            budget.charge()
+
+        response = (self.session or requests).request(
+            "GET",
+            url,
+            headers=headers,
+            auth=(self.config["token"], ""),
+            stream=True,
+            timeout=self.request_timeout,
+        )
+
+        if 500 <= response.status_code < 600:
+            response.close()
+            raise Server5xxError("Server error {}".format(response.status_code))
+        elif response.status_code == 429:
+            response.close()
+            raise Server429Error('Rate limit exceeded')
+        elif response.status_code not in (200, 206, 416):
+            raise RuntimeError(response.text)
+
+        return response
@@ -5,5 +5,16 @@ from dateutil.parser import parse
 LOGGER = singer.get_logger()  # noqa
 
 
+class ConfigError(Exception):
+    pass
+
+
+def check_config(config):
+    # Either a single account's token or a list of accounts, each with its
+    # own, so singer can't check for the token itself
+    if 'token' not in config and 'accounts' not in config:
+        raise ConfigError("Config is missing required keys: ['token'] (or 'accounts')")
+
+
 def get_config_start_date(config):
     return parse(config.get("start_date")).replace(tzinfo=pytz.utc)
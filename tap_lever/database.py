@@ -0,0 +1,188 @@
+import json
+import sqlite3
+
+import singer
+
+from tap_lever.parquet import get_kind
+
+try:
+    import duckdb
+except ImportError:  # pragma: no cover - optional dependency
+    duckdb = None
+
+LOGGER = singer.get_logger()  # noqa
+
+STATE_TABLE = '_sdc_state'
+
+COLUMN_TYPES = {
+    'sqlite': {
+        'timestamp': 'TEXT',
+        'integer': 'INTEGER',
+        'number': 'REAL',
+        'boolean': 'INTEGER',
+        'string': 'TEXT',
+        'json': 'TEXT',
+    },
+    'duckdb': {
+        'timestamp': 'TIMESTAMPTZ',
+        'integer': 'BIGINT',
+        'number': 'DOUBLE',
+        'boolean': 'BOOLEAN',
+        'string': 'VARCHAR',
+        'json': 'VARCHAR',
+    },
+}
+
+
+def quote(name):
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def get_dialect(config):
+    if config.get('database_type'):
+        return config['database_type']
+    return 'duckdb' if config['database_path'].endswith(('.duckdb', '.ddb')) else 'sqlite'
+
+
+def connect(dialect, path):
+    if dialect == 'duckdb':
+        if duckdb is None:
+            raise RuntimeError('Writing to DuckDB requires the duckdb package, '
+                               'install it with `pip install tap-lever[duckdb]`')
+        return duckdb.connect(path)
+    if dialect == 'sqlite':
+        # Every write happens under the output lock, from whichever stream
+        # thread holds it; transactions are opened explicitly
+        return sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    raise RuntimeError('Unknown database_type {}, expected sqlite or duckdb'.format(dialect))
+
+
+def to_value(kind, value):
+    if value is None:
+        return None
+    if kind == 'json':
+        return json.dumps(value)
+    return value
+
+
+class Table:
+    """A stream's table: its columns as derived from the stream schema and
+    the upsert statement for a page of records."""
+
+    def __init__(self, stream, schema, key_properties, dialect):
+        self.stream = stream
+        self.kinds = {name: get_kind(field_schema)
+                      for name, field_schema in schema.get('properties', {}).items()}
+        self.columns = list(self.kinds)
+        self.key_properties = list(key_properties)
+        self.dialect = dialect
+
+    def create_statement(self):
+        columns = ['{} {}'.format(quote(name), COLUMN_TYPES[self.dialect][kind])
+                   for name, kind in self.kinds.items()]
+        if self.key_properties:
+            columns.append('PRIMARY KEY ({})'.format(', '.join(quote(key) for key in self.key_properties)))
+        return 'CREATE TABLE IF NOT EXISTS {} ({})'.format(quote(self.stream), ', '.join(columns))
+
+    def upsert_statement(self):
+        statement = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            quote(self.stream),
+            ', '.join(quote(name) for name in self.columns),
+            ', '.join('?' for _ in self.columns))
+
+        if not self.key_properties:
+            return statement
+
+        updates = [name for name in self.columns if name not in self.key_properties]
+        conflict = 'ON CONFLICT ({})'.format(', '.join(quote(key) for key in self.key_properties))
+        if not updates:
+            return '{} {} DO NOTHING'.format(statement, conflict)
+        return '{} {} DO UPDATE SET {}'.format(
+            statement, conflict,
+            ', '.join('{0} = excluded.{0}'.format(quote(name)) for name in updates))
+
+    def rows(self, records):
+        return [
+            tuple(to_value(self.kinds[name], record.get(name)) for name in self.columns)
+            for record in records
+        ]
+
+
+class DatabaseSink:
+    """Writes transformed records straight into a local SQLite or DuckDB file.
+
+    Each stream gets a table derived from its schema, with the key properties
+    as primary key, and every page is upserted in one statement. Pages are
+    written into an open transaction that is committed together with the
+    state, kept in `_sdc_state`, so the file never holds rows the state
+    doesn't account for or the other way around.
+    """
+
+    def __init__(self, config):
+        self.path = config['database_path']
+        self.dialect = get_dialect(config)
+        self.connection = connect(self.dialect, self.path)
+        self.tables = {}
+        self.in_transaction = False
+
+        self.connection.execute('CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY, value {})'.format(
+            quote(STATE_TABLE), COLUMN_TYPES[self.dialect]['json']))
+
+    def begin(self):
+        if not self.in_transaction:
+            self.connection.execute('BEGIN TRANSACTION')
+            self.in_transaction = True
+
+    def get_columns(self, stream):
+        rows = self.connection.execute('PRAGMA table_info({})'.format(quote(stream))).fetchall()
+        return {row[1] for row in rows}
+
+    def set_schema(self, stream, schema, key_properties):
+        table = Table(stream, schema, key_properties, self.dialect)
+        if stream in self.tables and self.tables[stream].kinds == table.kinds:
+            return
+
+        self.begin()
+        self.connection.execute(table.create_statement())
+
+        # Tables created by an earlier version of the schema get the new
+        # columns; columns that were dropped are left alone
+        existing = self.get_columns(stream)
+        for name, kind in table.kinds.items():
+            if name not in existing:
+                self.connection.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(
+                    quote(stream), quote(name), COLUMN_TYPES[self.dialect][kind]))
+
+        self.tables[stream] = table
+
+    def write_records(self, stream, records):
+        if not records:
+            return
+
+        table = self.tables[stream]
+        self.begin()
+        self.connection.executemany(table.upsert_statement(), table.rows(records))
+
+    def write_state(self, state):
+        self.begin()
+        self.connection.execute('DELETE FROM {}'.format(quote(STATE_TABLE)))
+        self.connection.execute('INSERT INTO {} (id, value) VALUES (1, ?)'.format(quote(STATE_TABLE)),
+                                (json.dumps(state),))
+        self.commit()
+
+    def commit(self):
+        if self.in_transaction:
+            self.connection.execute('COMMIT')
+            self.in_transaction = False
+
+    def read_state(self):
+        row = self.connection.execute('SELECT value FROM {} WHERE id = 1'.format(quote(STATE_TABLE))).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def close(self):
+        # Anything written after the last state is rolled back, the next
+        # run syncs it again
+        if self.in_transaction:
+            self.connection.execute('ROLLBACK')
+            self.in_transaction = False
+        self.connection.close()
@@ -0,0 +1,55 @@
+import signal
+import threading
+import time
+
+import singer
+
+LOGGER = singer.get_logger()  # noqa
+
+STOP = threading.Event()
+DEADLINE = None
+
+
+def configure(config):
+    global DEADLINE  # pylint: disable=global-statement
+
+    STOP.clear()
+    DEADLINE = None
+
+    if config.get('max_runtime'):
+        max_runtime = float(config['max_runtime'])
+        LOGGER.info('Sync will stop taking new work after %s seconds', max_runtime)
+        DEADLINE = time.monotonic() + max_runtime
+
+
+def request_stop(reason):
+    if not STOP.is_set():
+        LOGGER.warning('%s, finishing in-flight work and checkpointing', reason)
+        STOP.set()
+
+
+def stopping():
+    """Whether the sync should stop taking new work.
+
+    Checked between windows, pages and parents, never in the middle of one,
+    so everything the bookmarks point past has been written.
+    """
+    if not STOP.is_set() and DEADLINE is not None and time.monotonic() >= DEADLINE:
+        request_stop('Reached max_runtime')
+    return STOP.is_set()
+
+
+def handle_sigterm(signum, frame):  # pylint: disable=unused-argument
+    request_stop('Received SIGTERM')
+
+
+def install_signal_handler():
+    # Signal handlers can only be set from the main thread
+    if threading.current_thread() is not threading.main_thread():
+        return None
+    return signal.signal(signal.SIGTERM, handle_sigterm)
+
+
+def restore_signal_handler(previous):
+    if previous is not None:
+        signal.signal(signal.SIGTERM, previous)
@@ -0,0 +1,164 @@
+import contextvars
+import hashlib
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+import singer
+
+from requests.exceptions import ConnectionError, ChunkedEncodingError, RequestException
+
+from tap_lever import accounts
+from tap_lever.client import Server5xxError, Server429Error
+from tap_lever.ratelimit import RateLimiter
+
+LOGGER = singer.get_logger()  # noqa
+
+CHUNK_SIZE = 64 * 1024
+MAX_TRIES = 5
+
+# A file that can't be downloaded leaves its resume without one, rather
+# than failing the resume request
+DOWNLOAD_ERRORS = (RuntimeError, Server5xxError, Server429Error, RequestException, OSError)
+
+DOWNLOADERS = {}
+
+
+def configure(config, client):
+    downloader = DOWNLOADERS.pop(accounts.current(), None)
+    if downloader is not None:
+        downloader.shutdown()
+
+    if config.get('resume_download_dir') and config.get('replay_dir'):
+        # Only API responses are archived, not the files they point to
+        LOGGER.warning('Resume files are not downloaded when replaying an archive')
+    elif config.get('resume_download_dir'):
+        LOGGER.info('Downloading resume files to {}'
+                    .format(config['resume_download_dir']))
+        DOWNLOADERS[accounts.current()] = ResumeDownloader(config, client)
+
+
+def get_downloader():
+    return DOWNLOADERS.get(accounts.current())
+
+
+def shutdown():
+    configure({}, None)
+
+
+class ResumeDownloader:
+    """Downloads resume files concurrently into a content-addressed store.
+
+    Files are streamed to `<dir>/.partial/<resume id>.part` in fixed-size
+    chunks and moved to `<dir>/<sha[:2]>/<sha256>` once complete, so a file
+    shared by several resumes is only stored once. A partial file left by an
+    interrupted run is resumed with a Range request. A resume asked for
+    while it is already downloading waits for that download, as both would
+    write the same partial file.
+    """
+
+    def __init__(self, config, client):
+        self.client = client
+        self.download_dir = os.path.abspath(config['resume_download_dir'])
+        self.partial_dir = os.path.join(self.download_dir, '.partial')
+        self.rate_limiter = RateLimiter(
+            float(config.get('resume_download_rate_limit', 2)))
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(config.get('resume_download_workers', 4)),
+            thread_name_prefix='resume-download')
+        self.in_flight = {}
+        self.lock = threading.Lock()
+
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def download_all(self, downloads):
+        """Download `(resume_id, url)` pairs, returning `(sha256, path)`
+        tuples in the same order, or None for a file that couldn't be
+        downloaded."""
+        submitted = [(resume_id, self.submit(resume_id, url)) for resume_id, url in downloads]
+
+        results = []
+        for resume_id, future in submitted:
+            try:
+                results.append(future.result())
+            except DOWNLOAD_ERRORS as e:
+                LOGGER.warning('Failed to download the file of resume %s: %s', resume_id, e)
+                results.append(None)
+        return results
+
+    def submit(self, resume_id, url):
+        # Candidate and opportunity resumes syncing concurrently can ask for
+        # the same resume
+        with self.lock:
+            future = self.in_flight.get(resume_id)
+            if future is not None:
+                return future
+
+            # Each download runs in a copy of the caller's context, so it
+            # counts towards the caller's account and stream
+            future = self.executor.submit(contextvars.copy_context().run, self.download, resume_id, url)
+            self.in_flight[resume_id] = future
+
+        # Outside the lock, as it runs right away if the download is done
+        future.add_done_callback(lambda done: self.forget(resume_id, done))
+        return future
+
+    def forget(self, resume_id, future):
+        with self.lock:
+            if self.in_flight.get(resume_id) is future:
+                del self.in_flight[resume_id]
+
+    def download(self, resume_id, url):
+        partial_path = os.path.join(self.partial_dir, '{}.part'.format(resume_id))
+
+        for attempt in range(1, MAX_TRIES + 1):
+            try:
+                self.fetch_to(partial_path, url)
+                break
+            except (ConnectionError, ChunkedEncodingError):
+                if attempt == MAX_TRIES:
+                    raise
+                LOGGER.warning('Download of resume %s interrupted, resuming (attempt %s)',
+                               resume_id, attempt + 1)
+
+        sha256 = hash_file(partial_path)
+        final_dir = os.path.join(self.download_dir, sha256[:2])
+        final_path = os.path.join(final_dir, sha256)
+        os.makedirs(final_dir, exist_ok=True)
+
+        if os.path.exists(final_path):
+            os.remove(partial_path)
+        else:
+            os.replace(partial_path, final_path)
+
+        return sha256, final_path
+
+    def fetch_to(self, partial_path, url):
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        headers = {'Range': 'bytes={}-'.format(offset)} if offset else None
+
+        self.rate_limiter.acquire()
+        response = self.client.stream_request(url, headers=headers)
+
+        with response:
+            if response.status_code == 416:
+                # The partial file already holds the whole resume
+                return
+
+            # A 200 means the server ignored the Range header, so start over
+            mode = 'ab' if response.status_code == 206 else 'wb'
+            with open(partial_path, mode) as handle:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    handle.write(chunk)
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,105 @@
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+import singer
+
+from tap_lever import accounts
+from tap_lever.batch import new_run_id
+
+LOGGER = singer.get_logger()  # noqa
+
+DELETED_AT = '_sdc_deleted_at'
+
+
+def fingerprint(record):
+    serialized = json.dumps(record, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.blake2b(serialized.encode('utf-8'), digest_size=8).hexdigest()
+
+
+class ChangeTracker:
+    """Compares full-table records against the fingerprints of the last run.
+
+    Fingerprints are compact hashes keyed by primary key, so only new or
+    changed records need to be emitted, and keys that weren't seen again can
+    be reported as deleted.
+    """
+
+    def __init__(self, key_properties, previous=None):
+        self.key_properties = key_properties
+        self.previous = previous or {}
+        self.fingerprints = {}
+
+    def get_key(self, record):
+        return json.dumps([record.get(key) for key in self.key_properties])
+
+    def changed(self, records):
+        changed = []
+        for record in records:
+            key = self.get_key(record)
+            digest = fingerprint(record)
+            self.fingerprints[key] = digest
+            if self.previous.get(key) != digest:
+                changed.append(record)
+        return changed
+
+    def tombstones(self, deleted_at):
+        tombstones = []
+        for key in self.previous:
+            if key not in self.fingerprints:
+                record = dict(zip(self.key_properties, json.loads(key)))
+                record[DELETED_AT] = deleted_at
+                tombstones.append(record)
+        return tombstones
+
+
+class FingerprintStore:
+    """Fingerprints kept on disk instead of in the state.
+
+    Each run of a stream writes its fingerprints to a new gzipped JSON file
+    under `<dir>/<stream>/` (with the account id in front in multi-account
+    mode), and only the file name goes into the stream's bookmark. The file
+    named by the incoming state is kept until the next run, in case the
+    state naming the new one never reaches the target.
+    """
+
+    def __init__(self, directory):
+        self.directory = os.path.abspath(directory)
+
+    def get_dir(self, table):
+        parts = [self.directory]
+        if accounts.current() is not None:
+            parts.append(accounts.current())
+        parts.append(table)
+        return os.path.join(*parts)
+
+    def load(self, table, name):
+        if name is None:
+            return {}
+
+        path = os.path.join(self.get_dir(table), name)
+        if not os.path.exists(path):
+            LOGGER.warning('Fingerprint file %s is missing, every %s row is emitted', path, table)
+            return {}
+
+        with gzip.open(path, 'rb') as compressed:
+            return json.loads(compressed.read().decode('utf-8'))
+
+    def save(self, table, fingerprints, previous=None):
+        directory = self.get_dir(table)
+        os.makedirs(directory, exist_ok=True)
+        name = '{}.json.gz'.format(new_run_id())
+
+        # Written next to its final path and moved into place, so an
+        # interrupted run never leaves a truncated file behind
+        handle, partial_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        with os.fdopen(handle, 'wb') as raw, gzip.GzipFile(fileobj=raw, mode='wb') as compressed:
+            compressed.write(json.dumps(fingerprints).encode('utf-8'))
+        os.replace(partial_path, os.path.join(directory, name))
+
+        for old in os.listdir(directory):
+            if old not in (name, previous):
+                os.remove(os.path.join(directory, old))
+        return name
@@ -0,0 +1,105 @@
+import copy
+import threading
+import time
+
+import singer
+
+from tap_lever import accounts
+
+LOGGER = singer.get_logger()  # noqa
+
+STATE_KEY = 'empty_parents'
+DEFAULT_TTL_DAYS = 7
+# The cache goes out with every STATE message, so it is kept small
+DEFAULT_MAX_ENTRIES = 1000
+
+CACHES = {}
+
+
+def configure(state, config):
+    ttl = float(config.get('empty_parent_ttl_days', DEFAULT_TTL_DAYS)) * 24 * 60 * 60
+    max_entries = int(config.get('empty_parent_max_entries', DEFAULT_MAX_ENTRIES))
+    CACHES[accounts.current()] = EmptyParentCache(state.get(STATE_KEY), ttl, max_entries)
+
+
+def get_cache():
+    return CACHES.get(accounts.current())
+
+
+def attach(state):
+    # Saved with every STATE message, like the retry queue
+    cache = get_cache()
+    if cache is None:
+        return state
+
+    entries = cache.dump()
+    if entries:
+        state[STATE_KEY] = entries
+    else:
+        state.pop(STATE_KEY, None)
+    return state
+
+
+class EmptyParentCache:
+    """Parents known to have no records in a child stream.
+
+    Entries are kept per child table as `{parent id: [updatedAt, expires]}`.
+    An entry only applies while the parent's `updatedAt` is unchanged, since
+    adding a child record updates its parent, and until it expires, so
+    anything missed is picked up again eventually.
+
+    At most `max_entries` are kept. Past that the entries expiring first go:
+    the newest are for the parents of the last window, which is the one the
+    next run reads again.
+    """
+
+    def __init__(self, entries=None, ttl=DEFAULT_TTL_DAYS * 24 * 60 * 60, max_entries=DEFAULT_MAX_ENTRIES):
+        self.entries = copy.deepcopy(entries or {})
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.size = sum(len(table_entries) for table_entries in self.entries.values())
+        self.lock = threading.Lock()
+
+    def is_empty(self, table, parent_id, updated_at):
+        if updated_at is None:
+            return False
+
+        with self.lock:
+            entry = self.entries.get(table, {}).get(parent_id)
+
+        return entry is not None and entry[0] == updated_at and entry[1] > time.time()
+
+    def add(self, table, parent_id, updated_at):
+        if updated_at is None:
+            return
+
+        with self.lock:
+            table_entries = self.entries.setdefault(table, {})
+            if parent_id not in table_entries:
+                self.size += 1
+            table_entries[parent_id] = [updated_at, int(time.time() + self.ttl)]
+            if self.size > self.max_entries:
+                self.trim()
+
+    def trim(self):
+        # A tenth below the limit, so trimming doesn't happen on every add
+        keep = self.max_entries * 9 // 10
+        by_expiry = sorted((entry[1], table, parent_id)
+                           for table, table_entries in self.entries.items()
+                           for parent_id, entry in table_entries.items())
+        for _, table, parent_id in by_expiry[:len(by_expiry) - keep]:
+            del self.entries[table][parent_id]
+        self.size = min(len(by_expiry), keep)
+
+    def dump(self):
+        now = time.time()
+        with self.lock:
+            for table in list(self.entries):
+                entries = {parent_id: entry for parent_id, entry in self.entries[table].items()
+                           if entry[1] > now}
+                if entries:
+                    self.entries[table] = entries
+                else:
+                    self.entries.pop(table)
+            self.size = sum(len(table_entries) for table_entries in self.entries.values())
+            return copy.deepcopy(self.entries)
@@ -0,0 +1,71 @@
+import collections
+import re
+import threading
+
+from urllib.parse import urlparse
+
+WINDOW = 200
+MIN_SAMPLES = 20
+
+VERSION_SEGMENT = re.compile(r'^v\d+$')
+
+
+def get_endpoint(url):
+    """Groups URLs by endpoint, e.g. `/v1/opportunities/{id}/offers`.
+
+    Lever paths alternate between resource names and ids, so every other
+    segment after the version is an id.
+    """
+    segments = urlparse(url).path.strip('/').split('/')
+    prefix = []
+    if segments and VERSION_SEGMENT.match(segments[0]):
+        prefix = [segments.pop(0)]
+
+    return '/' + '/'.join(prefix + [
+        '{id}' if i % 2 else segment for i, segment in enumerate(segments)
+    ])
+
+
+def is_child_endpoint(endpoint):
+    return '{id}' in endpoint
+
+
+class LatencyTracker:
+    """Keeps the latest response times per endpoint. Safe to share between
+    threads."""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.samples = {}
+        # Percentiles known from earlier runs, used until there are samples
+        self.seeds = {}
+        self.lock = threading.Lock()
+
+    def seed(self, endpoint, percentiles):
+        """Sets `{percent: seconds}` to answer with while `endpoint` has too
+        few samples of its own."""
+        with self.lock:
+            self.seeds[endpoint] = dict(percentiles)
+
+    def endpoints(self):
+        with self.lock:
+            return list(self.samples)
+
+    def observe(self, endpoint, seconds):
+        with self.lock:
+            if endpoint not in self.samples:
+                self.samples[endpoint] = collections.deque(maxlen=self.window)
+            self.samples[endpoint].append(seconds)
+
+    def percentile(self, endpoint, percent):
+        """The given percentile of recent latencies, or None until enough
+        requests have been observed and nothing was seeded for it."""
+        with self.lock:
+            samples = sorted(self.samples.get(endpoint, ()))
+            seeded = self.seeds.get(endpoint, {}).get(percent)
+
+        if len(samples) < MIN_SAMPLES:
+            return seeded
+
+        index = min(int(round(percent / 100.0 * (len(samples) - 1))), len(samples) - 1)
+        return samples[index]
@@ -0,0 +1,149 @@
+import threading
+
+import singer
+
+from tap_lever import accounts
+from tap_lever.batch import BatchWriter
+from tap_lever.database import DatabaseSink
+from tap_lever.parquet import ParquetSink
+from tap_lever.record_queue import RecordQueue
+
+LOGGER = singer.get_logger()  # noqa
+
+WRITER = None
+
+# Every message goes through this lock so that streams syncing on different
+# threads never interleave inside a page, and a STATE message is never
+# written in the middle of another stream's records.
+LOCK = threading.RLock()
+
+
+def configure(config, writer=None):
+    global WRITER  # pylint: disable=global-statement
+
+    close()
+
+    if writer is not None:
+        # Set by the in-process API, see tap_lever.api
+        WRITER = writer
+    elif config.get('parquet_dir'):
+        LOGGER.info('Writing records as Parquet to {}'.format(config['parquet_dir']))
+        WRITER = ParquetSink(config)
+    elif config.get('database_path'):
+        LOGGER.info('Writing records to the database {}'.format(config['database_path']))
+        WRITER = DatabaseSink(config)
+    elif config.get('batch_mode'):
+        LOGGER.info('Batch mode enabled, writing records to {}'
+                    .format(config.get('batch_dir', 'batches')))
+        WRITER = BatchWriter(config)
+    else:
+        WRITER = None
+
+
+def writes_raw_records():
+    # The Parquet sink converts whole columns itself, so records are handed
+    # over as decoded instead of going through the singer transformer.
+    return isinstance(WRITER, ParquetSink)
+
+
+def write_schema(stream, schema, key_properties):
+    # Records of several accounts share one output, so each is tagged with
+    # the account it came from and that id becomes part of the key.
+    if accounts.current() is not None:
+        schema = dict(schema, properties=dict(schema.get('properties', {})))
+        schema['properties'][accounts.ACCOUNT_FIELD] = {'type': ['string']}
+        key_properties = list(key_properties) + [accounts.ACCOUNT_FIELD]
+
+    with LOCK:
+        if isinstance(WRITER, ParquetSink):
+            WRITER.set_schema(stream, schema)
+        elif isinstance(WRITER, (DatabaseSink, RecordQueue)):
+            WRITER.set_schema(stream, schema, key_properties)
+        else:
+            singer.write_schema(stream, schema, key_properties=key_properties)
+
+
+def set_partition(stream, partition):
+    with LOCK:
+        if isinstance(WRITER, ParquetSink):
+            WRITER.set_partition(stream, partition)
+
+
+def supports_versions():
+    # Batch files, Parquet and database tables have nowhere to carry a
+    # table version
+    return WRITER is None
+
+
+def write_records(stream, records, version=None):
+    account_id = accounts.current()
+    if account_id is not None:
+        for record in records:
+            record[accounts.ACCOUNT_FIELD] = account_id
+
+    with LOCK:
+        if WRITER is not None:
+            WRITER.write_records(stream, records)
+        elif version is not None:
+            for record in records:
+                singer.write_message(singer.RecordMessage(stream, record, version=version))
+        else:
+            singer.write_records(stream, records)
+
+
+def write_activate_version(stream, version):
+    with LOCK:
+        singer.write_message(singer.ActivateVersionMessage(stream, version))
+
+
+def write_state(state):
+    with LOCK:
+        if isinstance(WRITER, RecordQueue):
+            WRITER.write_state(state)
+            return
+
+        # Committed in the same transaction as the rows written since the
+        # last state, and still emitted for whatever runs the tap
+        if isinstance(WRITER, DatabaseSink):
+            WRITER.write_state(state)
+        elif isinstance(WRITER, (BatchWriter, ParquetSink)):
+            # Held back while the files holding the rows it covers are open
+            state = WRITER.checkpoint(state)
+            if state is None:
+                return
+        singer.write_state(state)
+
+
+def commit():
+    # For a checkpoint without state, like a full table stream's
+    with LOCK:
+        if isinstance(WRITER, DatabaseSink):
+            WRITER.commit()
+
+
+def read_state():
+    # The state committed by an earlier run into the same database
+    with LOCK:
+        if isinstance(WRITER, DatabaseSink):
+            return WRITER.read_state()
+        return None
+
+
+def close():
+    global WRITER  # pylint: disable=global-statement
+
+    with LOCK:
+        if isinstance(WRITER, DatabaseSink):
+            WRITER.close()
+            WRITER = None
+        elif isinstance(WRITER, ParquetSink):
+            # The rows of a held back state are complete once their files
+            # are closed
+            state = WRITER.finish()
+            WRITER = None
+            if state is not None:
+                singer.write_state(state)
+        elif isinstance(WRITER, BatchWriter):
+            # Emits the state held back once its files are finalized
+            WRITER.commit()
+            WRITER = None
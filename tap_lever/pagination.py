@@ -0,0 +1,93 @@
+import contextvars
+import queue
+import threading
+
+import singer
+
+LOGGER = singer.get_logger()  # noqa
+
+_DONE = object()
+
+
+def get_prefetch_depth(config):
+    return max(int(config.get('prefetch_depth', 0) or 0), 0)
+
+
+def paginate(client, url, method, params=None, depth=0):
+    """Yield every response page of `url`, following the `next` cursor.
+
+    With a `depth` above zero the following pages are fetched on a background
+    thread as soon as their cursor is known, keeping at most `depth` pages
+    buffered ahead of the consumer.
+    """
+    params = dict(params or {})
+
+    if depth <= 0:
+        while True:
+            result = client.make_request(url, method, params=params)
+            yield result
+
+            _next = result.get('next')
+            if not _next:
+                return
+            params['offset'] = _next
+    else:
+        yield from PagePrefetcher(client, url, method, params, depth)
+
+
+class PagePrefetcher:
+
+    def __init__(self, client, url, method, params, depth):
+        self.client = client
+        self.url = url
+        self.method = method
+        self.params = params
+        self.pages = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+
+    def put(self, item):
+        # Blocks while the buffer is full, but gives up once the consumer
+        # has gone away so the thread never outlives the iteration.
+        while not self.stopped.is_set():
+            try:
+                self.pages.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def fetch(self):
+        params = self.params
+        try:
+            while not self.stopped.is_set():
+                result = self.client.make_request(self.url, self.method, params=dict(params))
+                if not self.put((result, None)):
+                    return
+
+                _next = result.get('next')
+                if not _next:
+                    break
+                params['offset'] = _next
+        except Exception as ex:  # pylint: disable=broad-except
+            self.put((None, ex))
+            return
+
+        self.put((_DONE, None))
+
+    def __iter__(self):
+        # Run in a copy of the context so requests are traced under the
+        # stream that reads the pages
+        worker = threading.Thread(target=contextvars.copy_context().run, args=(self.fetch,), daemon=True)
+        worker.start()
+
+        try:
+            while True:
+                result, error = self.pages.get()
+                if error is not None:
+                    raise error
+                if result is _DONE:
+                    return
+                yield result
+        finally:
+            self.stopped.set()
+            worker.join()
@@ -0,0 +1,198 @@
+import copy
+import json
+import os
+import time
+
+import singer
+
+from dateutil.parser import parse
+
+from tap_lever.batch import new_run_id
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover - optional dependency
+    pa = None
+    pq = None
+
+LOGGER = singer.get_logger()  # noqa
+
+DEFAULT_ROW_GROUP_SIZE = 10000
+DEFAULT_COMMIT_INTERVAL = 300
+DEFAULT_PARTITION = 'window=all'
+
+ARROW_ERRORS = (TypeError, ValueError, OverflowError)
+if pa is not None:
+    ARROW_ERRORS += (pa.ArrowInvalid, pa.ArrowTypeError)
+
+
+def get_kind(field_schema):
+    types = field_schema.get('type', [])
+    if not isinstance(types, list):
+        types = [types]
+    types = [t for t in types if t != 'null']
+
+    if field_schema.get('format') == 'date-time':
+        return 'timestamp'
+    if types in (['string'], ['integer'], ['number'], ['boolean']):
+        return types[0]
+    # Objects, arrays and untyped fields are kept as JSON text
+    return 'json'
+
+
+def to_millis(value):
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    return int(parse(value).timestamp() * 1000)
+
+
+def timestamp_array(values):
+    # Lever sends timestamps as unix milliseconds, so the whole column can
+    # usually be cast in one go; anything else is normalized value by value.
+    try:
+        millis = pa.array(values, type=pa.int64())
+    except ARROW_ERRORS:
+        millis = pa.array([to_millis(value) for value in values], type=pa.int64())
+    return millis.cast(pa.timestamp('ms', tz='UTC'))
+
+
+def scalar_array(values, arrow_type, convert):
+    try:
+        return pa.array(values, type=arrow_type)
+    except ARROW_ERRORS:
+        converted = []
+        for value in values:
+            try:
+                converted.append(None if value is None else convert(value))
+            except ARROW_ERRORS:
+                converted.append(None)
+        return pa.array(converted, type=arrow_type)
+
+
+def build_column(kind, values):
+    if kind == 'timestamp':
+        return timestamp_array(values)
+    if kind == 'integer':
+        return scalar_array(values, pa.int64(), int)
+    if kind == 'number':
+        return scalar_array(values, pa.float64(), float)
+    if kind == 'boolean':
+        return scalar_array(values, pa.bool_(), bool)
+    if kind == 'string':
+        return scalar_array(values, pa.string(), str)
+    return pa.array([None if value is None else json.dumps(value, default=str)
+                     for value in values], type=pa.string())
+
+
+class ParquetSink:
+    """Writes the records of each stream to local Parquet files.
+
+    Records arrive untransformed, a page at a time, and are converted to
+    columns using the stream's JSON schema. Files are laid out as
+    `<dir>/<stream>/window=<start>/<run>-<seq>.parquet` and only get their
+    final name once closed.
+
+    Files stay open across checkpoints, so row groups fill up, and are all
+    closed together once the oldest has been open for `commit_interval`
+    seconds, or at the end of the run. A STATE is held back until then, so
+    it is never emitted ahead of the rows it covers.
+    """
+
+    def __init__(self, config):
+        if pa is None:
+            raise RuntimeError('parquet_dir requires pyarrow, install tap-lever[parquet]')
+
+        self.parquet_dir = os.path.abspath(config['parquet_dir'])
+        self.row_group_size = int(config.get('parquet_row_group_size', DEFAULT_ROW_GROUP_SIZE))
+        self.commit_interval = float(config.get('parquet_commit_interval', DEFAULT_COMMIT_INTERVAL))
+        self.opened_at = None
+        self.pending_state = None
+        self.run_id = new_run_id()
+        self.sequence = 0
+        self.fields = {}
+        self.partitions = {}
+        self.buffers = {}
+        self.writers = {}
+
+    def set_schema(self, stream, schema):
+        fields = [(name, get_kind(field_schema))
+                  for name, field_schema in schema.get('properties', {}).items()]
+        if self.fields.get(stream) != fields:
+            self.close(stream)
+            self.fields[stream] = fields
+
+    def set_partition(self, stream, partition):
+        if self.partitions.get(stream, DEFAULT_PARTITION) != partition:
+            self.close(stream)
+            self.partitions[stream] = partition
+
+    def to_table(self, stream, records):
+        fields = self.fields[stream]
+        return pa.table({
+            name: build_column(kind, [record.get(name) for record in records])
+            for name, kind in fields
+        })
+
+    def write_records(self, stream, records):
+        if records and self.opened_at is None:
+            self.opened_at = time.monotonic()
+        buffer = self.buffers.setdefault(stream, [])
+        buffer.extend(records)
+        if len(buffer) >= self.row_group_size:
+            self.write_row_group(stream)
+
+    def write_row_group(self, stream):
+        records = self.buffers.pop(stream, [])
+        if not records:
+            return
+
+        table = self.to_table(stream, records)
+        if stream not in self.writers:
+            self.sequence += 1
+            directory = os.path.join(self.parquet_dir, stream,
+                                     self.partitions.get(stream, DEFAULT_PARTITION))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, '{}-{:05d}.parquet'.format(self.run_id, self.sequence))
+            tmp_path = os.path.join(directory, '.{}.part'.format(os.path.basename(path)))
+            self.writers[stream] = (path, tmp_path, pq.ParquetWriter(tmp_path, table.schema))
+
+        self.writers[stream][2].write_table(table)
+
+    def close(self, stream):
+        self.write_row_group(stream)
+        writer = self.writers.pop(stream, None)
+        if writer is None:
+            return
+
+        path, tmp_path, parquet_writer = writer
+        parquet_writer.close()
+        os.replace(tmp_path, path)
+        LOGGER.info('Wrote {}'.format(path))
+
+    def checkpoint(self, state):
+        """Returns the state to emit now, or None while files holding rows
+        it covers are open. The latest state held back is emitted once they
+        are closed."""
+        # Streams go on updating their bookmarks in place
+        self.pending_state = copy.deepcopy(state)
+        if self.opened_at is not None and time.monotonic() - self.opened_at >= self.commit_interval:
+            self.commit()
+
+        if self.opened_at is not None:
+            return None
+        state, self.pending_state = self.pending_state, None
+        return state
+
+    def commit(self):
+        for stream in list(self.buffers) + list(self.writers):
+            self.close(stream)
+        self.opened_at = None
+
+    def finish(self):
+        """Closes every file and returns the state held back, if any."""
+        self.commit()
+        state, self.pending_state = self.pending_state, None
+        return state
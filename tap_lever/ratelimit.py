@@ -0,0 +1,72 @@
+import threading
+import time
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` acquisitions per second on average and
+    bursts of up to `burst`. Safe to share between threads."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(rate, 1))
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity,
+                          self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self.refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+
+class RequestRate:
+    """Counts responses per second of the clock. Remembers the highest count
+    of a second without a 429, and the lowest count of a second with one.
+    Safe to share between threads."""
+
+    def __init__(self):
+        self.second = None
+        self.count = 0
+        self.throttled_second = False
+        self.peak = 0
+        self.throttled = None
+        self.lock = threading.Lock()
+
+    def record(self, status=None, now=None):
+        second = int(time.monotonic() if now is None else now)
+        with self.lock:
+            if second != self.second:
+                self.peak, self.throttled = self.summarize()
+                self.second = second
+                self.count = 0
+                self.throttled_second = False
+
+            self.count += 1
+            if status == 429:
+                self.throttled_second = True
+
+    def summarize(self):
+        # Called under the lock, with the second in progress counted as is
+        if self.second is None:
+            return self.peak, self.throttled
+        if self.throttled_second:
+            throttled = self.count if self.throttled is None else min(self.throttled, self.count)
+            return self.peak, throttled
+        return max(self.peak, self.count), self.throttled
+
+    def summary(self):
+        """`(peak, throttled)` requests per second so far."""
+        with self.lock:
+            return self.summarize()
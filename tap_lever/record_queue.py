@@ -0,0 +1,68 @@
+import copy
+import queue
+import threading
+
+from typing import Any, Dict, NamedTuple
+
+_DONE = object()
+
+
+class Record(NamedTuple):
+    """A record of `stream`, transformed against the stream schema."""
+    stream: str
+    data: Dict[str, Any]
+
+
+class RecordQueue:
+    """Output that hands records to an in-process reader instead of writing
+    Singer messages.
+
+    Pages of records and state checkpoints are put on a bounded queue in the
+    order they are written, so a reader sees a state only after the records
+    it covers, and a slow reader holds up the sync rather than the queue
+    growing. Once the reader goes away, nothing is queued any more.
+    """
+
+    def __init__(self, streams, maxsize=100):
+        self.streams = set(streams)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.closed = threading.Event()
+        self.done = False
+        self.schemas = {}
+
+    def put(self, item):
+        while not self.closed.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def set_schema(self, stream, schema, key_properties):
+        self.schemas[stream] = (schema, list(key_properties))
+
+    def write_records(self, stream, records):
+        # Parents selected only because a child needs them aren't handed out
+        if records and stream in self.streams:
+            self.put(('records', stream, records))
+
+    def write_state(self, state):
+        self.put(('state', copy.deepcopy(state)))
+
+    def finish(self, error=None):
+        self.put((_DONE, error))
+
+    def close(self):
+        self.closed.set()
+
+    def __iter__(self):
+        """Yields `('records', stream, records)` and `('state', state)` items
+        until the sync has finished, then raises the error it failed with."""
+        while True:
+            item = self.queue.get()
+            if item[0] is _DONE:
+                self.done = True
+                if item[1] is not None:
+                    raise item[1]
+                return
+            yield item
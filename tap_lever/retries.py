@@ -0,0 +1,179 @@
+import copy
+import threading
+
+import singer
+
+from dateutil.parser import parse
+
+from requests.exceptions import RequestException
+
+from tap_lever import accounts
+from tap_lever.client import OffsetInvalidException, Server429Error, Server5xxError
+
+LOGGER = singer.get_logger()  # noqa
+
+STATE_KEY = 'failed_children'
+DEFERRED_KEY = 'deferred_children'
+DEFAULT_MAX_ATTEMPTS = 10
+DEFAULT_MAX_FAILED = 1000
+MAX_ERROR_LENGTH = 200
+
+# Errors that are deferred instead of failing the run. Retryable errors only
+# get here once the client's backoff has given up on them. A ServerAuthError
+# isn't one of them: without access to a child stream every parent fails.
+CHILD_ERRORS = (RuntimeError, Server5xxError, Server429Error,
+                OffsetInvalidException, RequestException)
+
+QUEUES = {}
+
+
+class TooManyFailuresError(Exception):
+    pass
+
+
+def configure(state, config=None):
+    config = config or {}
+    queue = QUEUES[accounts.current()] = RetryQueue(
+        state.get(STATE_KEY),
+        int(config.get('child_retry_max_attempts', DEFAULT_MAX_ATTEMPTS)),
+        int(config.get('child_retry_max_failed', DEFAULT_MAX_FAILED)),
+        state.get(DEFERRED_KEY))
+
+    for table, failed in queue.failed.items():
+        LOGGER.info('%s %s parents failed in earlier runs and will be retried',
+                    len(failed), table)
+
+
+def get_queue():
+    return QUEUES.get(accounts.current())
+
+
+def attach(state):
+    # Called for every STATE message, so the dead-letter list written always
+    # matches the bookmarks it is saved with.
+    queue = get_queue()
+    if queue is None:
+        return state
+
+    failed = queue.dump()
+    if failed:
+        state[STATE_KEY] = failed
+    else:
+        state.pop(STATE_KEY, None)
+
+    deferred = queue.dump_deferred()
+    if deferred:
+        state[DEFERRED_KEY] = deferred
+    else:
+        state.pop(DEFERRED_KEY, None)
+    return state
+
+
+class RetryQueue:
+    """Parent ids whose child records could not be fetched.
+
+    Kept per child table as `{parent id: {'error': ..., 'attempts': n}}` and
+    persisted in state under `failed_children`, so failures are retried at
+    the end of the stream's sync and again on later runs.
+
+    A parent is given up on after `max_attempts` failures. More than
+    `max_failed` failing parents of one table fail the run, since by then
+    the cause is more likely the table than its parents.
+
+    Parents a child table doesn't reach before the sync stops aren't listed
+    one by one. Only the earliest start of the parent windows they came
+    from is kept, under `deferred_children`, and the next run syncs the
+    parent stream from there again, see TimeRangeStream.get_start_date.
+    """
+
+    def __init__(self, failed=None, max_attempts=DEFAULT_MAX_ATTEMPTS, max_failed=DEFAULT_MAX_FAILED,
+                 deferred=None):
+        self.failed = copy.deepcopy(failed or {})
+        self.max_attempts = max_attempts
+        self.max_failed = max_failed
+        # Positions left by earlier runs, and those of this run's stops
+        self.deferred = {table: parse(position) for table, position in (deferred or {}).items()}
+        self.stopped = {}
+        self.lock = threading.Lock()
+
+    def add(self, table, parent_id, error):
+        with self.lock:
+            failed = self.failed.setdefault(table, {})
+            entry = failed.setdefault(parent_id, {'attempts': 0})
+            entry['attempts'] += 1
+            entry['error'] = str(error)[:MAX_ERROR_LENGTH]
+
+            if entry['attempts'] >= self.max_attempts:
+                LOGGER.error('Giving up on %s for %s after %s attempts: %s',
+                             table, parent_id, entry['attempts'], entry['error'])
+                self.discard(table, parent_id)
+                return
+
+            # Parents deferred by a stopping sync haven't failed
+            failing = sum(1 for failed_entry in failed.values() if failed_entry['attempts'])
+            if failing > self.max_failed:
+                raise TooManyFailuresError('{} failed for more than {} parents, last with: {}'
+                                           .format(table, self.max_failed, entry['error']))
+
+    def defer(self, table, parent_id, position=None):
+        # Parents not reached before the sync was stopped, with the start of
+        # the parent window they came from
+        with self.lock:
+            if position is not None:
+                self.stopped[table] = min(self.stopped.get(table, position), position)
+                return
+
+            # Parents being retried are on the list already, and so is one
+            # without a position
+            self.failed.setdefault(table, {}).setdefault(
+                parent_id, {'attempts': 0, 'error': 'Not fetched before the sync stopped'})
+
+    def finish_deferred(self, table, stopping):
+        """Called once `table` has been handed all of this run's parents.
+
+        The position left by an earlier run is replaced by where this run
+        stopped, if anywhere. While the sync is stopping it is kept too, as
+        the parent stream may have stopped before reaching it again.
+        """
+        with self.lock:
+            positions = [self.stopped.pop(table, None)]
+            if stopping:
+                positions.append(self.deferred.get(table))
+            positions = [position for position in positions if position is not None]
+
+            if positions:
+                self.deferred[table] = min(positions)
+            else:
+                self.deferred.pop(table, None)
+
+    def get_deferred(self, tables):
+        """The earliest parent window start an earlier run left any of the
+        child `tables` at, or None."""
+        with self.lock:
+            positions = [self.deferred[table] for table in tables if table in self.deferred]
+        return min(positions) if positions else None
+
+    def remove(self, table, parent_id):
+        with self.lock:
+            self.discard(table, parent_id)
+
+    def discard(self, table, parent_id):
+        # Called under the lock
+        failed = self.failed.get(table, {})
+        if failed.pop(parent_id, None) is not None and not failed:
+            self.failed.pop(table)
+
+    def pending(self, table):
+        with self.lock:
+            return list(self.failed.get(table, {}))
+
+    def dump(self):
+        with self.lock:
+            return copy.deepcopy(self.failed)
+
+    def dump_deferred(self):
+        with self.lock:
+            deferred = dict(self.deferred)
+            for table, position in self.stopped.items():
+                deferred[table] = min(deferred.get(table, position), position)
+            return {table: position.isoformat() for table, position in deferred.items()}
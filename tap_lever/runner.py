@@ -0,0 +1,279 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import singer
+
+from tap_lever import accounts, budget, deadline, downloads, hints, output, retries, tracing, \
+    transform, tuning
+from tap_lever.planner import SyncPlanner
+from tap_lever.scheduler import build_pipelines
+from tap_lever.streams import cache as stream_cache
+from tap_lever.state import StateDocument, save_state, share_document, share_state, \
+    unshare_document, unshare_state
+from tap_lever.streams.base import is_stream_selected
+
+LOGGER = singer.get_logger()  # noqa
+
+
+class LeverRunner:
+
+    def __init__(self, args, client, available_streams):
+        self.config = args.config
+        self.state = args.state
+        self.catalog = args.catalog
+        self.client = client
+        self.available_streams = available_streams
+
+    def discover(self):
+        LOGGER.info("Starting discovery.")
+
+        catalog = []
+        for available_stream in self.available_streams:
+            stream = available_stream(self.config, self.state, None, None)
+
+            for entry in stream.generate_catalog():
+                replication_method = entry.get("replication_method")
+                replication_keys = entry.get("replication_keys", [])
+
+                if replication_method == "FULL_TABLE":
+                    entry.pop("replication_keys", None)
+                elif replication_method == "INCREMENTAL":
+                    if not replication_keys:
+                        raise ValueError(
+                            f"Stream '{entry.get('stream')}' is marked as INCREMENTAL "
+                            f"but has no replication_keys defined."
+                        )
+
+                catalog.append(entry)
+
+        return {'streams': catalog}
+
+    def get_streams_to_replicate(self):
+        streams = []
+        inline_child_catalogs = {}
+
+        if not self.catalog:
+            return streams, inline_child_catalogs
+        for stream_catalog in self.catalog.streams:
+            if not is_stream_selected(stream_catalog):
+                LOGGER.info("'{}' is not marked selected, skipping."
+                            .format(stream_catalog.stream))
+                continue
+
+            for available_stream in self.available_streams:
+                if available_stream.matches_catalog(stream_catalog):
+                    if not available_stream.requirements_met(self.catalog):
+                        raise RuntimeError(
+                            "{} requires that that the following are "
+                            "selected: {}"
+                            .format(stream_catalog.stream,
+                                    ','.join(available_stream.get_requirements())))
+
+                    if available_stream.SYNC_WITH_PARENT:
+                        LOGGER.info('Will sync %s during the %s stream sync',
+                                    available_stream.TABLE, available_stream.PARENT)
+                        inline_child_catalogs.setdefault(available_stream.PARENT, {})[
+                            available_stream.TABLE] = stream_catalog
+                    else:
+                        to_add = available_stream(self.config, self.state, stream_catalog, self.client)
+                        streams.append(to_add)
+
+        return (streams, inline_child_catalogs)
+
+    def prepare_sync(self):
+        if self.config.get('activate_version') and self.config.get('change_detection'):
+            # A version has to hold every row to replace the previous one
+            raise RuntimeError('activate_version and change_detection cannot be used together')
+
+        downloads.configure(self.config, self.client)
+        retries.configure(self.state, self.config)
+        hints.configure(self.state, self.config)
+        # Before the streams are built, as it sets their window sizes
+        tuning.configure(self.state, self.config, self.client)
+
+        streams, inline_child_catalogs = self.get_streams_to_replicate()
+
+        if any(streams):
+            LOGGER.info('Will sync: %s', ', '.join([stream.TABLE for stream in streams]))
+
+        # Children synced inline get shares of their own
+        inline_tables = [table for children in inline_child_catalogs.values() for table in children]
+        budget.configure(self.state, self.config, [stream.TABLE for stream in streams] + inline_tables)
+
+        return build_pipelines(streams, inline_child_catalogs)
+
+    def get_projections(self):
+        # Handed to every transform worker once, when it starts
+        if not self.catalog:
+            return {}
+        return {
+            stream_catalog.stream: transform.build_projection(stream_catalog)
+            for stream_catalog in self.catalog.streams
+            if is_stream_selected(stream_catalog)
+        }
+
+    def get_buffer_size(self):
+        return int(self.config.get('pipeline_buffer_size',
+                                   stream_cache.DEFAULT_CHANNEL_SIZE))
+
+    def should_skip(self, pipeline):
+        if deadline.stopping():
+            LOGGER.info('Skipping %s, the sync is stopping', pipeline.root.TABLE)
+            return True
+        if not budget.allows(pipeline.root.TABLE):
+            LOGGER.info('Skipping %s, its request budget is spent', pipeline.root.TABLE)
+            return True
+        return False
+
+    def sync_pipeline(self, shared_state, pipeline, pipelined):
+        if self.should_skip(pipeline):
+            return
+
+        shared_state.claim(pipeline.tables)
+        state = pipeline.sync(shared_state.snapshot(),
+                              pipelined=pipelined,
+                              buffer_size=self.get_buffer_size())
+        shared_state.merge(state)
+
+    def sync_concurrently(self, pipelines, max_workers):
+        # Each pipeline gets a worker, and its non-inline children read the
+        # root's records from a channel while the root is still paging.
+        shared_state = share_state(self.state)
+
+        LOGGER.info('Syncing %s stream pipelines with up to %s workers', len(pipelines), max_workers)
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = [executor.submit(self.sync_pipeline, shared_state, pipeline, True)
+                           for pipeline in pipelines]
+                for future in futures:
+                    future.result()
+        finally:
+            self.state = unshare_state()
+
+    def sync_account(self):
+        pipelines = self.prepare_sync()
+
+        max_workers = int(self.config.get('max_concurrent_streams', 1))
+        if max_workers > 1:
+            self.sync_concurrently(pipelines, max_workers)
+        else:
+            for pipeline in pipelines:
+                if self.should_skip(pipeline):
+                    continue
+                self.state = pipeline.sync(self.state)
+
+        save_state(self.state)
+        downloads.shutdown()
+
+    def get_account_runners(self, document, session=None):
+        runners = []
+        for account in accounts.get_accounts(self.config, session):
+            args = SimpleNamespace(config=account.config,
+                                   state=document.get(account.id),
+                                   catalog=self.catalog)
+            runners.append((account.id, LeverRunner(args, account.client, self.available_streams)))
+        return runners
+
+    def sync_accounts(self):
+        """Syncs every entry of `accounts` in this process.
+
+        The pipelines of all accounts go through one pool of
+        `max_concurrent_streams` workers and one pool of HTTP connections.
+        Each account keeps its own client, rate limiter and state, stored
+        under `accounts` in a single state document. A failing account
+        doesn't stop the others.
+        """
+        if any(dict(self.config, **entry).get('activate_version') for entry in self.config['accounts']):
+            # Every account would activate its own version of the shared
+            # tables, dropping the rows of the accounts synced before it
+            raise RuntimeError('activate_version cannot be used with accounts')
+
+        max_workers = int(self.config.get('max_concurrent_streams', 1))
+        session = accounts.build_session(max(max_workers * 2, 10))
+        document = share_document(self.state)
+        runners = self.get_account_runners(document, session)
+
+        jobs = []
+        shared_states = {}
+        for account_id, runner in runners:
+            pipelines = accounts.run_as(account_id, runner.prepare_sync)
+            shared_states[account_id] = accounts.run_as(account_id, share_state, runner.state)
+            jobs.extend((account_id, runner, pipeline) for pipeline in pipelines)
+
+        LOGGER.info('Syncing %s stream pipelines of %s accounts with up to %s workers',
+                    len(jobs), len(runners), max_workers)
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                (account_id, executor.submit(accounts.run_as, account_id, runner.sync_pipeline,
+                                             shared_states[account_id], pipeline, max_workers > 1))
+                for account_id, runner, pipeline in jobs
+            ]
+            for account_id, future in futures:
+                try:
+                    future.result()
+                except Exception as ex:  # pylint: disable=broad-except
+                    LOGGER.critical('Account %s failed: %s', account_id, ex)
+                    errors.append(ex)
+
+        for account_id, runner in runners:
+            accounts.run_as(account_id, runner.finish_account)
+
+        self.state = unshare_document()
+        session.close()
+
+        if errors:
+            raise errors[0]
+
+    def finish_account(self):
+        self.state = unshare_state()
+        save_state(self.state)
+        downloads.shutdown()
+
+    def do_sync(self, writer=None):
+        LOGGER.info("Starting sync.")
+
+        output.configure(self.config, writer)
+        deadline.configure(self.config)
+        tracing.configure(self.config)
+
+        stored_state = output.read_state()
+        if not self.state and stored_state:
+            LOGGER.info('Resuming from the state stored in the database.')
+            self.state = stored_state
+        transform.configure(self.config, self.get_projections())
+
+        # On SIGTERM or once max_runtime has passed no new windows, pages or
+        # streams are started; whatever is in flight finishes and the final
+        # STATE covers all of it.
+        previous_handler = deadline.install_signal_handler()
+        try:
+            if self.config.get('accounts'):
+                self.sync_accounts()
+            else:
+                self.sync_account()
+        finally:
+            deadline.restore_signal_handler(previous_handler)
+            transform.shutdown()
+            tracing.close()
+            output.close()
+
+        if deadline.STOP.is_set():
+            LOGGER.info('Sync stopped early, the next run continues from the saved state.')
+
+    def get_plan(self):
+        streams, inline_child_catalogs = self.get_streams_to_replicate()
+        pipelines = build_pipelines(streams, inline_child_catalogs)
+        return SyncPlanner(self.config, self.client).plan(pipelines)
+
+    def plan(self):
+        LOGGER.info("Starting sync plan.")
+
+        if self.config.get('accounts'):
+            document = StateDocument(self.state)
+            return {'accounts': {
+                account_id: accounts.run_as(account_id, runner.get_plan)
+                for account_id, runner in self.get_account_runners(document)
+            }}
+        return self.get_plan()
@@ -0,0 +1,100 @@
+import contextvars
+import threading
+
+import singer
+
+from tap_lever.streams import cache as stream_cache
+
+LOGGER = singer.get_logger()  # noqa
+
+
+class Pipeline:
+    """A root stream together with the streams that depend on it.
+
+    Children declare their parent with `PARENT`. Children that are
+    `SYNC_WITH_PARENT` are handed to the root as catalogs and fetched inline
+    for every parent page; the others read the root's records, either from the
+    cache once the root has finished or, when pipelined, from a bounded
+    channel while the root is still paging.
+    """
+
+    def __init__(self, root, inline_catalogs=None):
+        self.root = root
+        self.inline_catalogs = inline_catalogs or {}
+        self.children = []
+
+    @property
+    def tables(self):
+        return [self.root.TABLE] + list(self.inline_catalogs) + \
+            [child.TABLE for child in self.children]
+
+    def sync_root(self):
+        if self.inline_catalogs:
+            self.root.sync(self.inline_catalogs)
+        else:
+            self.root.sync()
+        return self.root.state
+
+    def sync(self, state, pipelined=False, buffer_size=stream_cache.DEFAULT_CHANNEL_SIZE):
+        self.root.state = state
+        self.root.child_tables = [child.TABLE for child in self.children]
+
+        if pipelined and self.children:
+            return self.sync_pipelined(state, buffer_size)
+
+        state = self.sync_root()
+        for child in self.children:
+            child.state = state
+            child.sync()
+            state = child.state
+        return state
+
+    def sync_pipelined(self, state, buffer_size):
+        errors = []
+        threads = []
+
+        for child in self.children:
+            child.state = state
+            child.parent_channel = stream_cache.subscribe(self.root.TABLE, buffer_size)
+            # Copying the context keeps the child on the parent's account
+            thread = threading.Thread(target=contextvars.copy_context().run,
+                                      args=(self.sync_child, child, errors),
+                                      name='sync-{}'.format(child.TABLE))
+            thread.start()
+            threads.append(thread)
+
+        try:
+            state = self.sync_root()
+        finally:
+            stream_cache.close(self.root.TABLE)
+            for thread in threads:
+                thread.join()
+
+        if errors:
+            raise errors[0]
+        return state
+
+    def sync_child(self, child, errors):
+        try:
+            child.sync()
+        except Exception as ex:  # pylint: disable=broad-except
+            LOGGER.critical('Stream %s failed: %s', child.TABLE, ex)
+            child.parent_channel.abandon()
+            errors.append(ex)
+
+
+def build_pipelines(streams, inline_child_catalogs):
+    pipelines = []
+    by_table = {}
+
+    for stream in streams:
+        if stream.PARENT is None:
+            pipeline = Pipeline(stream, inline_child_catalogs.get(stream.TABLE))
+            pipelines.append(pipeline)
+            by_table[stream.TABLE] = pipeline
+
+    for stream in streams:
+        if stream.PARENT is not None:
+            by_table[stream.PARENT].children.append(stream)
+
+    return pipelines
@@ -1,7 +1,11 @@
+import copy
 import json
+import threading
+
 import singer
 
 from dateutil.parser import parse
+from tap_lever import accounts, budget, hints, output, retries, tracing, tuning
 
 LOGGER = singer.get_logger()
 
@@ -38,13 +42,107 @@ def incorporate(state, table, field, value):
     return new_state
 
 
+class SharedState:
+    """State shared by streams syncing on different threads.
+
+    Each thread works on its own copy of the state and declares the tables it
+    owns with `claim`. Saving merges only those tables' bookmarks into the
+    shared document, so one stream can't roll back another's progress.
+    """
+
+    def __init__(self, state):
+        self.state = copy.deepcopy(state)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def claim(self, tables):
+        self.local.tables = set(tables)
+
+    def merge(self, state):
+        tables = getattr(self.local, 'tables', set())
+        bookmarks = state.get('bookmarks', {})
+
+        with self.lock:
+            shared_bookmarks = self.state.setdefault('bookmarks', {})
+            for table in tables:
+                if table in bookmarks:
+                    shared_bookmarks[table] = copy.deepcopy(bookmarks[table])
+                else:
+                    shared_bookmarks.pop(table, None)
+
+            return copy.deepcopy(self.state)
+
+    def snapshot(self):
+        with self.lock:
+            return copy.deepcopy(self.state)
+
+
+class StateDocument:
+    """The state of a multi-account sync: every account's own state document
+    kept under `accounts`, keyed by account id."""
+
+    def __init__(self, state):
+        self.state = copy.deepcopy(state)
+        self.accounts = self.state.setdefault('accounts', {})
+
+    def get(self, account_id):
+        return copy.deepcopy(self.accounts.get(account_id, {}))
+
+    def update(self, account_id, state):
+        # Only called under the output lock. Account entries are replaced,
+        # never modified, so a shallow copy is enough to write them out.
+        self.accounts[account_id] = copy.deepcopy(state)
+        return dict(self.state, accounts=dict(self.accounts))
+
+
+SHARED_STATES = {}
+DOCUMENT = None
+
+
+def share_state(state):
+    shared = SHARED_STATES[accounts.current()] = SharedState(state)
+    return shared
+
+
+def unshare_state():
+    return SHARED_STATES.pop(accounts.current()).snapshot()
+
+
+def share_document(state):
+    global DOCUMENT  # pylint: disable=global-statement
+    DOCUMENT = StateDocument(state)
+    return DOCUMENT
+
+
+def unshare_document():
+    global DOCUMENT  # pylint: disable=global-statement
+    document, DOCUMENT = DOCUMENT, None
+    return document.state
+
+
 def save_state(state):
-    if not state:
-        return
+    # Merging and writing happen under the output lock so STATE messages
+    # from concurrent streams go out in the order they were merged.
+    with output.LOCK, tracing.span('save_state'):
+        shared = SHARED_STATES.get(accounts.current())
+        if shared is not None:
+            state = shared.merge(state)
+
+        state = retries.attach(state)
+        state = hints.attach(state)
+        state = budget.attach(state)
+        state = tuning.attach(state)
+
+        if DOCUMENT is not None:
+            state = DOCUMENT.update(accounts.current(), state)
+
+        if not state:
+            output.commit()
+            return
 
-    LOGGER.info('Updating state.')
+        LOGGER.info('Updating state.')
 
-    singer.write_state(state)
+        output.write_state(state)
 
 
 def load_state(filename):
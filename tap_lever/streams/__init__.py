@@ -18,8 +18,8 @@ from tap_lever.streams.stages import StagesStream
 from tap_lever.streams.users import UsersStream
 
 AVAILABLE_STREAMS = [
-    CandidateStream,  # must sync first to fill CACHE
-    OpportunityStream,  # must sync first to fill CACHE
+    CandidateStream,
+    OpportunityStream,
     ArchiveReasonsStream,
     CandidateApplicationsStream,
     CandidateOffersStream,
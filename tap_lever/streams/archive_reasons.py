@@ -7,6 +7,8 @@ LOGGER = singer.get_logger()  # noqa
 class ArchiveReasonsStream(BaseStream):
     API_METHOD = "GET"
     TABLE = "archive_reasons"
+    CHANGE_DETECTION = True
+    TABLE_VERSIONS = True
 
     @property
     def path(self):
@@ -1,6 +1,7 @@
 import inspect
 import math
 import os
+import time
 import pytz
 import singer
 import singer.utils
@@ -9,14 +10,21 @@ import singer.metrics
 from datetime import timedelta, datetime
 
 from singer import metadata as meta
+from tap_lever import budget, deadline, hints, output, retries, tracing, transform, tuning
 from tap_lever.streams import cache as stream_cache
 from tap_lever.config import get_config_start_date
+from tap_lever.fingerprints import ChangeTracker, FingerprintStore, DELETED_AT
+from tap_lever.pagination import get_prefetch_depth, paginate
 from tap_lever.state import incorporate, save_state, \
     get_last_record_value_for_table
+from tap_lever.transform import build_projection, project_record, transform_records
+from tap_lever.windows import add_range, covers, dump_ranges, load_ranges
 
 
 LOGGER = singer.get_logger()
 
+BASE_URL = 'https://api.lever.co/v1'
+
 
 def is_stream_selected(stream):
     stream_metadata = meta.to_map(stream.metadata)
@@ -27,6 +35,29 @@ def is_stream_selected(stream):
     return inclusion == 'automatic'
 
 
+def get_selected_fields(schema, metadata):
+    selected_fields = set()
+    for field_name in schema.get('properties', {}):
+        breadcrumb = ('properties', field_name)
+        selected = meta.get(metadata, breadcrumb, 'selected')
+        inclusion = meta.get(metadata, breadcrumb, 'inclusion')
+
+        if inclusion == 'automatic':
+            selected_fields.add(field_name)
+        elif selected is not False and inclusion != 'unsupported':
+            selected_fields.add(field_name)
+
+    return selected_fields
+
+
+def has_nested_metadata(metadata):
+    return any(len(breadcrumb) > 2 for breadcrumb in metadata)
+
+
+def get_partition(window_start):
+    return 'window={}'.format(window_start.strftime('%Y-%m-%d'))
+
+
 class BaseStream:
     KEY_PROPERTIES = ['id']
     CACHE_RESULTS = False
@@ -35,6 +66,23 @@ class BaseStream:
     REQUIRES = []
     REPLICATION_METHOD = 'FULL_TABLE'
     REPLICATION_KEYS = []
+    # Table of the stream whose records this stream is fetched for. Children
+    # synced with their parent are fetched inline for every parent page
+    # instead of reading the parent's records from the cache or a channel.
+    PARENT = None
+    SYNC_WITH_PARENT = False
+    # Full table streams that can emit only new or changed rows when
+    # `change_detection` is enabled
+    CHANGE_DETECTION = False
+    # Full table streams that can stamp a table version on their records
+    # and activate it once complete when `activate_version` is enabled
+    TABLE_VERSIONS = False
+    # Child streams for which Lever answers ResourceNotFound instead of an
+    # empty list when a parent has no records
+    MISSING_MEANS_EMPTY = False
+    # Child streams that remember parents without records, so they aren't
+    # asked for again while the parent is unchanged
+    CACHE_EMPTY_PARENTS = False
 
     def __init__(self, config, state, catalog, client):
         self.config = config
@@ -42,6 +90,13 @@ class BaseStream:
         self.catalog = catalog
         self.client = client
         self.substreams = []
+        self.projection = None
+        self.parent_channel = None
+        # The tables reading this stream's records, set by the pipeline
+        self.child_tables = []
+        self.parents_seen = 0
+        self.change_tracker = None
+        self.version = None
 
     def get_class_path(self):
         return os.path.dirname(inspect.getfile(self.__class__))
@@ -68,7 +123,13 @@ class BaseStream:
             s.stream for s in catalog.streams if is_stream_selected(s)
         ]
 
-        return set(cls.REQUIRES).issubset(selected_streams)
+        return set(cls.get_requirements()).issubset(selected_streams)
+
+    @classmethod
+    def get_requirements(cls):
+        if cls.PARENT is not None:
+            return [cls.PARENT] + cls.REQUIRES
+        return list(cls.REQUIRES)
 
     @classmethod
     def matches_catalog(cls, stream_catalog):
@@ -108,11 +169,34 @@ class BaseStream:
             'metadata': singer.metadata.to_list(mdata)
         }]
 
+    def uses_change_detection(self):
+        return self.CHANGE_DETECTION and bool(self.config.get('change_detection'))
+
+    def uses_table_versions(self):
+        if not (self.TABLE_VERSIONS and self.config.get('activate_version')):
+            return False
+        if not output.supports_versions():
+            LOGGER.warning('Table versions are only written to RECORD messages, '
+                           'not activating a version for {}'.format(self.TABLE))
+            return False
+        return True
+
+    def emits_tombstones(self):
+        return self.uses_change_detection() and bool(self.config.get('emit_tombstones'))
+
     def write_schema(self):
-        singer.write_schema(
+        schema = self.catalog.schema.to_dict()
+
+        if self.emits_tombstones():
+            schema['properties'][DELETED_AT] = {
+                'type': ['null', 'string'],
+                'format': 'date-time',
+            }
+
+        output.write_schema(
             self.catalog.stream,
-            self.catalog.schema.to_dict(),
-            key_properties=self.catalog.key_properties)
+            schema,
+            self.catalog.key_properties)
 
     def sync(self):
         LOGGER.info('Syncing stream {} with {}'
@@ -121,10 +205,113 @@ class BaseStream:
 
         self.write_schema()
 
-        return self.sync_data()
+        with tracing.span('sync', table=self.TABLE), budget.charging(self.TABLE):
+            return self.sync_data()
+
+    def get_base_url(self):
+        return self.config.get('base_url', BASE_URL).rstrip('/')
 
     def get_url(self):
-        return 'https://api.lever.co/v1{}'.format(self.path)
+        return '{}{}'.format(self.get_base_url(), self.path)
+
+    def get_parent_records(self):
+        if self.parent_channel is not None:
+            LOGGER.info('Reading {} from the {} stream as they are synced'
+                        .format(self.PARENT, self.PARENT))
+            return self.parent_channel
+
+        records = stream_cache.get(self.PARENT)
+        LOGGER.info('Found {} {} in cache'.format(len(records), self.PARENT))
+        return records
+
+    def stopping(self):
+        """Whether to stop taking new work, because the sync is stopping or
+        this stream has spent its share of the request budget."""
+        return deadline.stopping() or not budget.allows(self.TABLE)
+
+    def is_empty_for(self, parent):
+        """Whether the parent record shows there is nothing to fetch for it."""
+        cache = hints.get_cache()
+        return self.CACHE_EMPTY_PARENTS and cache is not None and \
+            cache.is_empty(self.TABLE, parent["id"], parent.get("updatedAt"))
+
+    def remember_empty(self, parent):
+        cache = hints.get_cache()
+        if self.CACHE_EMPTY_PARENTS and cache is not None:
+            cache.add(self.TABLE, parent["id"], parent.get("updatedAt"))
+
+    def sync_parent(self, parent_id, parent=None):
+        """Fetches this child stream's records for one parent.
+
+        `parent` is the parent record as returned by the API, when at hand,
+        and is used to skip requests that would come back empty. Failures
+        are put on the retry queue, when one is configured, so a single bad
+        parent doesn't abort the run. Returns whether the fetch succeeded.
+        """
+        queue = retries.get_queue()
+
+        # Parents are handed over in the order the parent stream published
+        # them, which places them in its windows
+        index = None
+        if parent is not None:
+            index, self.parents_seen = self.parents_seen, self.parents_seen + 1
+
+        if parent is not None and self.is_empty_for(parent):
+            LOGGER.info("Skipping %s for %s %s, it has none", self.TABLE, self.PARENT, parent_id)
+            return True
+
+        # Children synced inline belong to the parent's page, which is always
+        # finished; the others leave the parents not yet reached to the next
+        # run once the sync is stopping.
+        if queue is not None and not self.SYNC_WITH_PARENT and self.stopping():
+            position = None if index is None else stream_cache.get_window_start(self.PARENT, index)
+            queue.defer(self.TABLE, parent_id, position)
+            return False
+
+        try:
+            records = self.sync_parent_records(parent_id)
+        except retries.CHILD_ERRORS as e:
+            if self.MISSING_MEANS_EMPTY and "ResourceNotFound" in str(e):
+                LOGGER.info("%s %s has no %s", self.PARENT, parent_id, self.TABLE)
+                records = []
+            elif queue is None:
+                raise
+            else:
+                LOGGER.warning("Failed to fetch %s for %s %s, will retry: %s",
+                               self.TABLE, self.PARENT, parent_id, e)
+                queue.add(self.TABLE, parent_id, e)
+                return False
+
+        if parent is not None and records == []:
+            self.remember_empty(parent)
+        if queue is not None:
+            queue.remove(self.TABLE, parent_id)
+        return True
+
+    def sync_parent_records(self, parent_id):
+        raise NotImplementedError
+
+    def finish_parents(self):
+        """Called by child streams that aren't synced inline once they have
+        been handed every parent."""
+        queue = retries.get_queue()
+        if queue is not None:
+            queue.finish_deferred(self.TABLE, self.stopping())
+        self.retry_failed_parents()
+
+    def retry_failed_parents(self):
+        queue = retries.get_queue()
+        if queue is None or self.stopping():
+            return
+
+        failed = queue.pending(self.TABLE)
+        if not failed:
+            return
+
+        LOGGER.info("Retrying %s for %s failed %s", self.TABLE, len(failed), self.PARENT)
+        recovered = sum(1 for parent_id in failed if self.sync_parent(parent_id))
+        LOGGER.info("Recovered %s of %s failed %s for %s",
+                    recovered, len(failed), self.PARENT, self.TABLE)
 
     def get_params(self, _next):
         params = {"limit": 100}
@@ -138,6 +325,17 @@ class BaseStream:
 
         LOGGER.info('Syncing data for {}'.format(table))
 
+        if self.uses_change_detection():
+            self.change_tracker = ChangeTracker(self.KEY_PROPERTIES, self.load_fingerprints())
+
+        if self.uses_table_versions():
+            self.version = int(time.time() * 1000)
+            # Activating at the start would hide the previous version's rows
+            # until this one is complete, so that's only done on the first
+            # sync, to create the table.
+            if singer.bookmarks.get_bookmark(self.state, table, 'version') is None:
+                output.write_activate_version(table, self.version)
+
         url = self.get_url()
         params = self.get_params(_next=None)
         resources = self.sync_paginated(url, params)
@@ -146,50 +344,125 @@ class BaseStream:
             stream_cache.add(table, resources)
             LOGGER.info('Added {} {}s to cache'.format(len(resources), table))
 
+        if self.change_tracker is not None:
+            self.finish_change_detection()
+
+        if self.version is not None:
+            output.write_activate_version(table, self.version)
+            self.state = singer.bookmarks.write_bookmark(self.state, table, 'version', self.version)
+
         LOGGER.info('Reached end of stream, moving on.')
         save_state(self.state)
         return self.state
 
+    def finish_change_detection(self):
+        table = self.TABLE
+        tracker = self.change_tracker
+
+        if self.emits_tombstones():
+            tombstones = tracker.tombstones(singer.utils.strftime(singer.utils.now()))
+            if tombstones:
+                LOGGER.info('Writing {} tombstones for {}'.format(len(tombstones), table))
+                output.write_records(table, tombstones)
+
+        store = self.get_fingerprint_store()
+        if store is None:
+            self.state = singer.bookmarks.write_bookmark(
+                self.state, table, 'fingerprints', tracker.fingerprints)
+            return
+
+        previous = singer.bookmarks.get_bookmark(self.state, table, 'fingerprints_file')
+        name = store.save(table, tracker.fingerprints, previous)
+        self.state = singer.bookmarks.write_bookmark(self.state, table, 'fingerprints_file', name)
+        self.state = singer.bookmarks.clear_bookmark(self.state, table, 'fingerprints')
+
+    def get_fingerprint_store(self):
+        if not self.config.get('fingerprint_dir'):
+            return None
+        return FingerprintStore(self.config['fingerprint_dir'])
+
+    def load_fingerprints(self):
+        table = self.TABLE
+        store = self.get_fingerprint_store()
+        # Fingerprints kept in the bookmark by earlier runs are still read,
+        # and moved to the store at the end of the run
+        fingerprints = singer.bookmarks.get_bookmark(self.state, table, 'fingerprints')
+        if store is None or fingerprints is not None:
+            return fingerprints
+        return store.load(table, singer.bookmarks.get_bookmark(self.state, table, 'fingerprints_file'))
+
+    def paginate(self, url, params=None):
+        return paginate(self.client, url, self.API_METHOD, params,
+                        depth=get_prefetch_depth(self.config))
+
     def sync_paginated(self, url, params=None):
         table = self.TABLE
-        _next = True
         page = 1
 
         all_resources = []
         transformer = singer.Transformer(singer.UNIX_MILLISECONDS_INTEGER_DATETIME_PARSING)
-        while _next is not None:
-            result = self.client.make_request(url, self.API_METHOD, params=params)
-            _next = result.get('next')
-            data = self.get_stream_data(result['data'], transformer)
+        for result, data in self.transform_pages(self.paginate(url, params), transformer):
+            with tracing.span('page', table=table, page=page, records=len(data)):
+                records = data
+                if self.change_tracker is not None:
+                    records = self.change_tracker.changed(data)
 
-            with singer.metrics.record_counter(endpoint=table) as counter:
-                singer.write_records(
-                    table,
-                    data)
-                counter.increment(len(data))
-                all_resources.extend(data)
+                with singer.metrics.record_counter(endpoint=table) as counter:
+                    output.write_records(table, records, version=self.version)
+                    counter.increment(len(records))
+                    all_resources.extend(data)
 
-            if _next:
-                params['offset'] = _next
+                if self.CACHE_RESULTS:
+                    stream_cache.publish(table, data)
 
             LOGGER.info('Synced page {} for {}'.format(page, self.TABLE))
             page += 1
         transformer.log_warning()
         return all_resources
 
+    def get_projection(self):
+        # Worked out once instead of for every page
+        if self.projection is None:
+            self.projection = build_projection(self.catalog)
+
+        return self.projection
+
+    def prepare_records(self, records):
+        """Called on the records of a page before they are transformed."""
+
     def get_stream_data(self, result, transformer):
-        metadata = {}
+        self.prepare_records(result)
+        projection = self.get_projection()
 
-        if self.catalog.metadata is not None:
-            metadata = singer.metadata.to_map(self.catalog.metadata)
+        if output.writes_raw_records():
+            return [project_record(record, projection[1]) for record in result]
 
-        return [
-            transformer.transform(record, self.catalog.schema.to_dict(), metadata)
-            for record in result
-        ]
+        with tracing.span('transform', table=self.TABLE, records=len(result)):
+            return transform_records(result, projection, transformer)
+
+    def transform_pages(self, pages, transformer):
+        """Yields `(page, records)` for every page, with the page's records
+        transformed, in worker processes when `transform_workers` is set."""
+        pool = transform.get_pool()
+        if pool is None or output.writes_raw_records() or not pool.handles(self.catalog.stream):
+            for result in pages:
+                yield result, self.get_stream_data(result['data'], transformer)
+            return
+
+        yield from pool.map_pages(self.catalog.stream, pages, self.prepare_records, transformer)
 
 class TimeRangeStream(BaseStream):
     RANGE_FIELD = 'updated_at'
+    INTERVAL = timedelta(days=7)
+
+    def __init__(self, config, state, catalog, client):
+        super().__init__(config, state, catalog, client)
+        self.interval = self.INTERVAL
+        self.deferred_start = None
+
+    def get_interval(self):
+        # The window size learned by earlier runs with `self_tuning`
+        return tuning.get_interval(self.TABLE, self.INTERVAL)
 
     def get_params(self, start, end):
         return {
@@ -198,21 +471,118 @@ class TimeRangeStream(BaseStream):
             "limit": 100
         }
 
-    def sync_data(self):
-        table = self.TABLE
+    def get_deferred_start(self):
+        # Where child streams stopped by an earlier run need parents from
+        queue = retries.get_queue()
+        if queue is None:
+            return None
+        return queue.get_deferred(self.child_tables)
 
-        date = get_last_record_value_for_table(self.state, table)
+    def get_start_date(self):
+        date = get_last_record_value_for_table(self.state, self.TABLE)
 
         if date is None:
             date = get_config_start_date(self.config)
 
-        interval = timedelta(days=7)
+        if self.deferred_start is not None and self.deferred_start < date:
+            date = self.deferred_start
+        return date
+
+    def newest_first(self):
+        return self.config.get('window_order') == 'newest_first'
+
+    def get_all_windows(self, until):
+        windows = []
+        date = self.get_start_date()
+        while date < until:
+            windows.append(date)
+            date = date + self.interval
+        return windows
+
+    def get_windows(self):
+        """Yields the start of every window to sync.
+
+        By default windows are walked forward from the bookmark. With
+        `window_order` set to `newest_first` the most recent window comes
+        first and older ones follow, skipping those already completed by an
+        interrupted run.
+        """
+        if not self.newest_first():
+            date = self.get_start_date()
+            while date < datetime.now(pytz.utc):
+                yield date
+                date = date + self.interval
+            return
+
+        self.windows_until = datetime.now(pytz.utc)
+        completed = load_ranges(singer.bookmarks.get_bookmark(self.state, self.TABLE, 'completed_ranges'))
+        for date in reversed(self.get_all_windows(self.windows_until)):
+            end = min(date + self.interval, self.windows_until)
+            # Windows holding parents a child stream didn't reach are synced
+            # again even when completed
+            needed = self.deferred_start is not None and end > self.deferred_start
+            if not needed and covers(completed, date, end):
+                LOGGER.info('Window starting {} was already synced'.format(date.isoformat()))
+                continue
+            yield date
+
+    def complete_window(self, date, started_at):
+        table = self.TABLE
+        tuning.complete_window(table, date, min(date + self.interval, started_at))
+
+        if not self.newest_first():
+            self.state = incorporate(self.state,
+                                     table,
+                                     self.RANGE_FIELD,
+                                     date.isoformat())
+            return
+
+        # Only what had been updated when the window was requested is
+        # covered, the rest of it is picked up by the next run
+        completed = load_ranges(singer.bookmarks.get_bookmark(self.state, table, 'completed_ranges'))
+        completed = add_range(completed, date, min(date + self.interval, started_at))
+        self.state = singer.bookmarks.write_bookmark(
+            self.state, table, 'completed_ranges', dump_ranges(completed))
+
+    def finish_windows(self):
+        # Once every window up to the start of the run is done, the
+        # completed ranges collapse back into the plain bookmark.
+        if not self.newest_first():
+            return
+
+        table = self.TABLE
+        completed = load_ranges(singer.bookmarks.get_bookmark(self.state, table, 'completed_ranges'))
+        windows = self.get_all_windows(self.windows_until)
+        if not all(covers(completed, date, min(date + self.interval, self.windows_until))
+                   for date in windows):
+            return
+
+        if windows:
+            self.state = incorporate(self.state, table, self.RANGE_FIELD, windows[-1].isoformat())
+        self.state = singer.bookmarks.clear_bookmark(self.state, table, 'completed_ranges')
+        save_state(self.state)
+
+    def sync_data(self):
+        table = self.TABLE
+        self.interval = self.get_interval()
+        # Read once, as child streams finishing change it
+        self.deferred_start = self.get_deferred_start()
+        stream_cache.reset_windows(table)
+        if self.deferred_start is not None:
+            LOGGER.info('Syncing {} from {} again, where its child streams stopped'
+                        .format(table, self.deferred_start.isoformat()))
 
         all_resources = []
-        while date < datetime.now(pytz.utc):
-            res = self.sync_data_for_period(date, interval)
+        for date in self.get_windows():
+            if self.stopping():
+                LOGGER.info('Stopping {} before the window starting {}'
+                            .format(table, date.isoformat()))
+                break
+
+            res = self.sync_data_for_period(date, self.interval)
             all_resources.extend(res)
-            date = date + interval
+        else:
+            self.finish_windows()
 
         if self.CACHE_RESULTS:
             stream_cache.add(table, all_resources)
@@ -225,20 +595,23 @@ class TimeRangeStream(BaseStream):
 
         updated_after = date
         updated_before = updated_after + interval
+        started_at = datetime.now(pytz.utc)
 
         LOGGER.info(
             'Syncing data from {} to {}'.format(
                 updated_after.isoformat(),
                 updated_before.isoformat()))
 
+        output.set_partition(table, get_partition(updated_after))
+        stream_cache.start_window(table, updated_after)
+
         params = self.get_params(updated_after, updated_before)
         url = self.get_url()
-        res = self.sync_paginated(url, params)
+        with tracing.span('window', table=table, start=updated_after.isoformat()):
+            res = self.sync_paginated(url, params)
 
-        self.state = incorporate(self.state,
-                                 table,
-                                 self.RANGE_FIELD,
-                                 date.isoformat())
+        tuning.count(table, len(res))
+        self.complete_window(date, started_at)
 
         save_state(self.state)
         return res
@@ -1,8 +1,90 @@
+import queue
+import threading
+
+from tap_lever import accounts
 
 CACHE = {}
+CHANNELS = {}
+# Per parent table, the records published so far and where each window's
+# records start, as `(index, window start)`
+COUNTS = {}
+WINDOWS = {}
+
+DEFAULT_CHANNEL_SIZE = 1000
+
+_CLOSED = object()
+
+
+def scoped(key):
+    # Accounts syncing side by side each get their own entries
+    account_id = accounts.current()
+    return key if account_id is None else (account_id, key)
 
 def add(key, val):
-    CACHE[key] = val
+    CACHE[scoped(key)] = val
 
 def get(key):
-    return CACHE.get(key)
+    return CACHE.get(scoped(key))
+
+def reset_windows(key):
+    COUNTS.pop(scoped(key), None)
+    WINDOWS.pop(scoped(key), None)
+
+def start_window(key, start):
+    WINDOWS.setdefault(scoped(key), []).append((COUNTS.get(scoped(key), 0), start))
+
+def get_window_start(key, index):
+    """The earliest start of the windows holding the records published
+    from `index` on, or None for a parent that isn't synced by window."""
+    windows = WINDOWS.get(scoped(key), [])
+    holding = [position for position, (first, _) in enumerate(windows) if first <= index]
+    if not holding:
+        return None
+    return min(start for _, start in windows[holding[-1]:])
+
+
+class Channel:
+    """Bounded queue carrying a parent stream's records to one child stream
+    while the parent is still paging."""
+
+    def __init__(self, maxsize=DEFAULT_CHANNEL_SIZE):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.abandoned = threading.Event()
+
+    def put(self, item):
+        # A child that failed stops reading, so don't block the parent on it
+        while not self.abandoned.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def close(self):
+        self.put(_CLOSED)
+
+    def abandon(self):
+        self.abandoned.set()
+
+    def __iter__(self):
+        while True:
+            item = self.queue.get()
+            if item is _CLOSED:
+                return
+            yield item
+
+
+def subscribe(key, maxsize=DEFAULT_CHANNEL_SIZE):
+    channel = Channel(maxsize)
+    CHANNELS.setdefault(scoped(key), []).append(channel)
+    return channel
+
+def publish(key, records):
+    COUNTS[scoped(key)] = COUNTS.get(scoped(key), 0) + len(records)
+    for channel in CHANNELS.get(scoped(key), []):
+        for record in records:
+            channel.put(record)
+
+def close(key):
+    for channel in CHANNELS.pop(scoped(key), []):
+        channel.close()
@@ -1,5 +1,5 @@
 import singer
-from tap_lever.streams import cache as stream_cache
+from tap_lever import output
 from tap_lever.streams.base import BaseStream
 
 LOGGER = singer.get_logger()  # noqa
@@ -8,6 +8,7 @@ LOGGER = singer.get_logger()  # noqa
 class CandidateOffersStream(BaseStream):
     API_METHOD = "GET"
     TABLE = "candidate_offers"
+    PARENT = "candidates"
 
     @property
     def path(self):
@@ -15,25 +16,26 @@ class CandidateOffersStream(BaseStream):
 
     def get_url(self, candidate):
         _path = self.path.format(candidate_id=candidate)
-        return "https://api.lever.co/v1{}".format(_path)
+        return "{}{}".format(self.get_base_url(), _path)
 
     def sync_data(self):
-        candidates = stream_cache.get("candidates")
-        LOGGER.info("Found {} candidates in cache".format(len(candidates)))
+        for i, candidate in enumerate(self.get_parent_records()):
+            LOGGER.info("Fetching offers for candidate {}".format(i + 1))
+            self.sync_parent(candidate["id"], candidate)
 
+        self.finish_parents()
+
+    def sync_parent_records(self, candidate_id):
         params = self.get_params(_next=None)
-        for i, candidate in enumerate(candidates):
-            LOGGER.info(
-                "Fetching offers for candidate {} of {}".format(i + 1, len(candidates))
-            )
-            candidate_id = candidate["id"]
-            url = self.get_url(candidate_id)
-            resources = self.sync_paginated(url, params)
+        url = self.get_url(candidate_id)
+        resources = self.sync_paginated(url, params)
 
 
 class OpportunityOffersStream(BaseStream):
     API_METHOD = "GET"
     TABLE = "opportunity_offers"
+    PARENT = "opportunities"
+    SYNC_WITH_PARENT = True
 
     @property
     def path(self):
@@ -41,41 +43,27 @@ class OpportunityOffersStream(BaseStream):
 
     def get_url(self, opportunity):
         _path = self.path.format(opportunity_id=opportunity)
-        return "https://api.lever.co/v1{}".format(_path)
+        return "{}{}".format(self.get_base_url(), _path)
 
     # NB: We chose to change this function to NOT call base's
     # sync_paginated since there was a request to add the parent id
     # (opportunityId) to the records, and there was no natural place to do
     # this
-    def sync_data(self, opportunity_id):
+    def sync_parent_records(self, opportunity_id):
         params = self.get_params(_next=None)
         url = self.get_url(opportunity_id)
 
         transformer = singer.Transformer(singer.UNIX_MILLISECONDS_INTEGER_DATETIME_PARSING)
         with singer.metrics.record_counter(endpoint=self.TABLE) as counter:
-            for page in self.paginate(url, params, opportunity_id):
-                self.add_parent_id(page, opportunity_id)
-                transformed_data = self.get_stream_data(page, transformer)
-                singer.write_records(self.TABLE, transformed_data)
-                counter.increment(len(page))
+            for page, result in enumerate(self.paginate(url, params), 1):
+                data = result['data']
+                self.add_parent_id(data, opportunity_id)
+                transformed_data = self.get_stream_data(data, transformer)
+                output.write_records(self.TABLE, transformed_data)
+                counter.increment(len(data))
+                LOGGER.info('Synced page {} for {}'.format(page, self.TABLE))
         transformer.log_warning()
 
-    def paginate(self, url, params, opportunity_id):
-        _next = True
-        page = 1
-
-        while _next is not None:
-            result = self.client.make_request(url, self.API_METHOD, params=params)
-            _next = result.get('next')
-
-            yield result['data']
-
-            if _next:
-                params['offset'] = _next
-            LOGGER.info('Synced page {} for {}'.format(page, self.TABLE))
-            page += 1
-
-
     def add_parent_id(self, data, opportunity_id):
         for rec in data:
             rec['opportunityId'] = opportunity_id
@@ -1,10 +1,12 @@
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
 import singer
+from tap_lever import budget, output, tracing, tuning
 from tap_lever.client import OffsetInvalidException
-from tap_lever.streams import cache as stream_cache
-from tap_lever.streams.base import TimeRangeStream
-from tap_lever.state import incorporate, save_state, \
-    get_last_record_value_for_table
-from tap_lever.config import get_config_start_date
+from tap_lever.streams.base import TimeRangeStream, get_partition
+from tap_lever.state import save_state
+from dateutil.parser import parse
 from datetime import timedelta, datetime
 import pytz
 from .applications import OpportunityApplicationsStream
@@ -13,11 +15,91 @@ from .referrals import OpportunityReferralsStream
 from .resumes import OpportunityResumesStream
 LOGGER = singer.get_logger()  # noqa
 
+DEFAULT_PARTITION_AFTER = 5
+
+CHILD_STREAMS = [
+    OpportunityApplicationsStream,
+    OpportunityOffersStream,
+    OpportunityReferralsStream,
+    OpportunityResumesStream,
+]
+
+
+class WindowProgress:
+    """Tracks how far through a window the emitted opportunities reach.
+
+    Lever pages through a window in `updatedAt` order. When an offset token
+    expires, the window can be narrowed to start at the last emitted
+    `updatedAt` instead of being read again from the first page. Narrowing is
+    only used while every record seen so far confirms the ordering.
+    """
+
+    def __init__(self, range_field):
+        self.range_field = range_field
+        self.last = None
+        self.order = None
+        self.bounds = {}
+
+    def load(self, saved):
+        if saved:
+            self.last = saved.get('last')
+            self.order = saved.get('order')
+            self.bounds = saved.get('bounds', {})
+
+    def dump(self):
+        return {'last': self.last, 'order': self.order, 'bounds': self.bounds}
+
+    def observe(self, records):
+        for record in records:
+            updated_at = record.get('updatedAt')
+            if updated_at is None:
+                self.order = 'unsorted'
+                continue
+
+            if self.last is not None and updated_at != self.last:
+                order = 'desc' if updated_at < self.last else 'asc'
+                if self.order is None:
+                    self.order = order
+                elif self.order != order:
+                    self.order = 'unsorted'
+
+            self.last = updated_at
+
+    def narrow(self, params):
+        # Records sharing the boundary timestamp may straddle the expired
+        # page, so the boundary itself is included and read again.
+        if self.order == 'desc':
+            self.bounds = {self.range_field + '_end': self.last + 1}
+        elif self.order == 'asc':
+            self.bounds = {self.range_field + '_start': self.last}
+        else:
+            return False
+
+        params.update(self.bounds)
+        return True
+
+
+def skip_emitted(result, data, emitted):
+    """Drops the opportunities in `emitted` from a page and its transformed
+    records."""
+    fresh = [record for record in result['data'] if record['id'] not in emitted]
+    if len(fresh) == len(result['data']):
+        return result, data
+
+    ids = {record['id'] for record in fresh}
+    return dict(result, data=fresh), [record for record in data if record.get('id') in ids]
+
 
 class OpportunityStream(TimeRangeStream):
     API_METHOD = "GET"
     TABLE = "opportunities"
     KEY_PROPERTIES = ["id"]
+    INTERVAL = timedelta(days=1)
+
+    def __init__(self, config, state, catalog, client):
+        super().__init__(config, state, catalog, client)
+        # The child streams fetched with each page, set by sync
+        self.inline_tables = []
 
     @property
     def path(self):
@@ -30,129 +112,283 @@ class OpportunityStream(TimeRangeStream):
 
         self.write_schema()
 
-        return self.sync_data(child_streams)
+        self.inline_tables = [table for table, catalog in (child_streams or {}).items() if catalog]
+        with tracing.span('sync', table=self.TABLE), budget.charging(self.TABLE, self.inline_tables):
+            return self.sync_data(child_streams)
+
+    def stopping(self):
+        # Child streams can't stop in the middle of a page, so the page loop
+        # stops once any of them has spent its share of the request budget
+        return super().stopping() or not all(budget.allows(table) for table in self.inline_tables)
+
+    def get_child_streams(self, child_streams):
+        child_streams = child_streams or {}
+        return [
+            child_class(self.config, self.state, child_streams[child_class.TABLE], self.client)
+            for child_class in CHILD_STREAMS
+            if child_streams.get(child_class.TABLE)
+        ]
 
     def sync_paginated(self, url, params=None, updated_after=None, child_streams=None):
         table = self.TABLE
 
         transformer = singer.Transformer(singer.UNIX_MILLISECONDS_INTEGER_DATETIME_PARSING)
-        applications_stream = OpportunityApplicationsStream(self.config,
-                                                            self.state,
-                                                            child_streams.get('opportunity_applications'),
-                                                            self.client)
-        offers_stream = OpportunityOffersStream(self.config,
-                                                self.state,
-                                                child_streams.get('opportunity_offers'),
-                                                self.client)
-        referrals_stream = OpportunityReferralsStream(self.config,
-                                                      self.state,
-                                                      child_streams.get('opportunity_referrals'),
-                                                      self.client)
-        resumes_stream = OpportunityResumesStream(self.config,
-                                                  self.state,
-                                                  child_streams.get('opportunity_resumes'),
-                                                  self.client)
+        children = self.get_child_streams(child_streams)
         # Set up looping parameters (page is for logging consistency)
         finished_paginating = False
         page = singer.bookmarks.get_bookmark(self.state, table, "next_page") or 1
         _next = singer.bookmarks.get_bookmark(self.state, table, "offset")
+        progress = WindowProgress(self.RANGE_FIELD)
+        if _next and not self.is_offset_for(updated_after):
+            LOGGER.info('Bookmarked offset belongs to another window, starting from the first page.')
+            _next = None
+            page = 1
         if _next:
             params['offset'] = _next
+            progress.load(singer.bookmarks.get_bookmark(self.state, table, "window_progress"))
+            params.update(progress.bounds)
 
+        # Opportunities of the window emitted by this run, which partitions
+        # don't emit again
+        emitted = set()
         while not finished_paginating:
+            pages_synced = 0
             try:
-                result = self.client.make_request(url, self.API_METHOD, params=params)
-            except OffsetInvalidException as ex:
-                LOGGER.warning('Found invalid offset "%s", retrying without offset.', params['offset'])
-                params.pop("offset")
-                _next = None
-                page = 1
-                result = self.client.make_request(url, self.API_METHOD, params=params)
-            _next = result.get('next')
+                for result, data in self.transform_pages(self.paginate(url, params), transformer):
+                    progress.observe(result['data'])
+                    with tracing.span('page', table=table, page=page, records=len(data)):
+                        self.sync_page(result, data, page, updated_after, children, progress)
+                    emitted.update(record['id'] for record in result['data'])
+                    page += 1
+                    pages_synced += 1
+
+                    # The page's offset is bookmarked, so the next run picks
+                    # up right after it
+                    if result.get('next') and self.stopping():
+                        LOGGER.info('Stopping {} after page {}'.format(table, page - 1))
+                        transformer.log_warning()
+                        return False
+
+                    if result.get('next') and self.is_dense(pages_synced):
+                        transformer.log_warning()
+                        params.pop('offset', None)
+                        if not self.sync_partitioned(url, params, child_streams, emitted):
+                            return False
+                        break
+                finished_paginating = True
+            except OffsetInvalidException as error:
+                if not self.recover_offset(error, params, progress, pages_synced):
+                    page = 1
 
-            data = self.get_stream_data(result['data'], transformer)
+        transformer.log_warning()
+        self.state = singer.bookmarks.clear_bookmark(self.state, table, "offset")
+        self.state = singer.bookmarks.clear_bookmark(self.state, table, "next_page")
+        self.state = singer.bookmarks.clear_bookmark(self.state, table, "window_progress")
+        self.state = singer.bookmarks.clear_bookmark(self.state, table, "offset_window")
+        self.state = singer.bookmarks.clear_bookmark(self.state, table, "offset_window_end")
+        save_state(self.state)
+        return True
+
+
+    def recover_offset(self, error, params, progress, pages_synced):
+        """Sets up `params` to read on after an expired offset, from the
+        last `updatedAt` emitted if the order allows, or else from the first
+        page. Returns whether the read was narrowed."""
+        # Only the first request of an attempt can go without an offset
+        if 'offset' not in params and pages_synced == 0:
+            raise error
+        params.pop("offset", None)
+        if progress.narrow(params):
+            LOGGER.warning('Found invalid offset, continuing from updatedAt %s.', progress.last)
+            return True
+
+        LOGGER.warning('Found invalid offset, retrying without offset.')
+        return False
+
+    def is_offset_for(self, updated_after):
+        offset_window = singer.bookmarks.get_bookmark(self.state, self.TABLE, "offset_window")
+        if offset_window is None:
+            # Offsets saved before windows were tracked belong to the window
+            # at the bookmark, which is where walking forward starts
+            return not self.newest_first()
+        # The cursor belongs to a query with both ends of the window
+        offset_window_end = singer.bookmarks.get_bookmark(self.state, self.TABLE, "offset_window_end")
+        if offset_window_end is not None and offset_window_end != (updated_after + self.interval).isoformat():
+            return False
+        return offset_window == updated_after.isoformat()
+
+    def get_interval(self):
+        # A window left with a bookmarked offset is finished at the size it
+        # was started with, whatever size earlier runs have tuned since
+        start = singer.bookmarks.get_bookmark(self.state, self.TABLE, "offset_window")
+        end = singer.bookmarks.get_bookmark(self.state, self.TABLE, "offset_window_end")
+        if singer.bookmarks.get_bookmark(self.state, self.TABLE, "offset") and start and end:
+            return parse(end) - parse(start)
+        return super().get_interval()
+
+    def get_partition_workers(self):
+        return int(self.config.get('opportunity_partition_workers', 0) or 0)
+
+    def is_dense(self, pages_synced):
+        if self.get_partition_workers() < 2:
+            return False
+        return pages_synced >= int(self.config.get('opportunity_partition_after', DEFAULT_PARTITION_AFTER))
+
+    def get_stage_ids(self):
+        # Every opportunity is in exactly one stage, so filtering by each of
+        # them splits a window into parts that together cover all of it.
+        # Postings don't: opportunities without one would be left out.
+        if getattr(self, 'stage_ids', None) is None:
+            url = '{}/stages'.format(self.get_base_url())
+            self.stage_ids = [stage['id'] for result in self.paginate(url, {'limit': 100})
+                              for stage in result['data']]
+        return self.stage_ids
+
+    def sync_partitioned(self, url, params, child_streams, emitted):
+        """Reads the rest of a dense window split by stage, each stage with
+        its own cursor chain on its own worker.
+
+        Each stage is read from the start of the window, skipping the
+        opportunities in `emitted` and their children. Offsets aren't
+        bookmarked while the partitions run: a run stopped halfway continues
+        from the last bookmarked offset of the window. Returns whether every
+        partition was read to the end.
+        """
+        stage_ids = self.get_stage_ids()
+        workers = min(self.get_partition_workers(), len(stage_ids)) or 1
+        LOGGER.info('Window is dense, reading it as {} stage partitions with {} workers'
+                    .format(len(stage_ids), workers))
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='opportunity-partition') as executor:
+            futures = [
+                executor.submit(contextvars.copy_context().run, self.sync_partition,
+                                url, dict(params, stage_id=stage_id), child_streams, emitted)
+                for stage_id in stage_ids
+            ]
+            return all([future.result() for future in futures])
+
+    def sync_partition(self, url, params, child_streams, emitted):
+        table = self.TABLE
+        stage_id = params['stage_id']
 
-            LOGGER.info('Starting Opportunity child stream syncs')
-            for opportunity in data:
-                opportunity_id = opportunity['id']
+        # Child streams keep per-request attributes, so every partition gets
+        # its own
+        transformer = singer.Transformer(singer.UNIX_MILLISECONDS_INTEGER_DATETIME_PARSING)
+        children = self.get_child_streams(child_streams)
+
+        # What the partition emits is skipped too, in case an expired
+        # offset has it read part of the stage again
+        emitted = set(emitted)
+        progress = WindowProgress(self.RANGE_FIELD)
+        page = 1
+        while True:
+            pages_synced = 0
+            try:
+                for result, data in self.transform_pages(self.paginate(url, params), transformer):
+                    progress.observe(result['data'])
+                    result, data = skip_emitted(result, data, emitted)
+                    with tracing.span('page', table=table, page=page, stage_id=stage_id, records=len(data)):
+                        self.sync_children(result, children)
+                        self.write_page(data, 'page {} of stage {}'.format(page, stage_id))
+                    emitted.update(record['id'] for record in result['data'])
+                    page += 1
+                    pages_synced += 1
+
+                    if result.get('next') and self.stopping():
+                        LOGGER.info('Stopping {} partition of stage {}'.format(table, stage_id))
+                        transformer.log_warning()
+                        return False
+                break
+            except OffsetInvalidException as error:
+                self.recover_offset(error, params, progress, pages_synced)
 
-                if child_streams.get('opportunity_applications'):
-                    applications_stream.write_schema()
-                    applications_stream.sync_data(opportunity_id)
+        transformer.log_warning()
+        return True
 
-                if child_streams.get('opportunity_offers'):
-                    offers_stream.write_schema()
-                    offers_stream.sync_data(opportunity_id)
+    def sync_children(self, result, children):
+        LOGGER.info('Starting Opportunity child stream syncs')
+        # The records as returned by the API, since fields that tell whether
+        # a child request can be skipped may not be selected
+        for opportunity in result['data']:
+            opportunity_id = opportunity['id']
 
-                if child_streams.get('opportunity_referrals'):
-                    referrals_stream.write_schema()
-                    referrals_stream.sync_data(opportunity_id)
+            for child in children:
+                child.write_schema()
+                with tracing.span('child', table=child.TABLE, parent_id=opportunity_id), \
+                        budget.charging_child(child.TABLE):
+                    child.sync_parent(opportunity_id, opportunity)
 
-                if child_streams.get('opportunity_resumes'):
-                    resumes_stream.write_schema()
-                    resumes_stream.sync_data(opportunity_id)
+        LOGGER.info('Finished Opportunity child stream syncs')
 
-            LOGGER.info('Finished Opportunity child stream syncs')
+    def write_page(self, data, description):
+        with singer.metrics.record_counter(endpoint=self.TABLE) as counter:
+            self.write_schema()
+            output.write_records(self.TABLE, data)
+            counter.increment(len(data))
+        tuning.count(self.TABLE, len(data))
 
+        LOGGER.info('Synced {} for {}'.format(description, self.TABLE))
 
-            with singer.metrics.record_counter(endpoint=table) as counter:
-                self.write_schema()
-                singer.write_records(table, data)
-                counter.increment(len(data))
+    def sync_page(self, result, data, page, updated_after, children, progress):
+        table = self.TABLE
+        _next = result.get('next')
 
-            LOGGER.info('Synced page {} for {}'.format(page, self.TABLE))
-            page += 1
+        self.sync_children(result, children)
+        self.write_page(data, 'page {}'.format(page))
 
-            if _next:
-                params['offset'] = _next
-                self.state = singer.bookmarks.write_bookmark(self.state, table, "offset", _next)
-                self.state = singer.bookmarks.write_bookmark(self.state, table, "next_page", page)
+        if _next:
+            self.state = singer.bookmarks.write_bookmark(self.state, table, "offset", _next)
+            self.state = singer.bookmarks.write_bookmark(self.state, table, "next_page", page + 1)
+            self.state = singer.bookmarks.write_bookmark(self.state, table, "window_progress", progress.dump())
+            self.state = singer.bookmarks.write_bookmark(self.state, table, "offset_window", updated_after.isoformat())
+            self.state = singer.bookmarks.write_bookmark(self.state, table, "offset_window_end",
+                                                         (updated_after + self.interval).isoformat())
+            if not self.newest_first():
                 # Save the last_record bookmark when we're paginating to make sure we pick up there if interrupted
                 self.state = singer.bookmarks.write_bookmark(self.state, table, "last_record", updated_after.isoformat())
-                save_state(self.state)
-            else:
-                finished_paginating = True
-
-        transformer.log_warning()
-        self.state = singer.bookmarks.clear_bookmark(self.state, table, "offset")
-        self.state = singer.bookmarks.clear_bookmark(self.state, table, "next_page")
-        save_state(self.state)
-
+            save_state(self.state)
 
     def sync_data_for_period(self, date, interval, child_streams=None):
         table = self.TABLE
 
         updated_after = date
         updated_before = updated_after + interval
+        started_at = datetime.now(pytz.utc)
 
         LOGGER.info(
             'Syncing data from {} to {}'.format(
                 updated_after.isoformat(),
                 updated_before.isoformat()))
 
+        partition = get_partition(updated_after)
+        for stream in [table] + list(child_streams or {}):
+            output.set_partition(stream, partition)
+
         params = self.get_params(updated_after, updated_before)
         url = self.get_url()
-        self.sync_paginated(url, params, updated_after, child_streams)
+        with tracing.span('window', table=table, start=updated_after.isoformat()):
+            if not self.sync_paginated(url, params, updated_after, child_streams):
+                return
 
-        self.state = incorporate(self.state,
-                                 table,
-                                 self.RANGE_FIELD,
-                                 date.isoformat())
+        self.complete_window(date, started_at)
 
         save_state(self.state)
 
     def sync_data(self, child_streams=None):
-        table = self.TABLE
-
-        date = get_last_record_value_for_table(self.state, table)
-
-        if date is None:
-            date = get_config_start_date(self.config)
-
-        interval = timedelta(days=1)
-
-        while date < datetime.now(pytz.utc):
-            self.sync_data_for_period(date, interval, child_streams)
-            date = date + interval
+        self.interval = self.get_interval()
+        for date in self.get_windows():
+            if self.stopping():
+                LOGGER.info('Stopping {} before the window starting {}'
+                            .format(self.TABLE, date.isoformat()))
+                break
+
+            self.sync_data_for_period(date, self.interval, child_streams)
+        else:
+            # A window stopped halfway isn't completed, which this checks
+            self.finish_windows()
+
+        for child in self.get_child_streams(child_streams):
+            child.write_schema()
+            child.retry_failed_parents()
 
         return self.state
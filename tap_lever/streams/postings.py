@@ -8,6 +8,8 @@ LOGGER = singer.get_logger()  # noqa
 class PostingsStream(BaseStream):
     API_METHOD = 'GET'
     TABLE = 'postings'
+    CHANGE_DETECTION = True
+    TABLE_VERSIONS = True
 
     @property
     def path(self):
@@ -1,5 +1,4 @@
 import singer
-from tap_lever.streams import cache as stream_cache
 from tap_lever.streams.base import BaseStream
 
 LOGGER = singer.get_logger()  # noqa
@@ -8,6 +7,7 @@ LOGGER = singer.get_logger()  # noqa
 class CandidateReferralsStream(BaseStream):
     API_METHOD = "GET"
     TABLE = "candidate_referrals"
+    PARENT = "candidates"
 
     @property
     def path(self):
@@ -15,29 +15,26 @@ class CandidateReferralsStream(BaseStream):
 
     def get_url(self, candidate):
         _path = self.path.format(candidate_id=candidate)
-        return "https://api.lever.co/v1{}".format(_path)
+        return "{}{}".format(self.get_base_url(), _path)
 
     def sync_data(self):
-        table = self.TABLE
+        for i, candidate in enumerate(self.get_parent_records()):
+            LOGGER.info("Fetching referrals for candidate {}".format(i + 1))
+            self.sync_parent(candidate["id"], candidate)
 
-        candidates = stream_cache.get("candidates")
-        LOGGER.info("Found {} candidates in cache".format(len(candidates)))
+        self.finish_parents()
 
+    def sync_parent_records(self, candidate_id):
         params = self.get_params(_next=None)
-        for i, candidate in enumerate(candidates):
-            LOGGER.info(
-                "Fetching referrals for candidate {} of {}".format(
-                    i + 1, len(candidates)
-                )
-            )
-            candidate_id = candidate["id"]
-            url = self.get_url(candidate_id)
-            resources = self.sync_paginated(url, params)
+        url = self.get_url(candidate_id)
+        resources = self.sync_paginated(url, params)
 
 
 class OpportunityReferralsStream(BaseStream):
     API_METHOD = "GET"
     TABLE = "opportunity_referrals"
+    PARENT = "opportunities"
+    SYNC_WITH_PARENT = True
 
     @property
     def path(self):
@@ -45,9 +42,9 @@ class OpportunityReferralsStream(BaseStream):
 
     def get_url(self, opportunity):
         _path = self.path.format(opportunity_id=opportunity)
-        return "https://api.lever.co/v1{}".format(_path)
+        return "{}{}".format(self.get_base_url(), _path)
 
-    def sync_data(self, opportunity_id):
+    def sync_parent_records(self, opportunity_id):
         params = self.get_params(_next=None)
         url = self.get_url(opportunity_id)
         resources = self.sync_paginated(url, params)
@@ -1,14 +1,44 @@
 import singer
 
-from tap_lever.streams import cache as stream_cache
+from tap_lever import downloads
 from tap_lever.streams.base import BaseStream
 
 LOGGER = singer.get_logger()  # noqa
 
 
-class CandidateResumesStream(BaseStream):
+class ResumesStream(BaseStream):
     API_METHOD = "GET"
+    # There's a bug in the Lever API where a missing resume will result in a
+    # ResourceNotFound error instead of returning an empty response
+    MISSING_MEANS_EMPTY = True
+    CACHE_EMPTY_PARENTS = True
+
+    def sync_paginated(self, url, params=None):
+        self.resumes_url = url
+        return super().sync_paginated(url, params)
+
+    def prepare_records(self, records):
+        downloader = downloads.get_downloader()
+        if downloader is not None:
+            self.attach_files(downloader, records)
+
+    def attach_files(self, downloader, resumes):
+        with_files = [resume for resume in resumes if resume.get("file")]
+        files = downloader.download_all(
+            (resume["id"], "{}/{}/download".format(self.resumes_url, resume["id"]))
+            for resume in with_files
+        )
+
+        for resume, downloaded in zip(with_files, files):
+            # Emitted without the file when it couldn't be downloaded
+            if downloaded is None:
+                continue
+            resume["contentSha256"], resume["localPath"] = downloaded
+
+
+class CandidateResumesStream(ResumesStream):
     TABLE = "candidate_resumes"
+    PARENT = "candidates"
 
     @property
     def path(self):
@@ -16,31 +46,23 @@ class CandidateResumesStream(BaseStream):
 
     def get_url(self, candidate):
         _path = self.path.format(candidate_id=candidate)
-        return "https://api.lever.co/v1{}".format(_path)
+        return "{}{}".format(self.get_base_url(), _path)
 
     def sync_data(self):
-        candidates = stream_cache.get("candidates")
-        LOGGER.info("Found {} candidates in cache".format(len(candidates)))
-
-        for i, candidate in enumerate(candidates):
-            LOGGER.info(
-                "Fetching resumes for candidate {} of {}".format(i + 1, len(candidates))
-            )
-            candidate_id = candidate["id"]
-            url = self.get_url(candidate_id)
-            try:
-                resources = self.sync_paginated(url)
-            except RuntimeError as e:
-                # There's a bug in the Lever API where a missing resume will result
-                # in a ResourceNotFound error instead of returning an empty response
-                if "ResourceNotFound" in str(e):
-                    LOGGER.info("Candidate %s does not have resumes", candidate_id)
-                else:
-                    raise
-
-class OpportunityResumesStream(BaseStream):
-    API_METHOD = "GET"
+        for i, candidate in enumerate(self.get_parent_records()):
+            LOGGER.info("Fetching resumes for candidate {}".format(i + 1))
+            self.sync_parent(candidate["id"], candidate)
+
+        self.finish_parents()
+
+    def sync_parent_records(self, candidate_id):
+        url = self.get_url(candidate_id)
+        return self.sync_paginated(url)
+
+class OpportunityResumesStream(ResumesStream):
     TABLE = "opportunity_resumes"
+    PARENT = "opportunities"
+    SYNC_WITH_PARENT = True
 
     @property
     def path(self):
@@ -48,16 +70,8 @@ class OpportunityResumesStream(BaseStream):
 
     def get_url(self, opportunity):
         _path = self.path.format(opportunity_id=opportunity)
-        return "https://api.lever.co/v1{}".format(_path)
+        return "{}{}".format(self.get_base_url(), _path)
 
-    def sync_data(self, opportunity_id):
+    def sync_parent_records(self, opportunity_id):
         url = self.get_url(opportunity_id)
-        try:
-            resources = self.sync_paginated(url)
-        except RuntimeError as e:
-            # There's a bug in the Lever API where a missing resume will result
-            # in a ResourceNotFound error instead of returning an empty response
-            if "ResourceNotFound" in str(e):
-                LOGGER.info("Opportunity %s does not have resumes", opportunity_id)
-            else:
-                raise
+        return self.sync_paginated(url)
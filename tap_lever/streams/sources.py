@@ -8,6 +8,8 @@ class SourcesStream(BaseStream):
     API_METHOD = 'GET'
     TABLE = 'sources'
     KEY_PROPERTIES = ['text']
+    CHANGE_DETECTION = True
+    TABLE_VERSIONS = True
 
     @property
     def path(self):
@@ -8,6 +8,8 @@ class StagesStream(BaseStream):
     API_METHOD = 'GET'
     TABLE = 'stages'
     KEY_PROPERTIES = ['id']
+    CHANGE_DETECTION = True
+    TABLE_VERSIONS = True
 
     @property
     def path(self):
@@ -7,6 +7,8 @@ LOGGER = singer.get_logger()  # noqa
 class UsersStream(BaseStream):
     API_METHOD = "GET"
     TABLE = "users"
+    CHANGE_DETECTION = True
+    TABLE_VERSIONS = True
 
     @property
     def path(self):
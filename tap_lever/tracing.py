@@ -0,0 +1,129 @@
+import contextlib
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+
+import singer
+
+LOGGER = singer.get_logger()  # noqa
+
+TRACER = None
+
+# The span the current thread is in. Threads started with a copy of the
+# context (pipelines, prefetching, hedged requests) nest their spans under
+# the span that started them.
+CURRENT = contextvars.ContextVar('lever_span', default=None)
+
+
+def configure(config):
+    close()
+
+    if config.get('trace_file'):
+        LOGGER.info('Writing a trace of the sync to {}'.format(config['trace_file']))
+        set_tracer(Tracer(config['trace_file']))
+
+
+def set_tracer(tracer):
+    global TRACER  # pylint: disable=global-statement
+    TRACER = tracer
+
+
+def close():
+    tracer = TRACER
+    set_tracer(None)
+    if tracer is not None:
+        tracer.close()
+
+
+@contextlib.contextmanager
+def span(name, **args):
+    """Records the time spent in the block as a span of the current trace,
+    nested under the span it runs in. Yields the span's args, which can be
+    added to until the block ends. Does nothing unless `trace_file` is set."""
+    tracer = TRACER
+    if tracer is None:
+        yield args
+        return
+
+    with tracer.span(name, args):
+        yield args
+
+
+class Tracer:
+    """Writes spans as Chrome trace events, to be opened in `chrome://tracing`
+    or Perfetto.
+
+    Spans are complete (`X`) events, written as soon as they end so a trace
+    survives a crash; the viewers accept the array without its closing
+    bracket. Each span carries its id and its parent's in `args`, and a span
+    running on another thread than its parent is linked to it with a flow
+    arrow.
+    """
+
+    def __init__(self, path):
+        self.pid = os.getpid()
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self.threads = set()
+        self.handle = open(path, 'w')
+        self.handle.write('[\n')
+
+    def now(self):
+        return time.perf_counter_ns() // 1000
+
+    def write(self, event):
+        with self.lock:
+            if self.handle is None:
+                return
+            self.handle.write(json.dumps(event, default=str))
+            self.handle.write(',\n')
+
+    def name_thread(self, tid):
+        if tid in self.threads:
+            return
+        self.threads.add(tid)
+        self.write({'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid,
+                    'args': {'name': threading.current_thread().name}})
+
+    @contextlib.contextmanager
+    def span(self, name, args):
+        parent = CURRENT.get()
+        span_id = next(self.ids)
+        tid = threading.get_ident()
+        self.name_thread(tid)
+
+        started = self.now()
+        if parent is not None and parent[1] != tid:
+            self.write({'name': name, 'cat': 'thread', 'ph': 's', 'id': span_id,
+                        'pid': self.pid, 'tid': parent[1], 'ts': started})
+            self.write({'name': name, 'cat': 'thread', 'ph': 'f', 'bp': 'e', 'id': span_id,
+                        'pid': self.pid, 'tid': tid, 'ts': started})
+
+        token = CURRENT.set((span_id, tid))
+        error = None
+        try:
+            yield args
+        except BaseException as ex:
+            error = ex
+            raise
+        finally:
+            CURRENT.reset(token)
+            args.update(span_id=span_id, parent_id=parent[0] if parent else None)
+            if error is not None:
+                args['error'] = type(error).__name__
+            self.write({'name': name, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                        'ts': started, 'dur': self.now() - started, 'args': args})
+
+    def close(self):
+        with self.lock:
+            handle, self.handle = self.handle, None
+        # Strips the trailing comma to leave a plain JSON array
+        if handle.tell() > 2:
+            handle.seek(handle.tell() - 2)
+            handle.truncate()
+            handle.write('\n')
+        handle.write(']\n')
+        handle.close()
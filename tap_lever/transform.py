@@ -0,0 +1,167 @@
+import collections
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+
+import singer
+
+from tap_lever import tracing
+
+LOGGER = singer.get_logger()  # noqa
+
+# Smaller pages, like most child requests, are transformed in place since
+# the round trip to a worker costs more than it saves
+MIN_POOLED_RECORDS = 20
+
+POOL = None
+
+# Set in each worker process by init_worker
+_PROJECTIONS = None
+
+
+def project_record(record, fields):
+    return {key: value for key, value in record.items() if key in fields}
+
+
+def build_projection(catalog_entry):
+    """The schema dict, the selected top-level fields and the metadata the
+    transformer still has to apply, which are fixed for the whole sync."""
+    # Imported here so worker processes don't load the streams
+    from tap_lever.streams.base import get_selected_fields, has_nested_metadata
+
+    schema = catalog_entry.schema.to_dict()
+    metadata = {}
+
+    if catalog_entry.metadata is not None:
+        metadata = singer.metadata.to_map(catalog_entry.metadata)
+
+    fields = get_selected_fields(schema, metadata)
+    transform_metadata = metadata if has_nested_metadata(metadata) else None
+    return (schema, fields, transform_metadata)
+
+
+def transform_records(records, projection, transformer):
+    schema, fields, metadata = projection
+    # Drop unselected and unknown fields right after decoding so nested
+    # arrays like `applications` or `urls` are never walked by the
+    # transformer unless they are actually going to be emitted.
+    return [
+        transformer.transform(project_record(record, fields), schema, metadata)
+        for record in records
+    ]
+
+
+def init_worker(projections):
+    global _PROJECTIONS  # pylint: disable=global-statement
+    _PROJECTIONS = projections
+
+
+def transform_page(table, records):
+    transformer = singer.Transformer(singer.UNIX_MILLISECONDS_INTEGER_DATETIME_PARSING)
+    data = transform_records(records, _PROJECTIONS[table], transformer)
+    # Warnings are logged once by the stream's own transformer
+    return data, transformer.removed
+
+
+def configure(config, projections):
+    shutdown()
+
+    workers = int(config.get('transform_workers', 0) or 0)
+    if workers < 1:
+        return
+
+    LOGGER.info('Transforming records in {} worker processes'.format(workers))
+    set_pool(TransformPool(workers, projections))
+
+
+def set_pool(pool):
+    global POOL  # pylint: disable=global-statement
+    POOL = pool
+
+
+def get_pool():
+    return POOL
+
+
+def shutdown():
+    pool = POOL
+    set_pool(None)
+    if pool is not None:
+        pool.shutdown()
+
+
+class TransformPool:
+    """Transforms pages of records in worker processes.
+
+    Every worker receives the projection of each selected stream once, when
+    it starts, so only the raw records and the transformed ones cross the
+    process boundary. Up to two pages per worker are in flight for a stream
+    and they come back in the order they were read.
+    """
+
+    def __init__(self, workers, projections):
+        self.depth = workers * 2
+        self.projections = projections
+        # Workers are spawned rather than forked since the tap already runs
+        # prefetch, pipeline and download threads by the time they start
+        self.executor = ProcessPoolExecutor(max_workers=workers,
+                                            mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=init_worker,
+                                            initargs=(projections,))
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def handles(self, table):
+        return table in self.projections
+
+    def map_pages(self, table, pages, prepare, transformer):
+        """Yields `(page, records)` for every page of `pages`, with the records
+        transformed. `prepare` is called on each page's records first, in
+        this process."""
+        pages = iter(pages)
+        pending = collections.deque()
+        exhausted = False
+        error = None
+
+        try:
+            while True:
+                while not exhausted and len(pending) < self.depth:
+                    try:
+                        result = next(pages)
+                    except StopIteration:
+                        exhausted = True
+                    except Exception as ex:  # pylint: disable=broad-except
+                        # The pages read before the failure are still
+                        # handed out, then the error is raised
+                        exhausted = True
+                        error = ex
+                    else:
+                        prepare(result['data'])
+                        future = None
+                        if len(result['data']) >= MIN_POOLED_RECORDS:
+                            future = self.executor.submit(transform_page, table, result['data'])
+                        pending.append((result, future))
+
+                if not pending:
+                    break
+
+                result, future = pending.popleft()
+                if future is None:
+                    with tracing.span('transform', table=table, records=len(result['data'])):
+                        data = transform_records(result['data'], self.projections[table], transformer)
+                else:
+                    with tracing.span('transform', table=table, records=len(result['data']), pooled=True):
+                        data, removed = future.result()
+                    transformer.removed.update(removed)
+                yield result, data
+        finally:
+            for _, future in pending:
+                if future is not None:
+                    future.cancel()
+            close = getattr(pages, 'close', None)
+            if close is not None:
+                close()
+
+        if error is not None:
+            raise error
@@ -0,0 +1,199 @@
+import copy
+import threading
+
+from datetime import timedelta
+
+import singer
+
+from tap_lever import accounts
+from tap_lever.ratelimit import RateLimiter
+
+LOGGER = singer.get_logger()  # noqa
+
+STATE_KEY = 'tuning'
+PERCENTILES = (50, 95, 99)
+DEFAULT_WINDOW_RECORDS = 500
+MIN_WINDOW = timedelta(hours=1)
+MAX_WINDOW = timedelta(days=30)
+# Weight kept by what earlier runs observed each time a run adds its own,
+# so the profile follows an account whose volume changes
+DECAY = 0.5
+DAY = 24 * 60 * 60
+# Requests per second above the safe rate a run is allowed, so the limit
+# found by one run is tried again rather than kept for good
+PROBE_STEP = 1
+
+PROFILES = {}
+
+
+def configure(state, config, client):
+    if not config.get('self_tuning'):
+        PROFILES.pop(accounts.current(), None)
+        return
+
+    window_records = int(config.get('tuning_window_records', DEFAULT_WINDOW_RECORDS))
+    profile = TuningProfile(client, state.get(STATE_KEY), window_records)
+    profile.seed_client()
+    PROFILES[accounts.current()] = profile
+
+
+def get_profile():
+    return PROFILES.get(accounts.current())
+
+
+def get_interval(table, default):
+    """The window size earlier runs found best for `table`, or `default`."""
+    profile = get_profile()
+    if profile is None:
+        return default
+    return profile.get_interval(table, default)
+
+
+def count(table, records):
+    profile = get_profile()
+    if profile is not None:
+        profile.count(table, records)
+
+
+def complete_window(table, start, end):
+    profile = get_profile()
+    if profile is not None:
+        profile.complete_window(table, start, end)
+
+
+def attach(state):
+    # Saved with every STATE message, like the retry queue
+    profile = get_profile()
+    if profile is None:
+        return state
+
+    state[STATE_KEY] = profile.dump()
+    return state
+
+
+def merge_density(saved, records, seconds):
+    days = seconds / DAY
+    if saved:
+        kept = saved['days'] * DECAY
+        records += saved['records_per_day'] * kept
+        days += kept
+    if not days:
+        return saved
+    return {'records_per_day': round(records / days, 3), 'days': round(days, 3)}
+
+
+def merge_request_rate(saved, peak, throttled):
+    """Keeps the highest requests per second that got no 429 and the lowest
+    that did. A throttled rate found by an earlier run stands until a run
+    gets to it without a 429."""
+    saved = saved or {}
+    if throttled is None and saved.get('throttled') and peak < saved['throttled']:
+        throttled = saved['throttled']
+
+    safe = max(saved.get('safe', 0), peak)
+    if throttled is not None:
+        safe = min(safe, throttled - 1)
+    safe = max(safe, 1)
+
+    return {'safe': safe, 'throttled': throttled}
+
+
+class TuningProfile:
+    """What earlier runs learned about an account, to start from instead of
+    the defaults.
+
+    Per table, the records per day of the windows synced, decayed so recent
+    runs count most, and the window size that holds about `window_records`
+    records at that density. Per endpoint, latency percentiles, which size
+    request timeouts and hedging delays before the run has samples of its
+    own. And the highest request rate that wasn't throttled: once a run has
+    been, later runs are held to one step above it, which either raises it
+    or finds the limit again.
+    """
+
+    def __init__(self, client, saved=None, window_records=DEFAULT_WINDOW_RECORDS):
+        self.client = client
+        self.saved = copy.deepcopy(saved or {})
+        self.window_records = window_records
+        self.lock = threading.Lock()
+        # Records of windows still being synced, and of the finished ones
+        self.pending = {}
+        self.observed = {}
+
+    def seed_client(self):
+        for endpoint, percentiles in self.saved.get('latency', {}).items():
+            self.client.latency.seed(endpoint, {
+                int(percent[1:]): seconds for percent, seconds in percentiles.items()
+            })
+
+        request_rate = self.saved.get('request_rate', {})
+        # An explicit max_requests_per_second always wins
+        if request_rate.get('throttled') and not self.client.config.get('max_requests_per_second'):
+            rate = request_rate['safe'] + PROBE_STEP
+            LOGGER.info('Earlier runs were throttled at {} requests per second, '
+                        'sending up to {}'.format(request_rate['throttled'], rate))
+            self.client.rate_limiter = RateLimiter(rate)
+
+    def get_interval(self, table, default):
+        seconds = self.saved.get('windows', {}).get(table)
+        if seconds is None:
+            return default
+
+        interval = timedelta(seconds=seconds)
+        LOGGER.info('Syncing {} in windows of {}, as tuned by earlier runs'.format(table, interval))
+        return interval
+
+    def count(self, table, records):
+        with self.lock:
+            self.pending[table] = self.pending.get(table, 0) + records
+
+    def complete_window(self, table, start, end):
+        # Records of a window that is stopped halfway are never counted, as
+        # they would only cover part of it
+        with self.lock:
+            records = self.pending.pop(table, 0)
+            observed = self.observed.setdefault(table, [0, 0.0])
+            observed[0] += records
+            observed[1] += max((end - start).total_seconds(), 0)
+
+    def get_window(self, density):
+        if density['records_per_day'] <= 0:
+            return int(MAX_WINDOW.total_seconds())
+
+        window = timedelta(days=self.window_records / density['records_per_day'])
+        window = min(max(window, MIN_WINDOW), MAX_WINDOW)
+        # Whole hours, so the windows of consecutive runs line up
+        return int(round(window.total_seconds() / 3600)) * 3600
+
+    def dump_latency(self):
+        latency = copy.deepcopy(self.saved.get('latency', {}))
+        for endpoint in self.client.latency.endpoints():
+            percentiles = {
+                'p{}'.format(percent): self.client.latency.percentile(endpoint, percent)
+                for percent in PERCENTILES
+            }
+            if None not in percentiles.values():
+                latency[endpoint] = {key: round(value, 3) for key, value in percentiles.items()}
+        return latency
+
+    def dump(self):
+        # Always worked out from what the run started with, so saving more
+        # than once doesn't count this run's observations twice
+        with self.lock:
+            observed = copy.deepcopy(self.observed)
+
+        density = copy.deepcopy(self.saved.get('density', {}))
+        for table, (records, seconds) in observed.items():
+            merged = merge_density(density.get(table), records, seconds)
+            if merged:
+                density[table] = merged
+
+        peak, throttled = self.client.request_rate.summary()
+        profile = {
+            'density': density,
+            'windows': {table: self.get_window(entry) for table, entry in density.items()},
+            'latency': self.dump_latency(),
+        }
+        if peak or throttled or 'request_rate' in self.saved:
+            profile['request_rate'] = merge_request_rate(self.saved.get('request_rate'), peak, throttled)
+        return profile
@@ -0,0 +1,25 @@
+from dateutil.parser import parse
+
+
+def load_ranges(bookmark):
+    return [(parse(start), parse(end)) for start, end in bookmark or []]
+
+
+def dump_ranges(ranges):
+    return [[start.isoformat(), end.isoformat()] for start, end in ranges]
+
+
+def add_range(ranges, start, end):
+    """Adds `[start, end)` to a list of completed ranges, merging any that
+    touch or overlap so the list stays short and sorted."""
+    merged = []
+    for range_start, range_end in sorted(list(ranges) + [(start, end)]):
+        if merged and range_start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], range_end))
+        else:
+            merged.append((range_start, range_end))
+    return merged
+
+
+def covers(ranges, start, end):
+    return any(range_start <= start and end <= range_end for range_start, range_end in ranges)
@@ -0,0 +1,21 @@
+from singer.catalog import Catalog
+
+
+def build_catalog_entry(stream_class, deselected=()):
+    """The catalog entry of `stream_class`, with the `deselected` fields
+    left out."""
+    entry = stream_class({}, {}, None, None).generate_catalog()[0]
+    for item in entry["metadata"]:
+        if item["breadcrumb"] and item["breadcrumb"][1] in deselected:
+            item["metadata"]["selected"] = False
+    return Catalog.from_dict({"streams": [entry]}).streams[0]
+
+
+class PageClient:
+    """Answers every request with one page holding `records`."""
+
+    def __init__(self, records):
+        self.records = records
+
+    def make_request(self, url, method, params=None):
+        return {"data": [dict(record) for record in self.records]}
@@ -0,0 +1,65 @@
+import io
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from tap_lever import LeverTap, Record, deadline, output
+from tap_lever.config import ConfigError
+
+from stub_server import StubLeverServer
+
+
+class TestLeverTap(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(output.configure, {})
+        self.addCleanup(deadline.configure, {})
+
+    def test_records_of_a_child_stream_with_state_out(self):
+        """Only the requested stream is yielded, nothing reaches stdout, and the state comes back."""
+        routes = {
+            "/v1/opportunities": lambda params: (200, {"data": [{"id": "opp-0"}], "hasNext": False}),
+            "/v1/opportunities/opp-0/offers": lambda params: (
+                200, {"data": [{"id": "offer-0", "createdAt": 1600000000000}], "hasNext": False}),
+        }
+        stdout = io.StringIO()
+        with StubLeverServer(routes) as server, patch("sys.stdout", stdout):
+            config = {"token": "x", "start_date": (datetime.now(pytz.utc) - timedelta(hours=12)).isoformat(),
+                      "base_url": server.base_url}
+            tap = LeverTap(config)
+            records = list(tap.records("opportunity_offers"))
+
+        self.assertEqual(records, [Record("opportunity_offers", {
+            "id": "offer-0", "createdAt": "2020-09-13T12:26:40.000000Z", "opportunityId": "opp-0"})])
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertIn("last_record", tap.state["bookmarks"]["opportunities"])
+
+    def test_stopping_early_stops_the_sync(self):
+        """Breaking out stops the sync at its next window, with the state of what was read."""
+        def requisitions(params):
+            return 200, {"data": [{"id": "req-{}".format(params["created_at_start"])}], "hasNext": False}
+
+        start = datetime.now(pytz.utc) - timedelta(days=60)
+        with StubLeverServer({"/v1/requisitions": requisitions}) as server, patch("sys.stdout", io.StringIO()):
+            config = {"token": "x", "start_date": start.isoformat(), "base_url": server.base_url}
+            tap = LeverTap(config)
+            records = tap.records(["requisitions"], buffer_size=1)
+            first = next(records)
+            next(records)
+            records.close()
+            requested = len(server.requests)
+
+            rest = list(LeverTap(config, state=tap.state).records(["requisitions"]))
+
+        self.assertEqual(first.stream, "requisitions")
+        self.assertLess(requested, 9)
+        # The bookmark is the start of the last window read, which is read again
+        self.assertEqual(tap.state["bookmarks"]["requisitions"]["last_record"],
+                         start.strftime("%Y-%m-%dT%H:%M:%SZ"))
+        self.assertEqual(len(rest), 9)
+
+    def test_config_without_a_token_is_rejected(self):
+        """A config with neither a token nor accounts fails before anything is synced."""
+        with self.assertRaises(ConfigError):
+            LeverTap({"start_date": "2020-01-01T00:00:00Z"})
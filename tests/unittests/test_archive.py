@@ -0,0 +1,102 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from tap_lever import output
+from tap_lever.archive import MissingResponseError
+from tap_lever.client import LeverClient
+from tap_lever.streams import OpportunityStream
+from tap_lever.streams.offers import OpportunityOffersStream
+
+from helpers import build_catalog_entry
+from stub_server import StubLeverServer
+
+
+def opportunities(params):
+    if params.get("offset") == "page-2":
+        return 200, {"data": [{"id": "opp-1"}], "hasNext": False}
+    return 200, {"data": [{"id": "opp-0"}], "hasNext": True, "next": "page-2"}
+
+
+def offers(params):
+    return 200, {"data": [{"id": "offer-1", "createdAt": 1600000000000}], "hasNext": False}
+
+
+class TestResponseArchive(unittest.TestCase):
+    def setUp(self):
+        output.configure({})
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.archive_dir = directory.name
+        start = datetime.now(pytz.utc) - timedelta(hours=12)
+        self.config = {"token": "x", "start_date": start.isoformat()}
+
+    def sync(self, config):
+        stdout = io.StringIO()
+        with patch("sys.stdout", stdout):
+            stream = OpportunityStream(config, {}, build_catalog_entry(OpportunityStream), LeverClient(config))
+            stream.sync({"opportunity_offers": build_catalog_entry(OpportunityOffersStream)})
+
+        messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        return [message for message in messages if message["type"] == "RECORD"]
+
+    def test_replay_emits_the_archived_sync_without_network(self):
+        """A replayed sync emits the same records from disk, with no server to talk to."""
+        routes = {
+            "/v1/opportunities": opportunities,
+            "/v1/opportunities/opp-0/offers": offers,
+            "/v1/opportunities/opp-1/offers": offers,
+        }
+        with StubLeverServer(routes) as server:
+            archived = self.sync(dict(self.config, base_url=server.base_url, archive_dir=self.archive_dir))
+
+        files = [name for _, _, names in os.walk(os.path.join(self.archive_dir, "opportunities"))
+                 for name in names]
+        self.assertEqual(len(files), 4)
+        self.assertTrue(all(name.endswith(".json.gz") for name in files))
+
+        # Nothing listens on this port
+        replayed = self.sync(dict(self.config, base_url="http://127.0.0.1:9/v1",
+                                  replay_dir=self.archive_dir))
+
+        self.assertEqual(replayed, archived)
+        self.assertEqual(len([record for record in replayed if record["stream"] == "opportunity_offers"]), 2)
+
+    def test_replay_stops_where_the_archive_ends(self):
+        """A window the archived run never reached fails the replay without moving the bookmark past it."""
+        routes = {
+            "/v1/opportunities": opportunities,
+            "/v1/opportunities/opp-0/offers": offers,
+            "/v1/opportunities/opp-1/offers": offers,
+        }
+        start = datetime.now(pytz.utc) - timedelta(hours=36)
+        config = dict(self.config, start_date=start.isoformat())
+        with StubLeverServer(routes) as server:
+            self.sync(dict(config, base_url=server.base_url, archive_dir=self.archive_dir))
+
+        # Leave the archive ending after the first window
+        second_window = str(int((start + timedelta(days=1)).timestamp() * 1000))
+        for directory, _, names in os.walk(self.archive_dir):
+            for name in names:
+                path = os.path.join(directory, name)
+                with gzip.open(path, "rt") as handle:
+                    request = json.load(handle)["request"]
+                if request["params"].get("updated_at_start") == second_window:
+                    os.remove(path)
+
+        stdout = io.StringIO()
+        config = dict(config, base_url="http://127.0.0.1:9/v1", replay_dir=self.archive_dir)
+        with patch("sys.stdout", stdout), self.assertRaises(MissingResponseError):
+            stream = OpportunityStream(config, {}, build_catalog_entry(OpportunityStream), LeverClient(config))
+            stream.sync({"opportunity_offers": build_catalog_entry(OpportunityOffersStream)})
+
+        states = [json.loads(line)["value"] for line in stdout.getvalue().splitlines()
+                  if json.loads(line)["type"] == "STATE"]
+        self.assertEqual(states[-1]["bookmarks"]["opportunities"]["last_record"], start.isoformat())
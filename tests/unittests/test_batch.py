@@ -0,0 +1,85 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from tap_lever import output
+from tap_lever.batch import BatchWriter
+from tap_lever.state import save_state
+
+
+class TestBatchMode(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        output.configure({
+            "batch_mode": True,
+            "batch_dir": self.tmp.name,
+            "batch_max_records": 2,
+        })
+        self.addCleanup(output.configure, {})
+
+    def messages(self, stdout):
+        return [json.loads(line) for line in stdout.getvalue().splitlines()]
+
+    @patch("sys.stdout", new_callable=io.StringIO)
+    def test_rotates_by_record_count(self, stdout):
+        """A batch file is finalized and announced as soon as it is full."""
+        output.write_records("users", [{"id": "1"}, {"id": "2"}, {"id": "3"}])
+
+        messages = self.messages(stdout)
+        self.assertEqual(len(messages), 1)
+        self.assertEqual(messages[0]["type"], "BATCH")
+        self.assertEqual(messages[0]["stream"], "users")
+
+        path = messages[0]["manifest"][0][len("file://"):]
+        with gzip.open(path, "rt") as handle:
+            rows = [json.loads(line) for line in handle]
+        self.assertEqual(rows, [{"id": "1"}, {"id": "2"}])
+
+    @patch("sys.stdout", new_callable=io.StringIO)
+    def test_state_waits_for_its_batch_files(self, stdout):
+        """Checkpoints don't finalize batch files, and the latest STATE follows the file that covers it."""
+        output.write_records("users", [{"id": "1"}])
+        save_state({"bookmarks": {"users": {"page": 1}}})
+        save_state({"bookmarks": {"users": {"page": 2}}})
+        self.assertEqual(self.messages(stdout), [])
+
+        output.write_records("users", [{"id": "2"}, {"id": "3"}])
+
+        messages = self.messages(stdout)
+        self.assertEqual([message["type"] for message in messages], ["BATCH", "STATE"])
+        self.assertEqual(messages[1]["value"], {"bookmarks": {"users": {"page": 2}}})
+
+    @patch("sys.stdout", new_callable=io.StringIO)
+    def test_held_state_is_emitted_at_close(self, stdout):
+        """Closing the output finalizes open files and emits the state held back."""
+        output.write_records("users", [{"id": "1"}])
+        save_state({"bookmarks": {"users": {}}})
+        output.close()
+
+        types = [message["type"] for message in self.messages(stdout)]
+        self.assertEqual(types, ["BATCH", "STATE"])
+        self.assertEqual(
+            [name for name in os.listdir(self.tmp.name) if name.endswith(".part")],
+            [])
+
+    @patch("sys.stdout", new_callable=io.StringIO)
+    def test_open_files_are_finalized_after_the_commit_interval(self, stdout):
+        """A file open for longer than batch_commit_interval is finalized at the next checkpoint."""
+        output.configure({"batch_mode": True, "batch_dir": self.tmp.name, "batch_commit_interval": 0})
+        output.write_records("users", [{"id": "1"}])
+        save_state({"bookmarks": {"users": {}}})
+
+        types = [message["type"] for message in self.messages(stdout)]
+        self.assertEqual(types, ["BATCH", "STATE"])
+
+    def test_writers_started_together_use_their_own_files(self):
+        """Two runs started in the same second never write to the same file name."""
+        first = BatchWriter({"batch_dir": self.tmp.name})
+        second = BatchWriter({"batch_dir": self.tmp.name})
+
+        self.assertNotEqual(first.next_path("users"), second.next_path("users"))
@@ -0,0 +1,121 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from tap_lever import LeverRunner, output
+from tap_lever.streams import UsersStream
+
+from helpers import PageClient, build_catalog_entry
+
+
+class TestChangeDetection(unittest.TestCase):
+    def setUp(self):
+        output.configure({})
+        self.config = {"change_detection": True, "emit_tombstones": True}
+
+    def sync(self, records, state):
+        stream = UsersStream(self.config, state, build_catalog_entry(UsersStream), PageClient(records))
+        stdout = io.StringIO()
+        with patch("sys.stdout", stdout):
+            stream.sync()
+        messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        return stream.state, messages
+
+    def records(self, messages):
+        return [m["record"] for m in messages if m["type"] == "RECORD"]
+
+    def test_only_new_or_changed_rows_are_emitted(self):
+        """A quiet second run emits nothing; changes and deletions are reported."""
+        state, messages = self.sync([{"id": "u1", "name": "Ann"},
+                                     {"id": "u2", "name": "Bob"}], {})
+        self.assertEqual(len(self.records(messages)), 2)
+        self.assertEqual(len(state["bookmarks"]["users"]["fingerprints"]), 2)
+
+        state, messages = self.sync([{"id": "u1", "name": "Ann"},
+                                     {"id": "u2", "name": "Bob"}], state)
+        self.assertEqual(self.records(messages), [])
+
+        state, messages = self.sync([{"id": "u1", "name": "Ann B."}], state)
+        records = self.records(messages)
+        self.assertEqual(records[0], {"id": "u1", "name": "Ann B."})
+        self.assertEqual(records[1]["id"], "u2")
+        self.assertIn("_sdc_deleted_at", records[1])
+        self.assertEqual(len(state["bookmarks"]["users"]["fingerprints"]), 1)
+
+        schema = [m for m in messages if m["type"] == "SCHEMA"][0]["schema"]
+        self.assertIn("_sdc_deleted_at", schema["properties"])
+
+    def test_fingerprints_are_kept_out_of_the_state(self):
+        """With fingerprint_dir only the name of the latest fingerprint file is bookmarked."""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.config["fingerprint_dir"] = tmp.name
+        records = [{"id": "u1", "name": "Ann"}, {"id": "u2", "name": "Bob"}]
+
+        state, messages = self.sync(records, {})
+        self.assertEqual(len(self.records(messages)), 2)
+        self.assertEqual(list(state["bookmarks"]["users"]), ["fingerprints_file"])
+
+        first_file = state["bookmarks"]["users"]["fingerprints_file"]
+        state, messages = self.sync(records, state)
+        self.assertEqual(self.records(messages), [])
+
+        # The file named by the incoming state is kept for one more run
+        state, messages = self.sync(records, state)
+        self.assertEqual(self.records(messages), [])
+        files = os.listdir(os.path.join(tmp.name, "users"))
+        self.assertEqual(len(files), 2)
+        self.assertIn(state["bookmarks"]["users"]["fingerprints_file"], files)
+        self.assertNotIn(first_file, files)
+
+    def test_bookmarked_fingerprints_move_to_the_store(self):
+        """Fingerprints bookmarked before fingerprint_dir was set are still used."""
+        state, _ = self.sync([{"id": "u1", "name": "Ann"}], {})
+
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.config["fingerprint_dir"] = tmp.name
+        state, messages = self.sync([{"id": "u1", "name": "Ann"}], state)
+        self.assertEqual(self.records(messages), [])
+        self.assertEqual(list(state["bookmarks"]["users"]), ["fingerprints_file"])
+
+
+
+class TestTableVersions(unittest.TestCase):
+    def setUp(self):
+        output.configure({})
+
+    def sync(self, state):
+        stream = UsersStream({"activate_version": True}, state, build_catalog_entry(UsersStream),
+                             PageClient([{"id": "u1"}, {"id": "u2"}]))
+        stdout = io.StringIO()
+        with patch("sys.stdout", stdout):
+            stream.sync()
+        messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        return stream.state, [m for m in messages if m["type"] != "SCHEMA"]
+
+    def test_records_are_stamped_and_version_activated(self):
+        """The first sync creates the table; later ones only activate once complete."""
+        state, messages = self.sync({})
+        version = state["bookmarks"]["users"]["version"]
+        self.assertEqual([m["type"] for m in messages],
+                         ["ACTIVATE_VERSION", "RECORD", "RECORD", "ACTIVATE_VERSION", "STATE"])
+        self.assertEqual({m["version"] for m in messages[:4]}, {version})
+
+        with patch("time.time", return_value=version / 1000.0 + 60):
+            state, messages = self.sync(state)
+        self.assertEqual([m["type"] for m in messages],
+                         ["RECORD", "RECORD", "ACTIVATE_VERSION", "STATE"])
+        self.assertEqual(messages[-2]["version"], version + 60000)
+        self.assertEqual(state["bookmarks"]["users"]["version"], version + 60000)
+
+    def test_cannot_combine_with_change_detection(self):
+        """A version limited to changed rows would drop every other row."""
+        args = SimpleNamespace(config={"activate_version": True, "change_detection": True},
+                               state={}, catalog=None)
+        with self.assertRaises(RuntimeError):
+            LeverRunner(args, None, []).prepare_sync()
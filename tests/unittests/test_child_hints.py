@@ -0,0 +1,110 @@
+import io
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from tap_lever import hints, output, retries
+from tap_lever.client import LeverClient
+from tap_lever.state import save_state
+from tap_lever.streams import OpportunityStream
+from tap_lever.streams.applications import OpportunityApplicationsStream
+from tap_lever.streams.resumes import OpportunityResumesStream
+
+from helpers import build_catalog_entry
+from stub_server import StubLeverServer
+
+
+def not_found(params):
+    return 404, {"code": "ResourceNotFound", "message": "Resume not found"}
+
+
+def one_record(params):
+    return 200, {"data": [{"id": "child-1"}], "hasNext": False}
+
+
+class TestChildHints(unittest.TestCase):
+    def setUp(self):
+        output.configure({})
+        start = datetime.now(pytz.utc) - timedelta(hours=12)
+        self.start_ms = int(start.timestamp() * 1000)
+        self.config = {"token": "x", "start_date": start.isoformat()}
+        self.addCleanup(retries.configure, {})
+        self.addCleanup(hints.configure, {}, {})
+
+    def sync(self, opportunities, state):
+        routes = {
+            "/v1/opportunities": lambda params: (200, {"data": opportunities, "hasNext": False}),
+            "/v1/opportunities/opp-0/applications": one_record,
+            "/v1/opportunities/opp-1/applications": one_record,
+            "/v1/opportunities/opp-0/resumes": not_found,
+            "/v1/opportunities/opp-1/resumes": one_record,
+        }
+        retries.configure(state)
+        hints.configure(state, self.config)
+
+        stdout = io.StringIO()
+        with StubLeverServer(routes) as server, patch("sys.stdout", stdout):
+            config = dict(self.config, base_url=server.base_url)
+            stream = OpportunityStream(config, state, build_catalog_entry(OpportunityStream),
+                                       LeverClient(config))
+            state = stream.sync({
+                "opportunity_applications": build_catalog_entry(OpportunityApplicationsStream),
+                "opportunity_resumes": build_catalog_entry(OpportunityResumesStream),
+            })
+            save_state(state)
+
+        requested = sorted(path for path, _ in server.requests if path != "/v1/opportunities")
+        return requested, state
+
+    def test_empty_application_list_skips_request(self):
+        """An opportunity without application ids is never asked for applications."""
+        opportunities = [
+            {"id": "opp-0", "updatedAt": self.start_ms, "applications": ["app-0"]},
+            {"id": "opp-1", "updatedAt": self.start_ms, "applications": []},
+        ]
+        requested, _ = self.sync(opportunities, {})
+
+        self.assertIn("/v1/opportunities/opp-0/applications", requested)
+        self.assertNotIn("/v1/opportunities/opp-1/applications", requested)
+
+    def test_parents_without_resumes_are_remembered_until_updated(self):
+        """A parent known to have no resumes is skipped while its updatedAt is unchanged."""
+        opportunities = [{"id": "opp-0", "updatedAt": self.start_ms},
+                         {"id": "opp-1", "updatedAt": self.start_ms}]
+        _, state = self.sync(opportunities, {})
+        entry = state["empty_parents"]["opportunity_resumes"]["opp-0"]
+        self.assertEqual(entry[0], self.start_ms)
+        self.assertNotIn("opp-1", state["empty_parents"]["opportunity_resumes"])
+
+        requested, state = self.sync(opportunities, state)
+        self.assertNotIn("/v1/opportunities/opp-0/resumes", requested)
+        self.assertIn("/v1/opportunities/opp-1/resumes", requested)
+
+        opportunities[0]["updatedAt"] += 1
+        requested, _ = self.sync(opportunities, state)
+        self.assertIn("/v1/opportunities/opp-0/resumes", requested)
+
+    def test_entries_expire(self):
+        """Expired entries no longer skip requests and are dropped from state."""
+        cache = hints.EmptyParentCache({"opportunity_resumes": {
+            "opp-0": [1, int(time.time()) - 1],
+            "opp-1": [1, int(time.time()) + 60],
+        }})
+
+        self.assertFalse(cache.is_empty("opportunity_resumes", "opp-0", 1))
+        self.assertTrue(cache.is_empty("opportunity_resumes", "opp-1", 1))
+        self.assertEqual(list(cache.dump()["opportunity_resumes"]), ["opp-1"])
+
+    def test_size_is_capped(self):
+        """Past the limit the oldest entries go, so STATE messages stay small."""
+        cache = hints.EmptyParentCache(max_entries=10)
+        now = time.time()
+        with patch("time.time", side_effect=[now + i for i in range(11)]):
+            for i in range(11):
+                cache.add("opportunity_resumes", "opp-{}".format(i), 1)
+
+        self.assertEqual(sorted(cache.dump()["opportunity_resumes"], key=lambda key: int(key[4:])),
+                         ["opp-{}".format(i) for i in range(2, 11)])
@@ -0,0 +1,111 @@
+import io
+import json
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from tap_lever import output, retries
+from tap_lever.client import LeverClient, ServerAuthError
+from tap_lever.state import save_state
+from tap_lever.streams import OpportunityStream
+from tap_lever.streams.offers import OpportunityOffersStream
+
+from helpers import build_catalog_entry
+from stub_server import StubLeverServer
+
+
+class FlakyOffers:
+    """Fails the offers of `opp-1` with a 400 the first `failures` times."""
+
+    def __init__(self, failures):
+        self.failures = failures
+
+    def __call__(self, params):
+        return 200, {"data": [{"id": "offer-1"}], "hasNext": False}
+
+    def failing(self, params):
+        if self.failures:
+            self.failures -= 1
+            return 400, {"code": "BadRequestError", "message": "Try again"}
+        return self(params)
+
+
+class TestChildRetries(unittest.TestCase):
+    def setUp(self):
+        output.configure({})
+        start = datetime.now(pytz.utc) - timedelta(hours=12)
+        self.start_ms = int(start.timestamp() * 1000)
+        self.config = {"token": "x", "start_date": start.isoformat()}
+
+    def sync(self, offers, state):
+        opportunities = [{"id": "opp-{}".format(i), "updatedAt": self.start_ms + i}
+                         for i in range(3)]
+        routes = {
+            "/v1/opportunities": lambda params: (200, {"data": opportunities, "hasNext": False}),
+            "/v1/opportunities/opp-0/offers": offers,
+            "/v1/opportunities/opp-1/offers": offers.failing,
+            "/v1/opportunities/opp-2/offers": offers,
+        }
+        retries.configure(state)
+        self.addCleanup(retries.configure, {})
+
+        stdout = io.StringIO()
+        with StubLeverServer(routes) as server, patch("sys.stdout", stdout):
+            config = dict(self.config, base_url=server.base_url)
+            stream = OpportunityStream(config, state, build_catalog_entry(OpportunityStream),
+                                       LeverClient(config))
+            state = stream.sync({"opportunity_offers": build_catalog_entry(OpportunityOffersStream)})
+            save_state(state)
+
+        messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        offers_for = [m["record"]["opportunityId"] for m in messages
+                      if m["type"] == "RECORD" and m["stream"] == "opportunity_offers"]
+        return offers_for, [m["value"] for m in messages if m["type"] == "STATE"]
+
+    def test_failed_child_is_retried_at_end_of_run(self):
+        """A failing parent is skipped, then fetched again once the stream is done."""
+        offers_for, states = self.sync(FlakyOffers(failures=1), {})
+
+        self.assertEqual(offers_for, ["opp-0", "opp-2", "opp-1"])
+        self.assertIn("opp-1", states[0]["failed_children"]["opportunity_offers"])
+        self.assertNotIn("failed_children", states[-1])
+
+    def test_dead_letters_are_persisted_and_retried_next_run(self):
+        """Parents that still fail stay in state and are retried by the next run."""
+        offers_for, states = self.sync(FlakyOffers(failures=2), {})
+
+        self.assertEqual(offers_for, ["opp-0", "opp-2"])
+        failed = states[-1]["failed_children"]["opportunity_offers"]["opp-1"]
+        self.assertEqual(failed["attempts"], 2)
+        self.assertIn("BadRequestError", failed["error"])
+
+        state = {"bookmarks": states[-1]["bookmarks"],
+                 "failed_children": states[-1]["failed_children"]}
+        with patch.object(OpportunityStream, "sync_data_for_period"):
+            offers_for, states = self.sync(FlakyOffers(failures=0), state)
+
+        self.assertEqual(offers_for, ["opp-1"])
+        self.assertNotIn("failed_children", states[-1])
+
+    def test_permission_errors_fail_the_run(self):
+        """A token without access to a child stream isn't deferred parent by parent."""
+        offers = FlakyOffers(failures=1)
+        offers.failing = lambda params: (403, {"code": "Forbidden", "message": "Not allowed"})
+
+        with self.assertRaises(ServerAuthError):
+            self.sync(offers, {})
+
+    def test_parents_are_given_up_on(self):
+        """A parent failing `max_attempts` times is dropped, and too many failing parents fail the run."""
+        queue = retries.RetryQueue(max_attempts=3, max_failed=2)
+        for _ in range(3):
+            queue.add("opportunity_offers", "opp-0", RuntimeError("Try again"))
+        self.assertEqual(queue.dump(), {})
+
+        queue.defer("opportunity_offers", "opp-9")
+        queue.add("opportunity_offers", "opp-1", RuntimeError("Try again"))
+        queue.add("opportunity_offers", "opp-2", RuntimeError("Try again"))
+        with self.assertRaises(retries.TooManyFailuresError):
+            queue.add("opportunity_offers", "opp-3", RuntimeError("Try again"))
@@ -0,0 +1,68 @@
+import io
+import json
+import threading
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from tap_lever import LeverRunner, output
+from tap_lever.state import save_state, share_state, unshare_state
+
+
+class FakeStream:
+    PARENT = None
+
+    def __init__(self, table, barrier=None):
+        self.TABLE = table
+        self.barrier = barrier
+        self.state = None
+        self.thread = None
+
+    def sync(self):
+        self.thread = threading.current_thread().name
+        if self.barrier is not None:
+            # Only passes if both streams are running at the same time
+            self.barrier.wait(timeout=5)
+        output.write_records(self.TABLE, [{"id": i} for i in range(50)])
+        self.state.setdefault("bookmarks", {})[self.TABLE] = {"last_record": self.TABLE}
+        save_state(self.state)
+
+
+class TestConcurrentSync(unittest.TestCase):
+    def setUp(self):
+        output.configure({})
+
+    @patch("sys.stdout", new_callable=io.StringIO)
+    def test_independent_streams_run_side_by_side(self, stdout):
+        """Independent streams sync concurrently and their bookmarks merge."""
+        barrier = threading.Barrier(2)
+        streams = [FakeStream("users", barrier), FakeStream("stages", barrier)]
+        args = SimpleNamespace(config={"max_concurrent_streams": 2},
+                               state={"bookmarks": {"candidates": {"last_record": "x"}}},
+                               catalog=None)
+        runner = LeverRunner(args, None, [])
+
+        with patch.object(runner, "get_streams_to_replicate", return_value=(streams, {})):
+            runner.do_sync()
+
+        self.assertNotEqual(streams[0].thread, streams[1].thread)
+        self.assertEqual(set(runner.state["bookmarks"]), {"candidates", "users", "stages"})
+
+        messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        final_state = [m for m in messages if m["type"] == "STATE"][-1]["value"]
+        self.assertEqual(final_state, runner.state)
+
+    def test_merge_only_touches_claimed_tables(self):
+        """A stale copy of another stream's bookmark never overwrites it."""
+        shared = share_state({"bookmarks": {"users": {"v": 1}}})
+        try:
+            shared.merge({"bookmarks": {"users": {"v": 2}}})
+            shared.claim(["requisitions"])
+            merged = shared.merge({"bookmarks": {"users": {"v": 0},
+                                                 "requisitions": {"v": 5}}})
+        finally:
+            state = unshare_state()
+
+        self.assertEqual(merged, {"bookmarks": {"users": {"v": 1},
+                                                "requisitions": {"v": 5}}})
+        self.assertEqual(state, merged)
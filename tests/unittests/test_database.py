@@ -0,0 +1,63 @@
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from tap_lever import output
+from tap_lever.database import DatabaseSink
+from tap_lever.streams import UsersStream
+
+from helpers import PageClient, build_catalog_entry
+
+
+class TestDatabaseSink(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "lever.sqlite")
+        self.addCleanup(output.configure, {})
+
+    def query(self, sql):
+        with sqlite3.connect(self.path) as connection:
+            return connection.execute(sql).fetchall()
+
+    def sync(self, records):
+        output.configure({"database_path": self.path})
+        stream = UsersStream({}, {}, build_catalog_entry(UsersStream), PageClient(records))
+        stdout = io.StringIO()
+        with patch("sys.stdout", stdout):
+            stream.sync()
+        output.close()
+        return [json.loads(line)["type"] for line in stdout.getvalue().splitlines()]
+
+    def test_records_are_upserted_with_the_state(self):
+        """Rows land in a table typed from the schema and are updated by key on the next run."""
+        messages = self.sync([{"id": "u1", "name": "Ann", "createdAt": 1600000000000,
+                               "accessRole": "admin", "deactivatedAt": None}])
+        self.assertEqual(messages, [])
+
+        self.sync([{"id": "u1", "name": "Anne", "createdAt": 1600000000000},
+                   {"id": "u2", "name": "Bob"}])
+
+        self.assertEqual(self.query('SELECT id, name, createdAt FROM users ORDER BY id'),
+                         [("u1", "Anne", "2020-09-13T12:26:40.000000Z"), ("u2", "Bob", None)])
+        columns = {row[1]: row[2] for row in self.query('PRAGMA table_info(users)')}
+        self.assertEqual(columns["createdAt"], "TEXT")
+
+    def test_rows_after_the_last_state_are_rolled_back(self):
+        """Only rows covered by a committed state are kept."""
+        sink = DatabaseSink({"database_path": self.path})
+        schema = {"properties": {"id": {"type": ["string"]}, "tags": {"type": ["null", "array"]}}}
+        sink.set_schema("users", schema, ["id"])
+        sink.write_records("users", [{"id": "u1", "tags": ["a"]}])
+        sink.write_state({"bookmarks": {"users": {"version": 1}}})
+        sink.write_records("users", [{"id": "u2", "tags": None}])
+        sink.close()
+
+        self.assertEqual(self.query('SELECT id, tags FROM users'), [("u1", '["a"]')])
+        reopened = DatabaseSink({"database_path": self.path})
+        self.assertEqual(reopened.read_state(), {"bookmarks": {"users": {"version": 1}}})
+        reopened.close()
@@ -0,0 +1,131 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+
+import pytz
+
+from tap_lever import downloads, hints, output, retries
+from tap_lever.client import LeverClient
+from tap_lever.downloads import ResumeDownloader
+from tap_lever.state import save_state
+from tap_lever.streams import OpportunityStream
+from tap_lever.streams.resumes import OpportunityResumesStream
+
+from helpers import build_catalog_entry
+from stub_server import StubLeverServer
+
+
+def make_response(status_code, body):
+    response = MagicMock(status_code=status_code)
+    response.__enter__.return_value = response
+    response.iter_content.return_value = [body[i:i + 3] for i in range(0, len(body), 3)]
+    return response
+
+
+class TestResumeDownloader(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.client = MagicMock()
+        self.downloader = ResumeDownloader(
+            {"resume_download_dir": self.tmp.name, "resume_download_rate_limit": 100},
+            self.client)
+        self.addCleanup(self.downloader.shutdown)
+
+    def test_identical_files_are_stored_once(self):
+        """Two resumes with the same content share one stored file."""
+        body = b"same resume body"
+        self.client.stream_request.side_effect = [
+            make_response(200, body), make_response(200, body)]
+
+        results = self.downloader.download_all([("r1", "url/r1"), ("r2", "url/r2")])
+
+        sha256 = hashlib.sha256(body).hexdigest()
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0][0], sha256)
+        with open(results[0][1], "rb") as handle:
+            self.assertEqual(handle.read(), body)
+        self.assertEqual(os.listdir(os.path.join(self.tmp.name, ".partial")), [])
+
+    def test_partial_download_is_resumed(self):
+        """An existing partial file is continued with a Range request."""
+        with open(os.path.join(self.tmp.name, ".partial", "r1.part"), "wb") as handle:
+            handle.write(b"hello ")
+        self.client.stream_request.return_value = make_response(206, b"world")
+
+        sha256, path = self.downloader.download("r1", "url/r1")
+
+        self.client.stream_request.assert_called_once_with(
+            "url/r1", headers={"Range": "bytes=6-"})
+        self.assertEqual(sha256, hashlib.sha256(b"hello world").hexdigest())
+        with open(path, "rb") as handle:
+            self.assertEqual(handle.read(), b"hello world")
+
+    def test_concurrent_requests_for_one_resume_share_a_download(self):
+        """A resume asked for while it downloads isn't fetched into the same partial file again."""
+        started, release = threading.Event(), threading.Event()
+
+        def stream_request(url, headers=None):
+            started.set()
+            release.wait(5)
+            return make_response(200, b"resume body")
+
+        self.client.stream_request.side_effect = stream_request
+        first = self.downloader.submit("r1", "url/r1")
+        started.wait(5)
+        second = self.downloader.submit("r1", "url/r1")
+        release.set()
+
+        self.assertIs(first, second)
+        self.assertEqual(first.result(), second.result())
+        self.assertEqual(self.client.stream_request.call_count, 1)
+        self.assertEqual(self.downloader.in_flight, {})
+
+
+class TestResumeFiles(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        output.configure({})
+        self.addCleanup(retries.configure, {})
+        self.addCleanup(hints.configure, {}, {})
+        self.addCleanup(downloads.shutdown)
+
+    def test_missing_file_keeps_the_resume(self):
+        """A resume whose file is gone is emitted without it, and its parent isn't taken as empty."""
+        start = datetime.now(pytz.utc) - timedelta(hours=12)
+        opportunity = {"id": "opp-0", "updatedAt": int(start.timestamp() * 1000)}
+        routes = {
+            "/v1/opportunities": lambda params: (200, {"data": [opportunity], "hasNext": False}),
+            "/v1/opportunities/opp-0/resumes": lambda params: (
+                200, {"data": [{"id": "res-0", "file": {"name": "cv.pdf"}}], "hasNext": False}),
+            "/v1/opportunities/opp-0/resumes/res-0/download": lambda params: (
+                404, {"code": "ResourceNotFound", "message": "File not found"}),
+        }
+        state = {}
+        retries.configure(state)
+
+        stdout = io.StringIO()
+        with StubLeverServer(routes) as server, patch("sys.stdout", stdout):
+            config = {"token": "x", "base_url": server.base_url, "start_date": start.isoformat(),
+                      "resume_download_dir": self.tmp.name}
+            client = LeverClient(config)
+            hints.configure(state, config)
+            downloads.configure(config, client)
+            stream = OpportunityStream(config, state, build_catalog_entry(OpportunityStream), client)
+            state = stream.sync({"opportunity_resumes": build_catalog_entry(OpportunityResumesStream)})
+            save_state(state)
+
+        messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        resumes = [message["record"] for message in messages
+                   if message["type"] == "RECORD" and message["stream"] == "opportunity_resumes"]
+        self.assertEqual([resume["id"] for resume in resumes], ["res-0"])
+        self.assertNotIn("localPath", resumes[0])
+        self.assertNotIn("opportunity_resumes", state.get("empty_parents", {}))
+        self.assertNotIn("opportunity_resumes", state.get("failed_children", {}))
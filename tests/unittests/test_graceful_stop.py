@@ -0,0 +1,149 @@
+import io
+import json
+import os
+import signal
+import unittest
+from datetime import datetime, timedelta
+
+from dateutil.parser import parse
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytz
+
+from tap_lever import LeverRunner, deadline, output, retries
+from tap_lever.client import LeverClient
+from tap_lever.scheduler import build_pipelines
+from tap_lever.state import save_state
+from tap_lever.streams import CandidateOffersStream, CandidateStream, OpportunityStream
+
+from helpers import build_catalog_entry
+from stub_server import StubLeverServer
+
+
+class SignallingStream:
+    PARENT = None
+
+    def __init__(self, table, send_signal=False):
+        self.TABLE = table
+        self.send_signal = send_signal
+        self.state = None
+        self.synced = False
+
+    def sync(self):
+        self.synced = True
+        if self.send_signal:
+            os.kill(os.getpid(), signal.SIGTERM)
+        self.state.setdefault("bookmarks", {})[self.TABLE] = {"last_record": self.TABLE}
+        save_state(self.state)
+
+
+class TestGracefulStop(unittest.TestCase):
+    def setUp(self):
+        output.configure({})
+        self.addCleanup(deadline.configure, {})
+
+    @patch("sys.stdout", new_callable=io.StringIO)
+    def test_sigterm_stops_before_the_next_stream(self, stdout):
+        """SIGTERM lets the running stream finish and checkpoints its state."""
+        streams = [SignallingStream("users", send_signal=True), SignallingStream("stages")]
+        args = SimpleNamespace(config={}, state={}, catalog=None)
+        runner = LeverRunner(args, None, [])
+
+        with patch.object(runner, "get_streams_to_replicate", return_value=(streams, {})):
+            runner.do_sync()
+
+        self.assertFalse(streams[1].synced)
+        self.assertIs(signal.getsignal(signal.SIGTERM), signal.SIG_DFL)
+
+        messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        self.assertEqual(messages[-1]["value"], {"bookmarks": {"users": {"last_record": "users"}}})
+
+    def test_max_runtime_keeps_the_page_offset(self):
+        """A stopped window keeps its offset so the next run continues after the last page."""
+        start = datetime.now(pytz.utc) - timedelta(hours=12)
+        start_ms = int(start.timestamp() * 1000)
+        records = [{"id": "opp-{}".format(i), "updatedAt": start_ms + i} for i in range(6)]
+
+        def opportunities(params):
+            offset = int(params.get("offset", "0"))
+            if offset == 0:
+                # The deadline passes while the first page is on its way
+                deadline.request_stop("Reached max_runtime")
+            body = {"data": records[offset:offset + 2], "hasNext": offset + 2 < len(records)}
+            if body["hasNext"]:
+                body["next"] = str(offset + 2)
+            return 200, body
+
+        stdout = io.StringIO()
+        with StubLeverServer({"/v1/opportunities": opportunities}) as server, \
+                patch("sys.stdout", stdout):
+            config = {"token": "x", "start_date": start.isoformat(), "base_url": server.base_url}
+            deadline.configure(config)
+            stream = OpportunityStream(config, {}, build_catalog_entry(OpportunityStream), LeverClient(config))
+            state = stream.sync({})
+
+        messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        emitted = [m["record"]["id"] for m in messages if m["type"] == "RECORD"]
+        self.assertEqual(emitted, ["opp-0", "opp-1"])
+        self.assertEqual(len(server.requests), 1)
+        self.assertEqual(state["bookmarks"]["opportunities"]["offset"], "2")
+        self.assertEqual(messages[-1]["value"], state)
+
+    def test_stopped_child_stream_keeps_one_position(self):
+        """Candidates a child stream didn't reach are kept as one position the next run reads them from."""
+        self.addCleanup(retries.configure, {})
+        start = datetime.now(pytz.utc) - timedelta(days=10)
+        start_ms = int(start.timestamp() * 1000)
+        second_window = start + timedelta(days=7)
+        second_window_ms = int(second_window.timestamp() * 1000)
+        candidates = [{"id": "c-0", "updatedAt": start_ms + 1000},
+                      {"id": "c-1", "updatedAt": start_ms + 2000},
+                      {"id": "c-2", "updatedAt": second_window_ms + 1000},
+                      {"id": "c-3", "updatedAt": second_window_ms + 2000}]
+
+        def list_candidates(params):
+            window = [candidate for candidate in candidates
+                      if int(params["updated_at_start"]) <= candidate["updatedAt"] < int(params["updated_at_end"])]
+            return 200, {"data": window, "hasNext": False}
+
+        def offers(params):
+            return 200, {"data": [], "hasNext": False}
+
+        stops = []
+
+        def stopping_offers(params):
+            # The deadline passes during the offers of the second window's first candidate, once
+            if not stops:
+                stops.append(params)
+                deadline.request_stop("Reached max_runtime")
+            return offers(params)
+
+        routes = {"/v1/candidates": list_candidates}
+        routes.update({"/v1/candidates/{}/offers".format(candidate["id"]): offers for candidate in candidates})
+        routes["/v1/candidates/c-2/offers"] = stopping_offers
+
+        def sync(state):
+            retries.configure(state)
+            config = {"token": "x", "start_date": start.isoformat(), "base_url": server.base_url}
+            client = LeverClient(config)
+            streams = [CandidateStream(config, state, build_catalog_entry(CandidateStream), client),
+                       CandidateOffersStream(config, state, build_catalog_entry(CandidateOffersStream), client)]
+            state = build_pipelines(streams, {})[0].sync(state)
+            save_state(state)
+            return state
+
+        with StubLeverServer(routes) as server, patch("sys.stdout", io.StringIO()):
+            state = sync({})
+            self.assertEqual(list(state["deferred_children"]), ["candidate_offers"])
+            self.assertEqual(parse(state["deferred_children"]["candidate_offers"]), second_window)
+            self.assertNotIn("failed_children", state)
+
+            deadline.configure({})
+            del server.requests[:]
+            state = sync(state)
+
+        first_window = [params for path, params in server.requests if path == "/v1/candidates"][0]
+        # Bookmarks are kept to the second
+        self.assertAlmostEqual(int(first_window["updated_at_start"]), second_window_ms, delta=1000)
+        self.assertNotIn("deferred_children", state)
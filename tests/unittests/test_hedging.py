@@ -0,0 +1,63 @@
+import threading
+import time
+import unittest
+
+from tap_lever.client import LeverClient
+from tap_lever.latency import get_endpoint
+
+from stub_server import StubLeverServer
+
+
+class TestAdaptiveTimeouts(unittest.TestCase):
+    def test_endpoints_group_urls_by_parent(self):
+        """Ids are replaced so every parent's child request shares one endpoint."""
+        self.assertEqual(get_endpoint("https://api.lever.co/v1/opportunities"),
+                         "/v1/opportunities")
+        self.assertEqual(get_endpoint("https://api.lever.co/v1/opportunities/abc/offers"),
+                         "/v1/opportunities/{id}/offers")
+
+    def test_timeout_follows_observed_latency(self):
+        """The timeout is a multiple of the p99, between a floor and the configured ceiling."""
+        client = LeverClient({"token": "x", "request_timeout": 60})
+        endpoint = "/v1/candidates"
+        self.assertEqual(client.get_timeout(endpoint), 60)
+
+        for _ in range(20):
+            client.latency.observe(endpoint, 0.1)
+        self.assertEqual(client.get_timeout(endpoint), 5)
+
+        for _ in range(20):
+            client.latency.observe(endpoint, 3)
+        self.assertEqual(client.get_timeout(endpoint), 12)
+
+        for _ in range(20):
+            client.latency.observe(endpoint, 30)
+        self.assertEqual(client.get_timeout(endpoint), 60)
+
+
+class TestHedgedRequests(unittest.TestCase):
+    def test_slow_child_request_is_hedged(self):
+        """A child GET slower than the p95 gets a second copy, and the faster one wins."""
+        calls = []
+        lock = threading.Lock()
+
+        def offers(params):
+            with lock:
+                calls.append(params)
+                first = len(calls) == 1
+            if first:
+                time.sleep(2)
+            return 200, {"data": [{"id": "offer-1"}], "hasNext": False}
+
+        with StubLeverServer({"/v1/opportunities/opp-1/offers": offers}) as server:
+            client = LeverClient({"token": "x", "hedge_requests": True})
+            for _ in range(20):
+                client.latency.observe("/v1/opportunities/{id}/offers", 0.05)
+
+            started = time.monotonic()
+            result = client.make_request(server.base_url + "/opportunities/opp-1/offers", "GET")
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(result["data"], [{"id": "offer-1"}])
+        self.assertEqual(len(calls), 2)
+        self.assertLess(elapsed, 1.5)
@@ -0,0 +1,104 @@
+import io
+import json
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from singer import metadata
+from singer.catalog import Catalog
+
+from tap_lever import LeverRunner, accounts
+from tap_lever.streams import AVAILABLE_STREAMS, StagesStream, UsersStream
+
+from stub_server import StubLeverServer
+
+
+def build_catalog():
+    entries = []
+    for stream_class in (UsersStream, StagesStream):
+        entry = stream_class({}, {}, None, None).generate_catalog()[0]
+        mdata = metadata.to_map(entry["metadata"])
+        mdata = metadata.write(mdata, (), "selected", True)
+        entry["metadata"] = metadata.to_list(mdata)
+        entries.append(entry)
+    return Catalog.from_dict({"streams": entries})
+
+
+def serve(prefix):
+    def route(params):
+        return 200, {"data": [{"id": "{}-{}".format(prefix, i)} for i in range(2)], "hasNext": False}
+    return {"/v1/users": route, "/v1/stages": route}
+
+
+class TestMultiAccount(unittest.TestCase):
+    def sync(self, max_workers, state):
+        stdout = io.StringIO()
+        with StubLeverServer(serve("a")) as first, StubLeverServer(serve("b")) as second, \
+                patch("sys.stdout", stdout):
+            config = {
+                "change_detection": True,
+                "max_concurrent_streams": max_workers,
+                "accounts": [
+                    {"account_id": "acme", "token": "t1", "base_url": first.base_url},
+                    {"account_id": "globex", "token": "t2", "base_url": second.base_url,
+                     "start_date": "2020-01-01T00:00:00Z"},
+                ],
+            }
+            args = SimpleNamespace(config=config, state=state, catalog=build_catalog())
+            runner = LeverRunner(args, None, AVAILABLE_STREAMS)
+            runner.do_sync()
+
+        messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        return runner.state, messages
+
+    def check(self, state, messages):
+        records = [m["record"] for m in messages if m["type"] == "RECORD"]
+        self.assertEqual(sorted((r["_sdc_account_id"], r["id"]) for r in records
+                                if r["id"].endswith("-0")),
+                         [("acme", "a-0"), ("acme", "a-0"), ("globex", "b-0"), ("globex", "b-0")])
+
+        schema = [m for m in messages if m["type"] == "SCHEMA"][0]
+        self.assertEqual(schema["key_properties"], ["id", "_sdc_account_id"])
+
+        self.assertEqual(set(state), {"accounts"})
+        for account_id, prefix in (("acme", "a"), ("globex", "b")):
+            bookmarks = state["accounts"][account_id]["bookmarks"]
+            self.assertEqual(set(bookmarks), {"users", "stages"})
+            self.assertEqual(sorted(json.loads(key)[0] for key in bookmarks["users"]["fingerprints"]),
+                             ["{}-0".format(prefix), "{}-1".format(prefix)])
+
+        self.assertEqual([m for m in messages if m["type"] == "STATE"][-1]["value"], state)
+
+    def test_accounts_share_one_state_document(self):
+        """Every account's records are tagged and its bookmarks kept under its id."""
+        state, messages = self.sync(1, {})
+        self.check(state, messages)
+
+        # Nothing changed, so the second run emits no records
+        state, messages = self.sync(1, state)
+        self.assertEqual([m for m in messages if m["type"] == "RECORD"], [])
+
+    def test_accounts_sync_concurrently(self):
+        """Pipelines of different accounts run on one pool without mixing state."""
+        state, messages = self.sync(4, {})
+        self.check(state, messages)
+
+    def test_each_token_gets_its_own_client(self):
+        """Accounts share the connection pool but not the rate limiter."""
+        session = accounts.build_session(4)
+        first, second = accounts.get_accounts(
+            {"max_requests_per_second": 5, "accounts": [{"token": "t1"}, {"token": "t2"}]},
+            session)
+
+        self.assertIs(first.client.session, second.client.session)
+        self.assertIsNot(first.client.rate_limiter, second.client.rate_limiter)
+        self.assertNotIn("t1", first.id)
+        self.assertEqual(first.config["token"], "t1")
+
+    def test_cannot_combine_with_activate_version(self):
+        """Each account activating its own version would drop the other accounts' rows."""
+        config = {"activate_version": True,
+                  "accounts": [{"token": "t1"}, {"token": "t2"}]}
+        args = SimpleNamespace(config=config, state={}, catalog=build_catalog())
+        with self.assertRaises(RuntimeError), patch("sys.stdout", io.StringIO()):
+            LeverRunner(args, None, AVAILABLE_STREAMS).do_sync()
@@ -0,0 +1,95 @@
+import io
+import json
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from tap_lever import output
+from tap_lever.client import LeverClient
+from tap_lever.streams import OpportunityStream
+
+from helpers import build_catalog_entry
+from stub_server import StubLeverServer
+
+
+class ExpiringOpportunities:
+    """Serves opportunities newest first, two per page, and rejects the given
+    offset token the first time it is used."""
+
+    def __init__(self, records, expire_token):
+        self.records = records
+        self.expire_token = expire_token
+
+    def __call__(self, params):
+        if self.expire_token is not None and params.get("offset") == self.expire_token:
+            self.expire_token = None
+            return 400, {"code": "BadRequestError",
+                         "message": "Invalid offset token: {}".format(params["offset"])}
+
+        matching = [
+            record for record in self.records
+            if int(params["updated_at_start"]) <= record["updatedAt"] < int(params["updated_at_end"])
+        ]
+        start = int(params.get("offset", "tok-0").split("-")[1])
+        body = {"data": matching[start:start + 2], "hasNext": start + 2 < len(matching)}
+        if body["hasNext"]:
+            body["next"] = "tok-{}".format(start + 2)
+        return 200, body
+
+
+class TestOffsetRecovery(unittest.TestCase):
+    def setUp(self):
+        output.configure({})
+        start = datetime.now(pytz.utc) - timedelta(hours=12)
+        self.start_ms = int(start.timestamp() * 1000)
+        self.records = [{"id": "opp-{}".format(i), "updatedAt": self.start_ms + 10000 - 1000 * i}
+                        for i in range(10)]
+        self.config = {"token": "x", "start_date": start.isoformat()}
+
+    def sync(self, server, state):
+        config = dict(self.config, base_url=server.base_url)
+        stream = OpportunityStream(config, state, build_catalog_entry(OpportunityStream), LeverClient(config))
+        stdout = io.StringIO()
+        with patch("sys.stdout", stdout):
+            stream.sync({})
+        messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        return [m["record"]["id"] for m in messages if m["type"] == "RECORD"]
+
+    def test_expired_offset_resumes_from_last_updated_at(self):
+        """An expired cursor narrows the window instead of restarting it."""
+        route = ExpiringOpportunities(self.records, expire_token="tok-6")
+        with StubLeverServer({"/v1/opportunities": route}) as server:
+            emitted = self.sync(server, {})
+
+        self.assertEqual(emitted, ["opp-{}".format(i) for i in range(6)] +
+                         ["opp-{}".format(i) for i in range(5, 10)])
+
+        path, params = server.requests[4]
+        self.assertNotIn("offset", params)
+        self.assertEqual(int(params["updated_at_end"]), self.records[5]["updatedAt"] + 1)
+        self.assertEqual(len(server.requests), 7)
+
+    def test_expired_bookmarked_offset_uses_saved_progress(self):
+        """A cursor bookmarked by an interrupted run is recovered the same way."""
+        state = {"bookmarks": {"opportunities": {
+            "offset": "tok-6",
+            "next_page": 4,
+            "window_progress": {"last": self.records[5]["updatedAt"], "order": "desc", "bounds": {}},
+        }}}
+        route = ExpiringOpportunities(self.records, expire_token="tok-6")
+        with StubLeverServer({"/v1/opportunities": route}) as server:
+            emitted = self.sync(server, state)
+
+        self.assertEqual(emitted, ["opp-{}".format(i) for i in range(5, 10)])
+
+    def test_unsorted_results_fall_back_to_a_full_restart(self):
+        """Without a confirmed ordering the window is read again from the start."""
+        records = list(self.records)
+        records[0], records[3] = records[3], records[0]
+        route = ExpiringOpportunities(records, expire_token="tok-6")
+        with StubLeverServer({"/v1/opportunities": route}) as server:
+            emitted = self.sync(server, {})
+
+        self.assertEqual(len(emitted), 16)
@@ -0,0 +1,54 @@
+import threading
+import unittest
+
+from tap_lever.pagination import paginate
+
+
+class FakeClient:
+    def __init__(self, pages, fail_on=None):
+        self.pages = pages
+        self.fail_on = fail_on
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def make_request(self, url, method, params=None):
+        with self.lock:
+            self.calls.append(dict(params))
+        index = int(params.get("offset", 0))
+        if index == self.fail_on:
+            raise RuntimeError("boom")
+        result = {"data": self.pages[index]}
+        if index + 1 < len(self.pages):
+            result["next"] = str(index + 1)
+        return result
+
+
+class TestPaginate(unittest.TestCase):
+    def test_pages_are_yielded_in_order(self):
+        """Prefetching keeps the cursor order of the pages."""
+        pages = [[{"id": i}] for i in range(5)]
+        for depth in (0, 1, 3):
+            client = FakeClient(pages)
+            results = list(paginate(client, "url", "GET", {"limit": 100}, depth=depth))
+            self.assertEqual([r["data"] for r in results], pages)
+            self.assertEqual([c.get("offset") for c in client.calls],
+                             [None, "1", "2", "3", "4"])
+
+    def test_prefetch_errors_are_raised_to_the_consumer(self):
+        """A failure on the background thread surfaces at the failing page."""
+        client = FakeClient([[1], [2], [3]], fail_on=1)
+        pages = paginate(client, "url", "GET", {}, depth=2)
+
+        self.assertEqual(next(pages)["data"], [1])
+        with self.assertRaises(RuntimeError):
+            next(pages)
+
+    def test_closing_early_stops_the_prefetch_thread(self):
+        """Abandoning the iterator doesn't leave the fetch thread running."""
+        client = FakeClient([[i] for i in range(50)])
+        pages = paginate(client, "url", "GET", {}, depth=2)
+        next(pages)
+        pages.close()
+
+        self.assertLess(len(client.calls), 50)
+        self.assertEqual(threading.active_count(), 1)
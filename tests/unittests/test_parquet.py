@@ -0,0 +1,94 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from tap_lever import output
+from tap_lever.state import save_state
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": "string"},
+        "createdAt": {"type": ["string", "null"], "format": "date-time"},
+        "tags": {"type": ["array", "null"]},
+        "isAnonymized": {"type": ["null", "boolean"]},
+    },
+}
+
+
+@unittest.skipUnless(pq is not None, "pyarrow is not installed")
+class TestParquetSink(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        output.configure({"parquet_dir": self.tmp.name})
+        self.addCleanup(output.configure, {})
+
+    def files(self):
+        return sorted(os.path.relpath(os.path.join(root, name), self.tmp.name)
+                      for root, _, names in os.walk(self.tmp.name) for name in names)
+
+    @patch("sys.stdout", new_callable=io.StringIO)
+    def test_writes_typed_columns_per_window(self, stdout):
+        """Pages become typed columns in one file per stream and window."""
+        output.write_schema("opportunities", SCHEMA, ["id"])
+        output.set_partition("opportunities", "window=2020-01-01")
+        output.write_records("opportunities", [
+            {"id": "1", "createdAt": 1577836800000, "tags": ["a"], "isAnonymized": False},
+        ])
+        output.set_partition("opportunities", "window=2020-01-02")
+        output.write_records("opportunities", [
+            {"id": "2", "createdAt": "2020-01-02T00:00:00Z", "tags": None},
+        ])
+        save_state({"bookmarks": {"opportunities": {}}})
+        output.close()
+
+        files = self.files()
+        self.assertEqual([os.path.dirname(path) for path in files],
+                         ["opportunities/window=2020-01-01",
+                          "opportunities/window=2020-01-02"])
+
+        first = pq.read_table(os.path.join(self.tmp.name, files[0]))
+        self.assertEqual(str(first.schema.field("createdAt").type), "timestamp[ms, tz=UTC]")
+        self.assertEqual(first.column("createdAt")[0].value, 1577836800000)
+        self.assertEqual(json.loads(first.column("tags")[0].as_py()), ["a"])
+
+        second = pq.read_table(os.path.join(self.tmp.name, files[1])).to_pylist()
+        self.assertEqual(second[0]["createdAt"].isoformat(), "2020-01-02T00:00:00+00:00")
+        self.assertIsNone(second[0]["isAnonymized"])
+
+        # Only STATE goes to stdout, schemas and records are in the files
+        types = [json.loads(line)["type"] for line in stdout.getvalue().splitlines()]
+        self.assertEqual(types, ["STATE"])
+
+    @patch("sys.stdout", new_callable=io.StringIO)
+    def test_files_stay_open_across_checkpoints(self, stdout):
+        """Checkpoints don't close files, and STATE waits until the files are committed."""
+        output.write_schema("users", SCHEMA, ["id"])
+        sink = output.WRITER
+        sink.row_group_size = 2
+        for page in range(3):
+            output.write_records("users", [{"id": "{}-{}".format(page, i)} for i in range(2)])
+            save_state({"bookmarks": {"users": {"page": page}}})
+
+        # One open file, with a hidden name, and no STATE yet
+        self.assertEqual([os.path.basename(path)[0] for path in self.files()], ["."])
+        self.assertEqual(stdout.getvalue(), "")
+
+        sink.commit_interval = 0
+        save_state({"bookmarks": {"users": {"page": 3}}})
+
+        files = self.files()
+        self.assertEqual([os.path.dirname(path) for path in files], ["users/window=all"])
+        parquet_file = pq.ParquetFile(os.path.join(self.tmp.name, files[0]))
+        self.assertEqual(parquet_file.metadata.num_row_groups, 3)
+        states = [json.loads(line)["value"] for line in stdout.getvalue().splitlines()]
+        self.assertEqual(states, [{"bookmarks": {"users": {"page": 3}}}])
@@ -0,0 +1,94 @@
+import io
+import json
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from tap_lever import output
+from tap_lever.client import LeverClient
+from tap_lever.streams import OpportunityStream
+from tap_lever.streams.offers import OpportunityOffersStream
+
+from helpers import build_catalog_entry
+from stub_server import StubLeverServer
+
+STAGES = ["lead-new", "offer", "hired"]
+
+
+def paged(records, params, page_size=2):
+    start = int(params.get("offset") or 0)
+    page = records[start:start + page_size]
+    if start + page_size < len(records):
+        return 200, {"data": page, "hasNext": True, "next": str(start + page_size)}
+    return 200, {"data": page, "hasNext": False}
+
+
+class TestPartitionedSync(unittest.TestCase):
+    def setUp(self):
+        output.configure({})
+        start = datetime.now(pytz.utc) - timedelta(hours=12)
+        self.config = {"token": "x", "start_date": start.isoformat(),
+                       "opportunity_partition_workers": 3, "opportunity_partition_after": 1}
+        self.opportunities = [{"id": "opp-{}".format(i), "stage": STAGES[i % 3]} for i in range(9)]
+
+    def opportunities_route(self, params):
+        records = self.opportunities
+        if "stage_id" in params:
+            records = [record for record in records if record["stage"] == params["stage_id"]]
+        return paged(records, params)
+
+    def routes(self, opportunities_route):
+        routes = {
+            "/v1/opportunities": opportunities_route,
+            "/v1/stages": lambda params: (200, {"data": [{"id": stage} for stage in STAGES], "hasNext": False}),
+        }
+        for record in self.opportunities:
+            routes["/v1/opportunities/{}/offers".format(record["id"])] = \
+                lambda params, opp=record["id"]: (200, {"data": [{"id": "offer-" + opp}], "hasNext": False})
+        return routes
+
+    def sync(self, routes):
+        stdout = io.StringIO()
+        with StubLeverServer(routes) as server, patch("sys.stdout", stdout):
+            config = dict(self.config, base_url=server.base_url)
+            stream = OpportunityStream(config, {}, build_catalog_entry(OpportunityStream), LeverClient(config))
+            state = stream.sync({"opportunity_offers": build_catalog_entry(OpportunityOffersStream)})
+
+        messages = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        emitted = [(m["stream"], m["record"]["id"]) for m in messages if m["type"] == "RECORD"]
+        return state, emitted, server.requests
+
+    def test_dense_window_is_read_by_stage_in_parallel(self):
+        """Past the threshold the window is read per stage, and every opportunity and child is emitted."""
+        state, emitted, requests = self.sync(self.routes(self.opportunities_route))
+
+        # Opportunities read before partitioning aren't emitted or fetched again
+        self.assertEqual(sorted(record_id for stream, record_id in emitted if stream == "opportunities"),
+                         sorted(record["id"] for record in self.opportunities))
+        self.assertEqual(len([1 for stream, _ in emitted if stream == "opportunity_offers"]), 9)
+        self.assertEqual(len([1 for path, _ in requests if path.endswith("/offers")]), 9)
+
+        stage_requests = {params.get("stage_id") for path, params in requests
+                          if path == "/v1/opportunities"}
+        self.assertEqual(stage_requests, {None} | set(STAGES))
+        self.assertNotIn("offset", state["bookmarks"]["opportunities"])
+
+    def test_expired_offset_in_a_partition_is_recovered(self):
+        """A stage whose cursor expires is read again without emitting anything twice."""
+        expired = []
+
+        def opportunities_route(params):
+            if params.get("stage_id") == "lead-new" and params.get("offset") == "2" and not expired:
+                expired.append(True)
+                return 400, {"message": "Invalid offset token: 2"}
+            return self.opportunities_route(params)
+
+        self.opportunities = [{"id": "opp-{}".format(i), "stage": STAGES[i % 3]} for i in range(15)]
+        state, emitted, requests = self.sync(self.routes(opportunities_route))
+
+        self.assertEqual(expired, [True])
+        self.assertEqual(sorted(record_id for stream, record_id in emitted if stream == "opportunities"),
+                         sorted(record["id"] for record in self.opportunities))
+        self.assertEqual(len([1 for stream, _ in emitted if stream == "opportunity_offers"]), 15)
@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import pytz
+
+from tap_lever import budget
+from tap_lever.client import LeverClient
+from tap_lever.planner import SyncPlanner
+from tap_lever.scheduler import build_pipelines
+from tap_lever.streams import CandidateOffersStream, CandidateStream, PostingsStream
+
+from stub_server import StubLeverServer
+
+
+class SampleClient:
+    def __init__(self):
+        self.params = []
+
+    def make_request(self, url, method, params=None):
+        self.params.append(dict(params))
+        if "offset" in params:
+            return {"data": [{"id": i} for i in range(50)]}
+        return {"data": [{"id": i} for i in range(100)], "next": "page-2"}
+
+
+class TestSyncPlanner(unittest.TestCase):
+    def test_projects_requests_from_sampled_density(self):
+        """Sampled windows drive page, child and wall-clock estimates."""
+        start = datetime.now(pytz.utc) - timedelta(days=69)
+        config = {"start_date": start.isoformat(), "max_requests_per_second": 5}
+        client = SampleClient()
+        streams = [CandidateStream(config, {}, None, client),
+                   CandidateOffersStream(config, {}, None, client),
+                   PostingsStream(config, {}, None, client)]
+
+        plan = SyncPlanner(config, client).plan(build_pipelines(streams, {}))
+
+        self.assertEqual(plan["sample_requests"], 6)
+        self.assertEqual(plan["streams"]["candidates"], {
+            "windows": 10,
+            "estimated_records": 1500,
+            "estimate_is_lower_bound": False,
+            "page_requests": 20,
+        })
+        self.assertEqual(plan["streams"]["candidate_offers"],
+                         {"parent": "candidates", "child_requests": 1500})
+        self.assertEqual(plan["streams"]["postings"], {"page_requests": 1})
+        self.assertEqual(plan["estimated_requests"], 1521)
+        self.assertEqual(plan["estimated_seconds"], 305)
+
+    def test_samples_are_neither_charged_nor_archived(self):
+        """Planning leaves the request budget and the response archive alone."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.addCleanup(budget.configure, {}, {}, [])
+        start = datetime.now(pytz.utc) - timedelta(days=13)
+        route = lambda params: (200, {"data": [{"id": "c-1"}], "hasNext": False})
+
+        with StubLeverServer({"/v1/candidates": route}) as server:
+            config = {"token": "x", "base_url": server.base_url, "start_date": start.isoformat(),
+                      "archive_dir": directory.name, "request_budget": 10}
+            budget.configure({}, config, ["candidates"])
+            client = LeverClient(config)
+            stream = CandidateStream(config, {}, None, client)
+            plan = SyncPlanner(config, client).plan(build_pipelines([stream], {}))
+
+        self.assertEqual(plan["sample_requests"], 2)
+        self.assertEqual(budget.get_budget().run_spent, 0)
+        self.assertEqual(os.listdir(directory.name), [])
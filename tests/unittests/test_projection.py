@@ -0,0 +1,39 @@
+import unittest
+
+import singer
+
+from tap_lever.streams import OpportunityStream
+
+from helpers import build_catalog_entry
+
+
+class TestFieldProjection(unittest.TestCase):
+    def test_unselected_fields_are_dropped_before_transform(self):
+        """Unselected and unknown fields never reach the transformer."""
+        catalog = build_catalog_entry(OpportunityStream,
+                                      deselected=("applications", "urls"))
+        stream = OpportunityStream({}, {}, catalog, None)
+        transformer = singer.Transformer(singer.UNIX_MILLISECONDS_INTEGER_DATETIME_PARSING)
+
+        record = {
+            "id": "opp-1",
+            "name": "Jane",
+            "applications": ["app-1", "app-2"],
+            "urls": {"list": "https://example.com"},
+            "updatedAt": 1600000000000,
+        }
+        data = stream.get_stream_data([record], transformer)
+
+        self.assertEqual(data, [{"id": "opp-1", "name": "Jane"}])
+        self.assertEqual(transformer.filtered, set())
+        self.assertEqual(transformer.removed, set())
+
+    def test_key_properties_are_kept_when_deselected(self):
+        """Automatic fields are always emitted."""
+        catalog = build_catalog_entry(OpportunityStream, deselected=("id",))
+        stream = OpportunityStream({}, {}, catalog, None)
+        transformer = singer.Transformer()
+
+        data = stream.get_stream_data([{"id": "opp-1"}], transformer)
+
+        self.assertEqual(data, [{"id": "opp-1"}])
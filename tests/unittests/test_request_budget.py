@@ -0,0 +1,105 @@
+import io
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from tap_lever import budget, output
+from tap_lever.budget import RequestBudget
+from tap_lever.client import LeverClient
+from tap_lever.streams import OpportunityStream, RequisitionStream
+from tap_lever.streams.offers import OpportunityOffersStream
+
+from helpers import build_catalog_entry
+from stub_server import StubLeverServer
+
+
+class BudgetClient:
+    """Answers every window with an empty page, charging the budget like
+    LeverClient does."""
+
+    def __init__(self):
+        self.requests = 0
+
+    def make_request(self, url, method, params=None):
+        budget.charge()
+        self.requests += 1
+        return {"data": []}
+
+
+def spend(request_budget, table):
+    sent = 0
+    while request_budget.allows(table):
+        request_budget.charge(table)
+        sent += 1
+    return sent
+
+
+class TestRequestBudget(unittest.TestCase):
+    def test_shares_follow_weights_and_finished_streams_release_theirs(self):
+        """Each stream gets its weighted part, and what a finished stream left over goes to the rest."""
+        request_budget = RequestBudget(12, None, {"candidates": 3}, ["candidates", "users", "postings"])
+
+        self.assertEqual(spend(request_budget, "users"), 3)
+        self.assertEqual(spend(request_budget, "candidates"), 8)
+
+        request_budget.finish("candidates")
+        request_budget.finish("users")
+        # Everything that is left belongs to the last stream
+        self.assertEqual(spend(request_budget, "postings"), 1)
+        self.assertEqual(request_budget.available(), 0)
+
+    def test_hourly_allowance_carries_over_between_runs(self):
+        """Requests of an earlier run in the same hour count, an hour later they don't."""
+        saved = {"hour_started": time.time() - 60, "spent": 8}
+        request_budget = RequestBudget(None, 10, {}, ["users"], saved)
+        self.assertEqual(spend(request_budget, "users"), 2)
+        self.assertEqual(request_budget.dump()["spent"], 10)
+
+        saved = {"hour_started": time.time() - 2 * 60 * 60, "spent": 10}
+        self.assertEqual(spend(RequestBudget(None, 10, {}, ["users"], saved), "users"), 10)
+
+    def test_spent_budget_checkpoints_at_window(self):
+        """A time-range stream out of budget stops before its next window and keeps its bookmark."""
+        output.configure({})
+        self.addCleanup(budget.configure, {}, {}, [])
+        start = datetime.now(pytz.utc) - timedelta(days=30)
+        config = {"start_date": start.isoformat(), "request_budget": 2}
+        budget.configure({}, config, ["requisitions"])
+
+        client = BudgetClient()
+        stream = RequisitionStream(config, {}, build_catalog_entry(RequisitionStream), client)
+        with patch("sys.stdout", io.StringIO()):
+            state = stream.sync()
+
+        self.assertEqual(client.requests, 2)
+        self.assertEqual(state["bookmarks"]["requisitions"]["last_record"],
+                         (start + timedelta(days=7)).strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+    def test_inline_children_spend_their_own_share(self):
+        """Opportunity children are charged to their own stream, and opportunities stop once they are out."""
+        output.configure({})
+        self.addCleanup(budget.configure, {}, {}, [])
+        start = datetime.now(pytz.utc) - timedelta(hours=12)
+
+        def list_opportunities(params):
+            offset = int(params.get("offset", 0))
+            opportunity = {"id": "opp-{}".format(offset), "updatedAt": int(start.timestamp() * 1000)}
+            return 200, {"data": [opportunity], "hasNext": True, "next": str(offset + 1)}
+
+        routes = {"/v1/opportunities": list_opportunities}
+        routes.update({"/v1/opportunities/opp-{}/offers".format(i): lambda params: (200, {"data": []})
+                       for i in range(5)})
+
+        with StubLeverServer(routes) as server, patch("sys.stdout", io.StringIO()):
+            config = {"token": "x", "base_url": server.base_url, "start_date": start.isoformat(),
+                      "request_budget": 10, "stream_weights": {"opportunity_offers": 0.25}}
+            budget.configure({}, config, ["opportunities", "opportunity_offers"])
+            stream = OpportunityStream(config, {}, build_catalog_entry(OpportunityStream), LeverClient(config))
+            state = stream.sync({"opportunity_offers": build_catalog_entry(OpportunityOffersStream)})
+
+        # Offers get 2 of the 10 requests, which they have spent after two pages
+        self.assertEqual(dict(budget.get_budget().spent), {"opportunities": 2, "opportunity_offers": 2})
+        self.assertEqual(state["bookmarks"]["opportunities"]["offset"], "2")
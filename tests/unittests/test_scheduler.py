@@ -0,0 +1,62 @@
+import threading
+import unittest
+
+from tap_lever.scheduler import build_pipelines
+from tap_lever.streams import cache as stream_cache
+
+
+class FakeParent:
+    TABLE = "candidates"
+    PARENT = None
+
+    def __init__(self, consumed):
+        self.consumed = consumed
+        self.state = None
+
+    def sync(self):
+        stream_cache.publish(self.TABLE, [{"id": "c1"}])
+        # The child has to pick up the first page before the parent goes on
+        if not self.consumed.wait(timeout=5):
+            raise AssertionError("child did not start while parent was paging")
+        stream_cache.publish(self.TABLE, [{"id": "c2"}, {"id": "c3"}])
+
+
+class FakeChild:
+    TABLE = "candidate_offers"
+    PARENT = "candidates"
+
+    def __init__(self, consumed):
+        self.consumed = consumed
+        self.parent_channel = None
+        self.state = None
+        self.seen = []
+
+    def sync(self):
+        for record in self.parent_channel:
+            self.seen.append(record["id"])
+            self.consumed.set()
+
+
+class TestPipelines(unittest.TestCase):
+    def test_children_are_grouped_under_their_parent(self):
+        """Pipelines follow PARENT declarations, not list order."""
+        consumed = threading.Event()
+        child, parent = FakeChild(consumed), FakeParent(consumed)
+
+        pipelines = build_pipelines([child, parent], {"candidates": {"x": None}})
+
+        self.assertEqual(len(pipelines), 1)
+        self.assertIs(pipelines[0].root, parent)
+        self.assertEqual(pipelines[0].children, [child])
+        self.assertEqual(pipelines[0].tables, ["candidates", "x", "candidate_offers"])
+
+    def test_children_consume_while_parent_is_paging(self):
+        """Pipelined children read parent records from a channel as they are emitted."""
+        consumed = threading.Event()
+        child, parent = FakeChild(consumed), FakeParent(consumed)
+        pipeline = build_pipelines([parent, child], {})[0]
+
+        pipeline.sync({}, pipelined=True, buffer_size=1)
+
+        self.assertEqual(child.seen, ["c1", "c2", "c3"])
+        self.assertEqual(stream_cache.CHANNELS, {})
@@ -0,0 +1,91 @@
+import contextvars
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from tap_lever import output, tracing
+from tap_lever.client import LeverClient
+from tap_lever.streams import OpportunityStream
+from tap_lever.streams.applications import OpportunityApplicationsStream
+
+from helpers import build_catalog_entry
+from stub_server import StubLeverServer
+
+
+class TestTracing(unittest.TestCase):
+    def setUp(self):
+        output.configure({})
+        self.trace_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.trace_dir.cleanup)
+        self.addCleanup(tracing.close)
+        self.path = os.path.join(self.trace_dir.name, "trace.json")
+
+    def load_spans(self):
+        with open(self.path) as handle:
+            events = json.load(handle)
+        return [event for event in events if event["ph"] == "X"], events
+
+    def test_sync_spans_nest_from_stream_to_request(self):
+        """Requests sit under child fetches, which sit under pages, windows and the stream."""
+        start = datetime.now(pytz.utc) - timedelta(hours=12)
+        opportunities = [{"id": "opp-0", "updatedAt": int(start.timestamp() * 1000), "applications": ["a"]}]
+        routes = {
+            "/v1/opportunities": lambda params: (200, {"data": opportunities, "hasNext": False}),
+            "/v1/opportunities/opp-0/applications": lambda params: (200, {"data": [{"id": "a"}], "hasNext": False}),
+        }
+
+        tracing.configure({"trace_file": self.path})
+        with StubLeverServer(routes) as server, patch("sys.stdout", io.StringIO()):
+            config = {"token": "x", "start_date": start.isoformat(), "base_url": server.base_url}
+            stream = OpportunityStream(config, {}, build_catalog_entry(OpportunityStream), LeverClient(config))
+            stream.sync({"opportunity_applications": build_catalog_entry(OpportunityApplicationsStream)})
+        tracing.close()
+
+        spans, _ = self.load_spans()
+        by_id = {span["args"]["span_id"]: span for span in spans}
+
+        def ancestors(span):
+            names = []
+            while span["args"]["parent_id"] is not None:
+                span = by_id[span["args"]["parent_id"]]
+                names.append(span["name"])
+            return names
+
+        child_request = next(span for span in spans if span["name"] == "http"
+                             and span["args"]["endpoint"] == "/v1/opportunities/{id}/applications")
+        self.assertEqual(ancestors(child_request),
+                         ["make_request", "child", "page", "window", "sync"])
+        self.assertEqual(child_request["args"]["status"], 200)
+        self.assertIn("save_state", {span["name"] for span in spans})
+        self.assertIn("transform", {span["name"] for span in spans})
+
+    def test_spans_on_other_threads_are_linked_to_their_parent(self):
+        """A span started from another thread records its parent and a flow arrow."""
+        tracing.configure({"trace_file": self.path})
+
+        with tracing.span("outer"):
+            thread = threading.Thread(target=contextvars.copy_context().run, args=(self.inner,))
+            thread.start()
+            thread.join()
+        tracing.close()
+
+        spans, events = self.load_spans()
+        outer = next(span for span in spans if span["name"] == "outer")
+        inner = next(span for span in spans if span["name"] == "inner")
+
+        self.assertEqual(inner["args"]["parent_id"], outer["args"]["span_id"])
+        self.assertNotEqual(inner["tid"], outer["tid"])
+        flows = [event for event in events if event["ph"] in ("s", "f")]
+        self.assertEqual([(event["ph"], event["tid"]) for event in flows],
+                         [("s", outer["tid"]), ("f", inner["tid"])])
+
+    def inner(self):
+        with tracing.span("inner"):
+            pass
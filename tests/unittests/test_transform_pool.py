@@ -0,0 +1,60 @@
+import unittest
+
+import singer
+
+from tap_lever import transform
+from tap_lever.streams import OpportunityStream
+
+from helpers import build_catalog_entry
+
+
+def make_page(start, size, next_offset=None):
+    return {
+        "data": [{"id": "opp-{}".format(i), "name": "Candidate {}".format(i),
+                  "createdAt": 1600000000000 + i, "tags": ["python"]}
+                 for i in range(start, start + size)],
+        "next": next_offset,
+    }
+
+
+class TestTransformPool(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        catalog = build_catalog_entry(OpportunityStream)
+        cls.projection = transform.build_projection(catalog)
+        cls.pool = transform.TransformPool(2, {"opportunities": cls.projection})
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.shutdown()
+
+    def serial(self, page):
+        transformer = singer.Transformer(singer.UNIX_MILLISECONDS_INTEGER_DATETIME_PARSING)
+        return transform.transform_records(page["data"], self.projection, transformer)
+
+    def test_pages_come_back_transformed_in_order(self):
+        """Pooled pages match the in-process transform and keep their order,
+        small pages included."""
+        pages = [make_page(i * 50, 50, str(i + 1)) for i in range(6)] + [make_page(300, 3)]
+        transformer = singer.Transformer(singer.UNIX_MILLISECONDS_INTEGER_DATETIME_PARSING)
+
+        results = list(self.pool.map_pages("opportunities", iter(pages), lambda records: None, transformer))
+
+        self.assertEqual([result for result, _ in results], pages)
+        self.assertEqual([data for _, data in results], [self.serial(page) for page in pages])
+        self.assertEqual(results[0][1][0]["createdAt"], "2020-09-13T12:26:40.000000Z")
+
+    def test_pages_read_before_an_error_are_handed_out(self):
+        """A failing request doesn't drop the pages already read ahead."""
+        def pages():
+            yield make_page(0, 25, "1")
+            yield make_page(25, 25, "2")
+            raise RuntimeError("offset expired")
+
+        transformer = singer.Transformer(singer.UNIX_MILLISECONDS_INTEGER_DATETIME_PARSING)
+        seen = []
+        with self.assertRaises(RuntimeError):
+            for result, _ in self.pool.map_pages("opportunities", pages(), lambda records: None, transformer):
+                seen.append(result["next"])
+
+        self.assertEqual(seen, ["1", "2"])
@@ -0,0 +1,106 @@
+import io
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from tap_lever import LeverTap, deadline, output, tuning
+from tap_lever.client import LeverClient
+from tap_lever.streams import OpportunityStream
+from tap_lever.tuning import TuningProfile
+
+from helpers import build_catalog_entry
+from stub_server import StubLeverServer
+
+
+class TestTuningProfile(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(output.configure, {})
+        self.addCleanup(deadline.configure, {})
+        self.addCleanup(tuning.configure, {}, {}, None)
+
+    def test_next_run_uses_the_learned_window_size(self):
+        """Density observed in one run sets the window size of the next."""
+        def requisitions(params):
+            return 200, {"data": [{"id": "req-{}-{}".format(params["created_at_start"], i)}
+                                  for i in range(10)], "hasNext": False}
+
+        start = datetime.now(pytz.utc) - timedelta(days=13)
+        with StubLeverServer({"/v1/requisitions": requisitions}) as server, patch("sys.stdout", io.StringIO()):
+            config = {"token": "x", "start_date": start.isoformat(), "base_url": server.base_url,
+                      "self_tuning": True, "tuning_window_records": 5}
+            tap = LeverTap(config)
+            self.assertEqual(len(list(tap.records(["requisitions"]))), 20)
+            first_run = len(server.requests)
+
+            records = LeverTap(config, state=tap.state).records(["requisitions"])
+            next(records)
+            records.close()
+            windows = [int(params["created_at_end"]) - int(params["created_at_start"])
+                       for path, params in server.requests[first_run:]]
+
+        profile = tap.state["tuning"]
+        self.assertAlmostEqual(profile["density"]["requisitions"]["records_per_day"], 20 / 13, places=2)
+        # 5 records at that density, in whole hours
+        self.assertEqual(profile["windows"]["requisitions"], 78 * 3600)
+        self.assertEqual(windows[0], 78 * 3600 * 1000)
+        self.assertEqual(profile["request_rate"]["throttled"], None)
+
+    def test_pending_offset_keeps_its_window_size(self):
+        """A cursor saved for a 1-day window is resumed with that window, not the tuned size."""
+        start = (datetime.now(pytz.utc) - timedelta(days=1, hours=12)).replace(microsecond=0)
+        state = {
+            "bookmarks": {"opportunities": {
+                "last_record": start.strftime("%Y-%m-%dT%H:%M:%SZ"), "offset": "tok-1",
+                "offset_window": start.isoformat(),
+                "offset_window_end": (start + timedelta(days=1)).isoformat(),
+            }},
+            "tuning": {"windows": {"opportunities": 12 * 3600}},
+        }
+        catalog = build_catalog_entry(OpportunityStream)
+
+        route = lambda params: (200, {"data": [], "hasNext": False})
+        with StubLeverServer({"/v1/opportunities": route}) as server, patch("sys.stdout", io.StringIO()):
+            config = {"token": "x", "base_url": server.base_url, "self_tuning": True}
+            client = LeverClient(config)
+            tuning.configure(state, config, client)
+            OpportunityStream(config, state, catalog, client).sync()
+
+        params = [params for path, params in server.requests]
+        self.assertEqual(params[0]["offset"], "tok-1")
+        self.assertEqual(int(params[0]["updated_at_end"]) - int(params[0]["updated_at_start"]),
+                         24 * 3600 * 1000)
+
+    def test_client_starts_from_the_profile(self):
+        """Saved latencies size timeouts right away, and a throttled rate is probed one step above the safe one."""
+        client = LeverClient({"token": "x"})
+        saved = {
+            "latency": {"/v1/opportunities": {"p50": 0.2, "p95": 1.0, "p99": 2.5}},
+            "request_rate": {"safe": 7, "throttled": 9},
+        }
+        profile = TuningProfile(client, saved)
+        profile.seed_client()
+
+        self.assertEqual(client.get_timeout("/v1/opportunities"), 10)
+        self.assertEqual(client.rate_limiter.rate, 8)
+
+        # A clean run at the probed rate raises the safe rate
+        for _ in range(8):
+            client.request_rate.record(200, now=100.5)
+        self.assertEqual(profile.dump()["request_rate"], {"safe": 8, "throttled": 9})
+
+        # Reaching the throttled rate without a 429 drops the limit
+        client.request_rate.record(200, now=100.6)
+        self.assertEqual(profile.dump()["request_rate"], {"safe": 9, "throttled": None})
+
+    def test_rate_limit_is_learned_from_seconds_with_429s(self):
+        """A 429 marks the rate of its second, not the requests in flight."""
+        client = LeverClient({"token": "x"})
+        for status in [200] * 9 + [429]:
+            client.request_rate.record(status, now=10.0)
+        for status in [200] * 6:
+            client.request_rate.record(status, now=11.0)
+
+        profile = TuningProfile(client).dump()["request_rate"]
+        self.assertEqual(profile, {"safe": 6, "throttled": 10})
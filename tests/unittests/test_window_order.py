@@ -0,0 +1,95 @@
+import io
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import pytz
+
+from tap_lever import deadline, output
+from tap_lever.streams import OpportunityStream, RequisitionStream
+
+from helpers import build_catalog_entry
+
+
+class WindowClient:
+    """Records the start of every window requested and stops the sync after
+    `stop_after` requests."""
+
+    def __init__(self, stop_after=None):
+        self.starts = []
+        self.stop_after = stop_after
+
+    def make_request(self, url, method, params=None):
+        self.starts.append(int(params["created_at_start"]))
+        if len(self.starts) == self.stop_after:
+            deadline.request_stop("Reached max_runtime")
+        return {"data": []}
+
+
+class TestNewestFirst(unittest.TestCase):
+    def setUp(self):
+        output.configure({})
+        self.addCleanup(deadline.configure, {})
+        self.start = datetime.now(pytz.utc) - timedelta(days=21, hours=12)
+        self.config = {"start_date": self.start.isoformat(), "window_order": "newest_first"}
+
+    def window(self, index):
+        return int((self.start + timedelta(days=7 * index)).timestamp() * 1000)
+
+    def sync(self, state, client):
+        deadline.configure({})
+        stream = RequisitionStream(self.config, state, build_catalog_entry(RequisitionStream), client)
+        with patch("sys.stdout", io.StringIO()):
+            stream.sync()
+        return stream.state
+
+    def test_recent_window_first_then_backfill(self):
+        """Windows run newest first, and an interrupted run leaves completed ranges
+        the next run skips."""
+        client = WindowClient(stop_after=2)
+        state = self.sync({}, client)
+
+        self.assertEqual(client.starts, [self.window(3), self.window(2)])
+        bookmark = state["bookmarks"]["requisitions"]
+        self.assertNotIn("last_record", bookmark)
+        self.assertEqual(len(bookmark["completed_ranges"]), 1)
+
+        client = WindowClient()
+        state = self.sync(state, client)
+
+        # The newest window is open-ended, so it's always synced again
+        self.assertEqual(client.starts, [self.window(3), self.window(1), self.window(0)])
+        bookmark = state["bookmarks"]["requisitions"]
+        self.assertNotIn("completed_ranges", bookmark)
+        self.assertEqual(bookmark["last_record"],
+                         (self.start + timedelta(days=21)).strftime("%Y-%m-%dT%H:%M:%SZ"))
+
+    def test_oldest_first_is_the_default(self):
+        """Without window_order windows are still walked forward."""
+        del self.config["window_order"]
+        client = WindowClient()
+        self.sync({}, client)
+
+        self.assertEqual(client.starts, [self.window(i) for i in range(4)])
+
+    def test_offset_only_resumes_its_own_window(self):
+        """A bookmarked offset is only used for the window it was saved in."""
+        class OpportunityClient:
+            def __init__(self):
+                self.params = []
+
+            def make_request(self, url, method, params=None):
+                self.params.append(dict(params))
+                return {"data": []}
+
+        offset_window = (self.start + timedelta(days=1)).isoformat()
+        state = {"bookmarks": {"opportunities": {"offset": "tok-2", "offset_window": offset_window}}}
+        self.config["start_date"] = (self.start + timedelta(days=20)).isoformat()
+        client = OpportunityClient()
+
+        stream = OpportunityStream(self.config, state, build_catalog_entry(OpportunityStream), client)
+        with patch("sys.stdout", io.StringIO()):
+            stream.sync({})
+
+        self.assertTrue(all("offset" not in params for params in client.params))
+        self.assertNotIn("offset", stream.state["bookmarks"]["opportunities"])